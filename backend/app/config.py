@@ -40,10 +40,61 @@ class Settings(BaseSettings):
     # Firebase Admin SDK service account
     FIREBASE_CREDENTIALS_FILE: str | None = None
 
+    # Response cache (memory | redis | none); redis needs the optional `redis` package
+    CACHE_BACKEND: str = "memory"
+    CACHE_REDIS_URL: str | None = None
+    CACHE_MAX_ENTRIES: int = 512
+    CACHE_DEFAULT_TTL_SECONDS: int = 60
+    STATS_CACHE_TTL_SECONDS: int = 60
+    # Authenticated user principal cache (0 disables); shared when CACHE_BACKEND=redis
+    AUTH_CACHE_TTL_SECONDS: int = 30
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+
+    # Socket.IO fan-out between workers: redis://… | amqp://… | memory (in-process, for tests) | empty (single worker)
+    SOCKETIO_MESSAGE_QUEUE: str | None = None
+    SOCKETIO_CHANNEL: str = "farah-socketio"
+    # Online presence (memory | redis); redis falls back to SOCKETIO_MESSAGE_QUEUE when it is a redis URL
+    PRESENCE_BACKEND: str = "memory"
+    PRESENCE_REDIS_URL: str | None = None
+    # Redis presence: socket entries expire after PRESENCE_TTL_SECONDS unless renewed
+    # by their worker every PRESENCE_HEARTBEAT_SECONDS (crashed workers drop out)
+    PRESENCE_TTL_SECONDS: int = 90
+    PRESENCE_HEARTBEAT_SECONDS: int = 30
+    # Per-socket cache of authorized chat rooms; reassignments invalidate it on every worker, the TTL is a fallback
+    SOCKET_ROOM_CACHE_TTL_SECONDS: int = 60
+
+    # Chat write-behind: messages are persisted with insert_many every N ms or M messages
+    CHAT_WRITE_BATCH_MS: int = 20
+    CHAT_WRITE_BATCH_SIZE: int = 100
+    # Raw WebSocket fan-out: per-connection send queue size and slow-consumer policy (drop_oldest | disconnect)
+    WS_SEND_QUEUE_SIZE: int = 100
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"
+    # Read receipts are coalesced and written at most once per room per interval
+    READ_RECEIPT_FLUSH_SECONDS: float = 1.0
+
+    # Realtime (Socket.IO/WebSocket) logging: debug | production; empty -> debug when APP_DEBUG
+    REALTIME_LOG_MODE: str | None = None
+    REALTIME_LOG_SAMPLE_RATE: float = 0.01
+    REALTIME_METRICS_INTERVAL_SECONDS: int = 60
+
+    # Offline chat delivery: one push per offline recipient per window, replay page size on reconnect
+    CHAT_PUSH_WINDOW_SECONDS: float = 30.0
+    CHAT_REPLAY_PAGE_SIZE: int = 200
+
+    # Chat image uploads are streamed to storage; larger files are rejected with 413
+    CHAT_IMAGE_MAX_BYTES: int = 10 * 1024 * 1024
+
     class Config:
         env_file = ".env"
         case_sensitive = False
 
+    @property
+    def realtime_debug(self) -> bool:
+        """Verbose per-event realtime logs (and socketio/engineio logs)."""
+        if self.REALTIME_LOG_MODE:
+            return self.REALTIME_LOG_MODE.lower() == "debug"
+        return self.APP_DEBUG
+
     @property
     def cors_origins(self) -> List[str]:
         """Return CORS origins as a list, parsing comma-separated env string."""
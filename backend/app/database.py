@@ -20,15 +20,21 @@ async def init_db() -> None:
         Doctor,
         Patient,
         Appointment,
+        SlotReservation,
         TreatmentNote,
         GalleryImage,
         ChatRoom,
         ChatMessage,
+        ChatDeliveryCursor,
         DeviceToken,
         Notification,
         OTPRequest,
         AssignmentLog,
         DoctorWorkingHours,
+        ScheduleException,
+        SlotAvailability,
+        DailyStats,
+        JobLock,
     )
     await init_beanie(
         database=_mongo_client[db_name],
@@ -37,15 +43,21 @@ async def init_db() -> None:
             Doctor,
             Patient,
             Appointment,
+            SlotReservation,
             TreatmentNote,
             GalleryImage,
             ChatRoom,
             ChatMessage,
+            ChatDeliveryCursor,
             DeviceToken,
             Notification,
             OTPRequest,
             AssignmentLog,
             DoctorWorkingHours,
+            ScheduleException,
+            SlotAvailability,
+            DailyStats,
+            JobLock,
         ],
     )
 
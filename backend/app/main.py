@@ -88,6 +88,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routers
@@ -115,6 +116,7 @@ print("   ✅ Chat router registered")
 app.include_router(stats_router.router)
 print("   ✅ Stats router registered")
 app.include_router(doctor_working_hours_router.router)
+app.include_router(doctor_working_hours_router.availability_router)
 print("   ✅ Doctor Working Hours router registered")
 print("✅ [STARTUP] All routers registered successfully!")
 print(f"   📍 Auth endpoints available at: /auth/*")
@@ -264,6 +266,9 @@ async def on_startup():
     import socket
     from apscheduler.schedulers.asyncio import AsyncIOScheduler
     from app.services.appointment_reminder_service import check_and_send_reminders
+    from app.services.stats_rollup_service import roll_up_pending_days
+    from app.utils.realtime_log import realtime_log
+    from app.services.socket_broker import get_presence
     
     global scheduler
     
@@ -304,9 +309,38 @@ async def on_startup():
             id="appointment_reminders",
             replace_existing=True
         )
+        # Roll up finished days into DailyStats shortly after midnight (UTC)
+        scheduler.add_job(
+            roll_up_pending_days,
+            trigger="cron",
+            hour=0,
+            minute=5,
+            timezone="UTC",
+            id="daily_stats_rollup",
+            replace_existing=True
+        )
+        # Renew this worker's sockets in shared presence (no-op for memory presence)
+        if (settings.PRESENCE_BACKEND or "memory").lower() == "redis":
+            scheduler.add_job(
+                get_presence().heartbeat,
+                trigger="interval",
+                seconds=settings.PRESENCE_HEARTBEAT_SECONDS,
+                id="presence_heartbeat",
+                replace_existing=True
+            )
+        # Realtime counters (connects/sec, messages/sec, emit latency)
+        if settings.REALTIME_METRICS_INTERVAL_SECONDS > 0:
+            scheduler.add_job(
+                realtime_log.report,
+                trigger="interval",
+                seconds=settings.REALTIME_METRICS_INTERVAL_SECONDS,
+                id="realtime_metrics",
+                replace_existing=True
+            )
         scheduler.start()
         logger.info("Appointment reminder scheduler started")
         print("✅ [STARTUP] Appointment reminder scheduler started (runs every hour)")
+        print("✅ [STARTUP] Daily stats rollup scheduled (runs daily at 00:05 UTC)")
     except Exception as e:
         logger.error(f"Failed to start appointment reminder scheduler: {e}")
         print(f"⚠️ [STARTUP] Failed to start appointment reminder scheduler: {e}")
@@ -318,6 +352,13 @@ async def on_startup():
 @app.on_event("shutdown")
 async def on_shutdown():
     global scheduler
+    # حفظ رسائل الدردشة المتبقية في مخزن الكتابة المؤجلة
+    from app.services.chat_engine import engine as chat_engine
+    from app.services.read_receipts import read_receipts
+    from app.services.offline_delivery import offline_delivery
+    await chat_engine.close()
+    await read_receipts.flush_all()
+    await offline_delivery.flush_all()
     if scheduler:
         try:
             scheduler.shutdown()
@@ -2,11 +2,13 @@
 from .user import User
 from .doctor import Doctor
 from .patient import Patient
-from .appointment import Appointment
+from .appointment import Appointment, SlotReservation
 from .note import TreatmentNote
 from .media import GalleryImage
-from .chat import ChatRoom, ChatMessage
+from .chat import ChatRoom, ChatMessage, ChatDeliveryCursor
 from .notification import DeviceToken, Notification
 from .otp import OTPRequest
 from .assignment import AssignmentLog
-from .doctor_working_hours import DoctorWorkingHours
+from .doctor_working_hours import DoctorWorkingHours, ScheduleException, SlotAvailability
+from .daily_stats import DailyStats
+from .job_lock import JobLock
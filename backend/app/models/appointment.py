@@ -3,6 +3,7 @@ from beanie import PydanticObjectId as OID
 from pydantic import Field
 from datetime import datetime, timezone
 from typing import List
+from pymongo import IndexModel, ASCENDING
 
 class Appointment(Document):
     """موعد مريض لدى طبيب."""
@@ -19,3 +20,21 @@ class Appointment(Document):
 
     class Settings:
         name = "appointments"
+
+
+class SlotReservation(Document):
+    """حجز خانة موعد: وثيقة واحدة لكل (طبيب، بداية خانة) بفهرس فريد.
+    الحجز عملية إدراج واحدة تنجح أو تفشل (DuplicateKey)، فلا يمكن حجز
+    الخانة مرتين حتى مع الطلبات المتزامنة؛ الإلغاء والحذف يحذفان الحجز.
+    """
+    doctor_id: OID
+    slot_start: datetime
+    appointment_id: OID | None = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    class Settings:
+        name = "slot_reservations"
+        indexes = [
+            IndexModel([("doctor_id", ASCENDING), ("slot_start", ASCENDING)], unique=True),
+            IndexModel([("appointment_id", ASCENDING)]),
+        ]
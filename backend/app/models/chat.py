@@ -1,16 +1,46 @@
 from beanie import Document, Indexed
 from beanie import PydanticObjectId as OID
 from pydantic import Field
+from pymongo import IndexModel, ASCENDING, DESCENDING
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Dict, Optional
 
 class ChatRoom(Document):
-    """غرفة محادثة واحدة لكل زوج (طبيب، مريض)."""
+    """غرفة محادثة واحدة لكل زوج (طبيب، مريض).
+    - ملخص مكرر (آخر رسالة، بيانات المشاركين، عدادات غير المقروء) يُحدَّث
+      عبر chat_service عند كل رسالة/قراءة حتى تُبنى /chat/list باستعلام واحد.
+    """
     doctor_id: Indexed(OID)
     patient_id: Indexed(OID)
 
+    # بيانات المشاركين للعرض
+    patient_user_id: OID | None = None
+    doctor_user_id: OID | None = None
+    patient_name: Optional[str] = None
+    patient_image_url: Optional[str] = None
+    doctor_name: Optional[str] = None
+    doctor_image_url: Optional[str] = None
+
+    # آخر رسالة
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
+
+    # عدد الرسائل غير المقروءة لكل طرف
+    unread_by_doctor: int = 0
+    unread_by_patient: int = 0
+
+    # غرف المرضى المحذوفين تُخفى من القوائم
+    archived: bool = False
+
     class Settings:
         name = "chat_rooms"
+        indexes = [
+            IndexModel([("patient_id", ASCENDING), ("doctor_id", ASCENDING)]),
+            IndexModel([("doctor_id", ASCENDING), ("last_message_at", DESCENDING)]),
+            IndexModel([("patient_id", ASCENDING), ("last_message_at", DESCENDING)]),
+            IndexModel([("patient_user_id", ASCENDING)]),
+            IndexModel([("doctor_user_id", ASCENDING)]),
+        ]
 
 class ChatMessage(Document):
     """رسالة دردشة محفوظة."""
@@ -18,8 +48,29 @@ class ChatMessage(Document):
     sender_user_id: Indexed(OID) | None = None
     content: str
     imageUrl: Optional[str] = None
+    # مصغّرات WebP للصورة: {"160": url, "480": url}
+    thumbnails: Optional[Dict[str, str]] = None
     is_read: bool = False
     created_at: Indexed(datetime) = Field(default_factory=lambda: datetime.now(timezone.utc))
 
     class Settings:
         name = "chat_messages"
+        indexes = [
+            # keyset pagination للتاريخ: (room_id, created_at, _id) تنازلياً
+            IndexModel([("room_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        ]
+
+class ChatDeliveryCursor(Document):
+    """موضع آخر رسالة سُلِّمت للمستخدم (created_at, _id) عبر Socket.IO.
+    - يُثبَّت عند انقطاع آخر socket للمستخدم، ويتقدم مع كل دفعة إعادة إرسال عند
+      الاتصال من جديد؛ ما بعده هو ما فاته وهو غير متصل.
+    - replay_pending: بقيت رسائل فائتة لم تُرسل بعد (لا يُقدَّم الموضع عند الانقطاع).
+    """
+    user_id: Indexed(OID, unique=True)
+    delivered_until: datetime
+    last_message_id: OID | None = None
+    replay_pending: bool = False
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    class Settings:
+        name = "chat_delivery_cursors"
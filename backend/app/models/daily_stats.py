@@ -0,0 +1,31 @@
+from beanie import Document
+from beanie import PydanticObjectId as OID
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING
+from datetime import datetime, timezone
+from typing import Dict
+
+
+class DailyStats(Document):
+    """عدادات يومية مجمّعة لكل طبيب (rollup) تُستخدم للإجابة على استعلامات الإحصائيات.
+    - day: بداية اليوم بتوقيت UTC.
+    - doctor_id=None: ما لا يُنسب لطبيب (مرضى جدد، صور، إشعارات)، ويُكتب لكل يوم
+      مُجمَّع حتى لو كانت قيمه صفراً ليُعرف مدى التغطية.
+    """
+    day: datetime
+    doctor_id: OID | None = None
+    new_patients: int = 0
+    appointments: int = 0
+    appointments_by_status: Dict[str, int] = Field(default_factory=dict)
+    notes: int = 0
+    images: int = 0
+    messages: int = 0
+    notifications: int = 0
+    transfers: int = 0
+    computed_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    class Settings:
+        name = "daily_stats"
+        indexes = [
+            IndexModel([("day", ASCENDING), ("doctor_id", ASCENDING)], unique=True),
+        ]
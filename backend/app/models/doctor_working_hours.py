@@ -1,8 +1,26 @@
+import re
+from bisect import bisect_right
+
 from beanie import Document, Indexed
 from beanie import PydanticObjectId as OID
 from pydantic import Field, field_validator
 from datetime import datetime, timezone
-from typing import Optional
+from typing import List, Optional
+from pymongo import IndexModel, ASCENDING
+
+
+def _check_time_format(v: str) -> str:
+    if not re.match(r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', v):
+        raise ValueError('Time must be in HH:MM format')
+    return v
+
+
+def _check_slot_duration(v: int) -> int:
+    if v < 15 or v > 120:
+        raise ValueError('slot_duration must be between 15 and 120 minutes')
+    if v % 15 != 0:
+        raise ValueError('slot_duration must be a multiple of 15 minutes')
+    return v
 
 
 class DoctorWorkingHours(Document):
@@ -26,19 +44,12 @@ class DoctorWorkingHours(Document):
     @field_validator('start_time', 'end_time')
     @classmethod
     def validate_time_format(cls, v: str) -> str:
-        import re
-        if not re.match(r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', v):
-            raise ValueError('Time must be in HH:MM format')
-        return v
+        return _check_time_format(v)
 
     @field_validator('slot_duration')
     @classmethod
     def validate_slot_duration(cls, v: int) -> int:
-        if v < 15 or v > 120:
-            raise ValueError('slot_duration must be between 15 and 120 minutes')
-        if v % 15 != 0:
-            raise ValueError('slot_duration must be a multiple of 15 minutes')
-        return v
+        return _check_slot_duration(v)
 
     def model_post_init(self, __context) -> None:
         """Validate that start_time is before end_time."""
@@ -53,6 +64,104 @@ class DoctorWorkingHours(Document):
     class Settings:
         name = "doctor_working_hours"
         indexes = [
-            [("doctor_id", 1), ("day_of_week", 1)],  # Unique compound index
+            IndexModel([("doctor_id", ASCENDING), ("day_of_week", ASCENDING)], unique=True),
         ]
 
+
+
+class ScheduleException(Document):
+    """استثناء من قالب الأسبوع لأيام محددة [start_date, end_date] (ضمناً):
+    - closed: الطبيب لا يعمل (عطلة، إجازة).
+    - custom_hours: ساعات مختلفة تحل محل ساعات القالب في هذه الأيام.
+    - extra_shift: فترة إضافية فوق ساعات اليوم (مثلاً مناوبة مسائية).
+    الفهرس (doctor_id, start_date, end_date) يجعل جلب كل ما يتقاطع مع أي مدى
+    استعلاماً واحداً: start_date <= آخر يوم و end_date >= أول يوم.
+    """
+    doctor_id: OID
+    kind: str  # closed | custom_hours | extra_shift
+    start_date: datetime  # منتصف الليل UTC
+    end_date: datetime  # منتصف الليل UTC (ضمناً)
+    start_time: Optional[str] = None  # HH:MM (custom_hours / extra_shift)
+    end_time: Optional[str] = None
+    slot_duration: int = 30
+    reason: Optional[str] = None
+    created_by: Optional[OID] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @field_validator('kind')
+    @classmethod
+    def validate_kind(cls, v: str) -> str:
+        if v not in SCHEDULE_EXCEPTION_KINDS:
+            raise ValueError(f"kind must be one of: {', '.join(SCHEDULE_EXCEPTION_KINDS)}")
+        return v
+
+    @field_validator('start_time', 'end_time')
+    @classmethod
+    def validate_time_format(cls, v: Optional[str]) -> Optional[str]:
+        if v is None:
+            return v
+        return _check_time_format(v)
+
+    @field_validator('slot_duration')
+    @classmethod
+    def validate_slot_duration(cls, v: int) -> int:
+        return _check_slot_duration(v)
+
+    def model_post_init(self, __context) -> None:
+        if self.end_date < self.start_date:
+            raise ValueError('end_date must not be before start_date')
+        if self.kind == "closed":
+            return
+        if not self.start_time or not self.end_time:
+            raise ValueError(f'start_time and end_time are required for {self.kind}')
+        start_hours, start_minutes = self.start_time.split(':')
+        end_hours, end_minutes = self.end_time.split(':')
+        if int(start_hours) * 60 + int(start_minutes) >= int(end_hours) * 60 + int(end_minutes):
+            raise ValueError('start_time must be before end_time')
+
+    class Settings:
+        name = "schedule_exceptions"
+        indexes = [
+            IndexModel([("doctor_id", ASCENDING), ("start_date", ASCENDING), ("end_date", ASCENDING)]),
+        ]
+
+
+SCHEDULE_EXCEPTION_KINDS = ("closed", "custom_hours", "extra_shift")
+
+
+class SlotAvailability(Document):
+    """فهرس الإتاحة: خانات يوم واحد لطبيب واحد مشتقة من DoctorWorkingHours
+    و ScheduleException.
+    - الخانة i تبدأ عند starts[i] وتنتهي عند ends[i] (بالدقائق من منتصف الليل UTC)،
+      و booked[i] عدد المواعيد الفعالة فيها (0 = متاحة). الخانات مرتبة ولا تتداخل.
+    - يوم بلا عمل يُخزَّن بقوائم فارغة حتى لا يُعاد بناؤه.
+    - يُحدَّث تدريجياً عند إنشاء/إلغاء المواعيد (slot_index) ويُحذف عند تغيير أوقات
+      العمل أو الاستثناءات.
+    """
+    doctor_id: OID
+    day: datetime  # منتصف الليل UTC
+    starts: List[int] = Field(default_factory=list)
+    ends: List[int] = Field(default_factory=list)
+    booked: List[int] = Field(default_factory=list)
+    built_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def slot_of(self, minute_of_day: int) -> Optional[int]:
+        """رقم الخانة التي تقع فيها الدقيقة (أو None خارج ساعات العمل)."""
+        index = bisect_right(self.starts, minute_of_day) - 1
+        if index < 0 or minute_of_day >= self.ends[index]:
+            return None
+        return index
+
+    def free_times(self) -> List[str]:
+        """الخانات المتاحة بصيغة HH:MM."""
+        return [
+            f"{minute // 60:02d}:{minute % 60:02d}"
+            for minute, count in zip(self.starts, self.booked)
+            if count <= 0
+        ]
+
+    class Settings:
+        name = "slot_availability"
+        indexes = [
+            IndexModel([("doctor_id", ASCENDING), ("day", ASCENDING)], unique=True),
+        ]
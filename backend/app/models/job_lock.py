@@ -0,0 +1,19 @@
+from beanie import Document
+from pymongo import IndexModel, ASCENDING
+from datetime import datetime
+
+
+class JobLock(Document):
+    """قفل بمهلة لمهمة مجدولة حتى يشغّلها worker واحد فقط.
+    - name: اسم المهمة (فريد).
+    - expires_at: بعده يُعتبر القفل متاحاً (إن توقف الـ worker قبل تحريره).
+    """
+    name: str
+    owner: str
+    expires_at: datetime
+
+    class Settings:
+        name = "job_locks"
+        indexes = [
+            IndexModel([("name", ASCENDING)], unique=True),
+        ]
@@ -9,9 +9,15 @@ from app.services.admin_service import (
     create_patient,
 )
 from app.services.patient_service import update_patient_by_admin, delete_patient
-from app.models import Patient, Doctor
 from app.services import patient_service
+from app.services.identity_service import resolve_appointment_identities
 from app.schemas import AppointmentOut, NoteOut, GalleryOut
+from app.schemas import DoctorScheduleIn, DoctorScheduleOut
+from app.routers.doctor_working_hours import (
+    working_hours_service,
+    working_hours_payload,
+    working_hours_out,
+)
 from datetime import datetime, timezone
 
 router = APIRouter(
@@ -137,45 +143,22 @@ async def delete_patient_admin(patient_id: str):
 async def admin_patient_appointments(patient_id: str):
     primary, secondary = await patient_service.list_patient_appointments_grouped(patient_id=patient_id)
     all_apps = primary + secondary
-    # Need to build AppointmentOut manually with patient_name and doctor_name
-    from app.models import User
-    import asyncio
-    
-    async def build_appointment_out(a):
-        patient_name = None
-        try:
-            apt_patient = await Patient.get(a.patient_id)
-            if apt_patient:
-                user = await User.get(apt_patient.user_id)
-                if user:
-                    patient_name = user.name
-        except Exception:
-            pass
-        
-        doctor_name = None
-        try:
-            doctor = await Doctor.get(a.doctor_id)
-            if doctor:
-                user = await User.get(doctor.user_id)
-                if user:
-                    doctor_name = user.name
-        except Exception:
-            pass
-        
-        return AppointmentOut(
+    identities = await resolve_appointment_identities(all_apps)
+    return [
+        AppointmentOut(
             id=str(a.id),
             patient_id=str(a.patient_id),
-            patient_name=patient_name,
+            patient_name=identities.patient_name(a.patient_id),
             doctor_id=str(a.doctor_id),
-            doctor_name=doctor_name,
+            doctor_name=identities.doctor_name(a.doctor_id),
             scheduled_at=a.scheduled_at.isoformat(),
             note=a.note,
             image_path=a.image_path,
             image_paths=a.image_paths or [],
             status=a.status,
         )
-    
-    return await asyncio.gather(*[build_appointment_out(a) for a in all_apps])
+        for a in all_apps
+    ]
 
 @router.get("/patients/{patient_id}/notes", response_model=list[NoteOut])
 async def admin_patient_notes(patient_id: str):
@@ -201,3 +184,26 @@ async def admin_patient_gallery(patient_id: str):
             # Skip this image if there's an error
             continue
     return result
+
+
+@router.put("/working-hours", response_model=list[DoctorScheduleOut])
+async def admin_set_working_hours(schedules: List[DoctorScheduleIn]):
+    """استبدال جداول عدة أطباء دفعة واحدة (bulk upsert واحد لكل الطلب)."""
+    if len({s.doctor_id for s in schedules}) != len(schedules):
+        raise HTTPException(status_code=400, detail="Duplicate doctor_id in request")
+    try:
+        result = await working_hours_service.set_working_hours_bulk({
+            s.doctor_id: [working_hours_payload(wh) for wh in s.working_hours]
+            for s in schedules
+        })
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [
+        DoctorScheduleOut(
+            doctor_id=doctor_id,
+            working_hours=[working_hours_out(wh) for wh in hours],
+        )
+        for doctor_id, hours in result.items()
+    ]
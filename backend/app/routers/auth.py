@@ -12,6 +12,8 @@ from app.services.auth_service import (
     staff_login_with_password,
 )
 from app.services.admin_service import create_patient
+from app.services import chat_service
+from app.services.auth_cache import invalidate_principal
 from app.security import create_access_token
 from fastapi import HTTPException
 from app.utils.r2_clinic import upload_clinic_image
@@ -206,6 +208,8 @@ async def route_update_me(
     current: User = Depends(get_current_user),
 ):
     """تحديث معلومات المستخدم الحالي."""
+    # current من كاش المصادقة (بدون password_hash)؛ نعدّل النسخة الكاملة من القاعدة
+    current = await User.get(current.id)
     if name is not None:
         current.name = name
     if phone is not None:
@@ -219,6 +223,8 @@ async def route_update_me(
     
     current.updated_at = datetime.now(timezone.utc)
     await current.save()
+    await invalidate_principal(current.id)
+    await chat_service.refresh_participant_profile(current)
     
     return UserOut(
         id=str(current.id),
@@ -263,9 +269,13 @@ async def route_upload_profile_image(
         key = image_path.replace("r2-disabled://", "")
         image_path = f"/media/{key}"
     
+    # current من كاش المصادقة (بدون password_hash)؛ نعدّل النسخة الكاملة من القاعدة
+    current = await User.get(current.id)
     current.imageUrl = image_path
     current.updated_at = datetime.now(timezone.utc)
     await current.save()
+    await invalidate_principal(current.id)
+    await chat_service.refresh_participant_profile(current)
     
     return UserOut(
         id=str(current.id),
@@ -1,137 +1,88 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, UploadFile, File, Form
 from datetime import datetime, timezone
 from beanie import PydanticObjectId as OID
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Dict, Optional
 
+from app.config import get_settings
 from app.security import get_current_user
 from app.schemas import ChatMessageOut, ChatMessageIn, ChatListItemOut
-from app.models import ChatRoom, ChatMessage, Patient, User, Doctor
+from app.models import ChatRoom, ChatMessage, Patient, User
 from app.constants import Role
-from app.utils.r2_clinic import upload_clinic_image
+from app.utils.r2_clinic import upload_clinic_image_stream, create_thumbnails
+from app.services import chat_engine, chat_service
+from app.services.loader_service import RequestLoaders, get_loaders
+from app.utils.cursor import encode_cursor, decode_cursor
 
 router = APIRouter(prefix="/chat", tags=["chat"]) 
+settings = get_settings()
 
-async def _get_or_room_for_user(*, patient_id: str, user: User) -> ChatRoom:
+MAX_MESSAGES_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def _public_url(image_path: str) -> str:
+    """تحويل r2-disabled:// إلى URL عام."""
+    if image_path.startswith("r2-disabled://"):
+        return f"/media/{image_path.replace('r2-disabled://', '')}"
+    return image_path
+
+async def _get_or_room_for_user(*, patient_id: str, user: User, loaders: RequestLoaders) -> ChatRoom:
     """الحصول على أو إنشاء غرفة محادثة بين الطبيب والمريض."""
-    # التحقق من وجود المريض
     try:
-        patient = await Patient.get(OID(patient_id))
-    except Exception:
-        patient = None
-    
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    
-    # التحقق من الصلاحيات وإنشاء/الحصول على الغرفة
-    if user.role == Role.DOCTOR:
-        # الطبيب يمكنه المحادثة مع المرضى المعينين له فقط
-        doctor = await Doctor.find_one(Doctor.user_id == user.id)
-        if not doctor:
-            raise HTTPException(status_code=403, detail="Doctor profile not found")
-        
-        # التحقق من أن الطبيب معين للمريض (أساسي أو ثانوي)
-        if doctor.id not in patient.doctor_ids:
-            raise HTTPException(status_code=403, detail="Doctor not assigned to this patient")
-        
-        # البحث عن غرفة محادثة أو إنشاء واحدة جديدة
-        room = await ChatRoom.find_one(
-            ChatRoom.patient_id == patient.id,
-            ChatRoom.doctor_id == doctor.id
-        )
-        if not room:
-            room = ChatRoom(
-                patient_id=patient.id,
-                doctor_id=doctor.id
-            )
-            await room.insert()
-        return room
-    
-    elif user.role == Role.PATIENT:
-        # المريض يمكنه المحادثة مع طبيبه المعين فقط
-        # التحقق من أن المستخدم هو نفس المريض
-        if patient.user_id != user.id:
-            raise HTTPException(status_code=403, detail="Forbidden")
-        
-        # استخدام الطبيب الأساسي أو الثانوي
-        if not patient.doctor_ids:
-            raise HTTPException(status_code=403, detail="No doctor assigned to this patient")
-        doctor_id = patient.doctor_ids[0]
-        if not doctor_id:
-            raise HTTPException(status_code=403, detail="No doctor assigned to this patient")
-        
-        # البحث عن غرفة محادثة أو إنشاء واحدة جديدة
-        room = await ChatRoom.find_one(
-            ChatRoom.patient_id == patient.id,
-            ChatRoom.doctor_id == doctor_id
-        )
-        if not room:
-            room = ChatRoom(
-                patient_id=patient.id,
-                doctor_id=doctor_id
-            )
-            await room.insert()
-        return room
-    
-    else:
-        raise HTTPException(status_code=403, detail="Forbidden")
+        return await chat_engine.resolve_room(user=user, patient_id=patient_id, loaders=loaders)
+    except chat_engine.ChatAccessError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+def _chat_list_item(room: ChatRoom, *, patient_id: str, name: str | None, image_url: str | None,
+                    unread_count: int) -> ChatListItemOut:
+    return ChatListItemOut(
+        patient_id=patient_id,
+        patient_name=name or "",
+        patient_image_url=image_url,
+        last_message=room.last_message_preview,
+        last_message_time=room.last_message_at.isoformat() if room.last_message_at else None,
+        unread_count=unread_count,
+        room_id=str(room.id)
+    )
+
+async def _list_rooms(*conditions) -> list[ChatRoom]:
+    """غرف المستخدم مرتبة حسب آخر رسالة (استعلام واحد على الفهرس)، مع ترحيل الغرف القديمة."""
+    rooms = await ChatRoom.find(*conditions, ChatRoom.archived != True).sort(
+        -ChatRoom.last_message_at
+    ).to_list()
+    legacy = [room for room in rooms if room.patient_user_id is None]
+    if not legacy:
+        return rooms
+    for room in legacy:
+        await chat_service.rebuild_room_summary(room)
+    rooms = [room for room in rooms if not room.archived]
+    rooms.sort(key=lambda r: r.last_message_at.isoformat() if r.last_message_at else "", reverse=True)
+    return rooms
 
 @router.get("/list", response_model=list[ChatListItemOut])
-async def get_chat_list(current: User = Depends(get_current_user)):
-    """جلب قائمة المحادثات للطبيب أو المريض مع آخر رسالة وعدد الرسائل غير المقروءة."""
+async def get_chat_list(
+    current: User = Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
+):
+    """جلب قائمة المحادثات للطبيب أو المريض مع آخر رسالة وعدد الرسائل غير المقروءة.
+    تُقرأ من ملخص الغرف (ChatRoom) دون جلب المرضى أو الرسائل.
+    """
     if current.role == Role.DOCTOR:
-        doctor = await Doctor.find_one(Doctor.user_id == current.id)
+        doctor = await loaders.doctors_by_user.load(current.id)
         if not doctor:
             raise HTTPException(status_code=403, detail="Doctor profile not found")
         
-        # جلب جميع غرف المحادثة للطبيب
-        rooms = await ChatRoom.find(ChatRoom.doctor_id == doctor.id).to_list()
-        
-        result = []
-        for room in rooms:
-            # جلب معلومات المريض
-            patient = await Patient.get(room.patient_id)
-            if not patient:
-                continue
-            
-            patient_user = await User.get(patient.user_id)
-            if not patient_user:
-                continue
-            
-            # جلب آخر رسالة
-            last_messages = await ChatMessage.find(
-                ChatMessage.room_id == room.id
-            ).sort(-ChatMessage.created_at).limit(1).to_list()
-            last_message = last_messages[0] if last_messages else None
-            
-            # جلب عدد الرسائل غير المقروءة (التي أرسلها المريض ولم يقرأها الطبيب)
-            unread_count = await ChatMessage.find(
-                ChatMessage.room_id == room.id,
-                ChatMessage.sender_user_id == patient.user_id,
-                ChatMessage.is_read == False
-            ).count()
-            
-            last_message_text = None
-            last_message_time = None
-            if last_message:
-                if last_message.imageUrl:
-                    last_message_text = "صورة"
-                else:
-                    last_message_text = last_message.content
-                last_message_time = last_message.created_at.isoformat()
-            
-            result.append(ChatListItemOut(
-                patient_id=str(patient.id),
-                patient_name=patient_user.name or patient.phone,
-                patient_image_url=patient_user.imageUrl,
-                last_message=last_message_text,
-                last_message_time=last_message_time,
-                unread_count=unread_count,
-                room_id=str(room.id)
-            ))
-        
-        # ترتيب حسب آخر رسالة
-        result.sort(key=lambda x: x.last_message_time or "", reverse=True)
-        return result
+        rooms = await _list_rooms(ChatRoom.doctor_id == doctor.id)
+        return [
+            _chat_list_item(
+                room,
+                patient_id=str(room.patient_id),
+                name=room.patient_name,
+                image_url=room.patient_image_url,
+                unread_count=room.unread_by_doctor,
+            )
+            for room in rooms
+        ]
     
     elif current.role == Role.PATIENT:
         # جلب معلومات المريض
@@ -139,80 +90,73 @@ async def get_chat_list(current: User = Depends(get_current_user)):
         if not patient:
             raise HTTPException(status_code=404, detail="Patient not found")
         
-        # جلب جميع غرف المحادثة للمريض
-        rooms = await ChatRoom.find(ChatRoom.patient_id == patient.id).to_list()
-        
-        result = []
-        for room in rooms:
-            # جلب معلومات الطبيب
-            doctor = await Doctor.get(room.doctor_id)
-            if not doctor:
-                continue
-            
-            doctor_user = await User.get(doctor.user_id)
-            if not doctor_user:
-                continue
-            
-            # جلب آخر رسالة
-            last_messages = await ChatMessage.find(
-                ChatMessage.room_id == room.id
-            ).sort(-ChatMessage.created_at).limit(1).to_list()
-            last_message = last_messages[0] if last_messages else None
-            
-            # جلب عدد الرسائل غير المقروءة (التي أرسلها الطبيب ولم يقرأها المريض)
-            unread_count = await ChatMessage.find(
-                ChatMessage.room_id == room.id,
-                ChatMessage.sender_user_id == doctor.user_id,
-                ChatMessage.is_read == False
-            ).count()
-            
-            last_message_text = None
-            last_message_time = None
-            if last_message:
-                if last_message.imageUrl:
-                    last_message_text = "صورة"
-                else:
-                    last_message_text = last_message.content
-                last_message_time = last_message.created_at.isoformat()
-            
-            result.append(ChatListItemOut(
+        rooms = await _list_rooms(ChatRoom.patient_id == patient.id)
+        return [
+            _chat_list_item(
+                room,
                 patient_id=str(patient.id),
-                patient_name=doctor_user.name or doctor.phone,
-                patient_image_url=doctor_user.imageUrl,
-                last_message=last_message_text,
-                last_message_time=last_message_time,
-                unread_count=unread_count,
-                room_id=str(room.id)
-            ))
-        
-        # ترتيب حسب آخر رسالة
-        result.sort(key=lambda x: x.last_message_time or "", reverse=True)
-        return result
+                name=room.doctor_name,
+                image_url=room.doctor_image_url,
+                unread_count=room.unread_by_patient,
+            )
+            for room in rooms
+            if room.doctor_name is not None
+        ]
     
     else:
         raise HTTPException(status_code=403, detail="Forbidden")
 
+class _MessageRow(BaseModel):
+    """إسقاط (projection) الحقول المستخدمة في ChatMessageOut فقط."""
+    id: OID = Field(alias="_id")
+    room_id: OID
+    sender_user_id: Optional[OID] = None
+    content: str = ""
+    imageUrl: Optional[str] = None
+    thumbnails: Optional[Dict[str, str]] = None
+    is_read: bool = False
+    created_at: datetime
+
 @router.get("/{patient_id}/messages", response_model=list[ChatMessageOut])
 async def get_messages(
     patient_id: str, 
-    limit: int = 50, 
-    before: str | None = Query(None), 
-    current: User = Depends(get_current_user)
+    response: Response,
+    limit: int = Query(50, ge=1, le=MAX_MESSAGES_PAGE_SIZE),
+    cursor: str | None = Query(None, description="قيمة X-Next-Cursor من الصفحة السابقة"),
+    before: str | None = Query(None, description="(قديم) ISO timestamp؛ يُفضّل cursor"),
+    current: User = Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
-    """استرجاع تاريخ الرسائل (أحدث أولاً) مع دعم before/limit."""
-    room = await _get_or_room_for_user(patient_id=patient_id, user=current)
+    """استرجاع تاريخ الرسائل (أحدث أولاً) بترقيم keyset على (created_at, _id).
+    - إذا امتلأت الصفحة يُعاد موضع الصفحة التالية في الترويسة X-Next-Cursor.
+    """
+    room = await _get_or_room_for_user(patient_id=patient_id, user=current, loaders=loaders)
     
     # بناء الاستعلام
     query = ChatMessage.find(ChatMessage.room_id == room.id)
     
-    if before:
+    if cursor:
+        try:
+            created_at, last_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.find({"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}},
+        ]})
+    elif before:
         try:
             dt = datetime.fromisoformat(before.replace('Z', '+00:00'))
-            query = query.find(ChatMessage.created_at < dt)
-        except Exception:
-            pass
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid 'before' timestamp")
+        query = query.find(ChatMessage.created_at < dt)
     
-    messages = await query.sort(-ChatMessage.created_at).limit(limit).to_list()
+    messages = await query.sort(
+        -ChatMessage.created_at, -ChatMessage.id
+    ).limit(limit).project(_MessageRow).to_list()
+    
+    if len(messages) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(messages[-1].created_at, messages[-1].id)
     
     return [
         ChatMessageOut(
@@ -221,6 +165,7 @@ async def get_messages(
             sender_user_id=str(msg.sender_user_id) if msg.sender_user_id else None,
             content=msg.content,
             imageUrl=msg.imageUrl,
+            thumbnails=msg.thumbnails,
             is_read=msg.is_read,
             created_at=msg.created_at.isoformat()
         )
@@ -232,10 +177,11 @@ async def send_message(
     patient_id: str,
     content: Optional[str] = Form(None),
     image: Optional[UploadFile] = File(None),
-    current: User = Depends(get_current_user)
+    current: User = Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
     """إرسال رسالة جديدة (نصية أو مع صورة)."""
-    room = await _get_or_room_for_user(patient_id=patient_id, user=current)
+    room = await _get_or_room_for_user(patient_id=patient_id, user=current, loaders=loaders)
     
     # التحقق من وجود محتوى (نص أو صورة)
     if not content and not image:
@@ -243,51 +189,34 @@ async def send_message(
     
     # رفع الصورة إذا كانت موجودة
     image_url = None
+    thumbnails = None
     if image:
         if image.content_type not in ("image/jpeg", "image/png", "image/webp"):
             raise HTTPException(status_code=400, detail="نوع الملف غير مدعوم. فقط JPEG, PNG, WEBP")
         
-        file_bytes = await image.read()
-        # استخدام room_id كمعرف فريد لصورة الرسالة
-        image_path = await upload_clinic_image(
+        # كتابة متدفقة على قطع (بدون تحميل الملف كاملاً في الذاكرة)؛ room_id كمجلد صور المحادثة
+        image_path, _ = await upload_clinic_image_stream(
             patient_id=str(room.id),
             folder="chat_images",
-            file_bytes=file_bytes,
+            upload=image,
             content_type=image.content_type,
+            max_bytes=settings.CHAT_IMAGE_MAX_BYTES,
         )
-        
-        # تحويل r2-disabled:// إلى URL عام
-        if image_path.startswith("r2-disabled://"):
-            key = image_path.replace("r2-disabled://", "")
-            image_url = f"/media/{key}"
-        else:
-            image_url = image_path
+        image_url = _public_url(image_path)
+        # مصغّرات WebP (في thread pool) لعرض المحادثة دون تحميل الصورة الأصلية
+        thumbnails = {
+            size: _public_url(path)
+            for size, path in (await create_thumbnails(image_path)).items()
+        }
     
-    # إنشاء الرسالة
-    message = ChatMessage(
-        room_id=room.id,
+    # حفظ الرسالة (ضمن دفعة) وبثها عبر محرك المحادثة
+    message = await chat_engine.engine.send(
+        room=room,
         sender_user_id=current.id,
         content=content or "",
-        imageUrl=image_url,
-        is_read=False
+        image_url=image_url,
+        thumbnails=thumbnails,
     )
-    await message.insert()
-    
-    # إرسال الرسالة عبر Socket.IO إذا كان متاحاً
-    try:
-        from app.services.socket_service import emit_message_to_room
-        await emit_message_to_room(str(room.id), {
-            "id": str(message.id),
-            "room_id": str(message.room_id),
-            "sender_user_id": str(message.sender_user_id) if message.sender_user_id else None,
-            "content": message.content,
-            "imageUrl": message.imageUrl,
-            "is_read": message.is_read,
-            "created_at": message.created_at.isoformat()
-        })
-    except Exception as e:
-        # لا نفشل الطلب إذا فشل Socket.IO
-        print(f"⚠️ Failed to emit message via Socket.IO: {e}")
     
     return ChatMessageOut(
         id=str(message.id),
@@ -295,6 +224,7 @@ async def send_message(
         sender_user_id=str(message.sender_user_id) if message.sender_user_id else None,
         content=message.content,
         imageUrl=message.imageUrl,
+        thumbnails=message.thumbnails,
         is_read=message.is_read,
         created_at=message.created_at.isoformat()
     )
@@ -303,10 +233,11 @@ async def send_message(
 async def mark_message_as_read(
     patient_id: str,
     message_id: str,
-    current: User = Depends(get_current_user)
+    current: User = Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
     """تعليم رسالة كمقروءة."""
-    room = await _get_or_room_for_user(patient_id=patient_id, user=current)
+    room = await _get_or_room_for_user(patient_id=patient_id, user=current, loaders=loaders)
     
     try:
         message = await ChatMessage.get(OID(message_id))
@@ -317,9 +248,8 @@ async def mark_message_as_read(
     if message.room_id != room.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    # تحديث حالة القراءة
-    message.is_read = True
-    await message.save()
+    # تحديث حالة القراءة وعداد غير المقروء في الغرفة
+    await chat_service.mark_message_read(room, message)
     
     return ChatMessageOut(
         id=str(message.id),
@@ -327,6 +257,7 @@ async def mark_message_as_read(
         sender_user_id=str(message.sender_user_id) if message.sender_user_id else None,
         content=message.content,
         imageUrl=message.imageUrl,
+        thumbnails=message.thumbnails,
         is_read=message.is_read,
         created_at=message.created_at.isoformat()
     )
@@ -1,24 +1,11 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 from beanie import PydanticObjectId as OID
 
-from app.constants import Role
-from app.services.chat_service import ConnectionManager
-from app.models import ChatRoom, ChatMessage, Patient, User, Doctor
+from app.services import chat_engine
+from app.services.auth_cache import decode_access_token, get_principal
 
 router = APIRouter(prefix="/ws", tags=["chat"])
-manager = ConnectionManager()
-
-async def _ensure_room(*, patient_id: OID, doctor_id: OID) -> ChatRoom:
-    """الحصول على أو إنشاء غرفة محادثة بين الطبيب والمريض."""
-    room = await ChatRoom.find_one(
-        ChatRoom.patient_id == patient_id,
-        ChatRoom.doctor_id == doctor_id
-    )
-    if room:
-        return room
-    room = ChatRoom(patient_id=patient_id, doctor_id=doctor_id)
-    await room.insert()
-    return room
+manager = chat_engine.ws_manager
 
 @router.websocket("/chat/{patient_id}")
 async def chat_ws(websocket: WebSocket, patient_id: str, token: str = Query("")):
@@ -27,25 +14,19 @@ async def chat_ws(websocket: WebSocket, patient_id: str, token: str = Query(""))
     - يتحقق من أن الطبيب مرتبط بالمريض أو أن المستخدم هو نفس المريض.
     """
     # Authenticate
-    from jose import jwt, JWTError
-    from app.config import get_settings
-
-    settings = get_settings()
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+        payload = decode_access_token(token)
         user_id_str = payload.get("sub")
         if not user_id_str:
             await websocket.close(code=4401)
             return
         user_id = OID(user_id_str)
-        role_val = payload.get("role")
-        role_str = str(role_val) if role_val else None
     except Exception:
         await websocket.close(code=4401)
         return
 
     try:
-        user = await User.get(user_id)
+        user = await get_principal(user_id)
     except Exception:
         user = None
     
@@ -53,66 +34,27 @@ async def chat_ws(websocket: WebSocket, patient_id: str, token: str = Query(""))
         await websocket.close(code=4401)
         return
 
-    # التحقق من وجود المريض
+    # التحقق من وجود المريض والصلاحية (طبيب معين أو المريض نفسه) والحصول على الغرفة
     try:
-        patient = await Patient.get(OID(patient_id))
-    except Exception:
-        patient = None
-    
-    if not patient:
-        await websocket.close(code=4404)
-        return
-
-    # Authorization: طبيب معين أو المريض نفسه
-    room = None
-    if role_str == Role.DOCTOR.value:
-        # الطبيب يمكنه المحادثة مع المرضى المعينين له فقط
-        doctor = await Doctor.find_one(Doctor.user_id == user.id)
-        if not doctor:
-            await websocket.close(code=4403, reason="Doctor profile not found")
-            return
-        
-        # التحقق من أن الطبيب معين للمريض (في doctor_ids)
-        if doctor.id not in patient.doctor_ids:
-            await websocket.close(code=4403, reason="Doctor not assigned to this patient")
-            return
-        
-        room = await _ensure_room(patient_id=patient.id, doctor_id=doctor.id)
-        room_key = f"room:{room.id}"
-    
-    elif role_str == Role.PATIENT.value:
-        # المريض يمكنه المحادثة مع طبيبه المعين فقط
-        # التحقق من أن المستخدم هو نفس المريض
-        if patient.user_id != user.id:
-            await websocket.close(code=4403)
-            return
-        
-        # استخدام أول طبيب في القائمة
-        if not patient.doctor_ids:
-            await websocket.close(code=4403, reason="No doctor assigned to this patient")
-            return
-        doctor_id = patient.doctor_ids[0]
-        
-        room = await _ensure_room(patient_id=patient.id, doctor_id=doctor_id)
-        room_key = f"room:{room.id}"
-    
-    else:
-        await websocket.close(code=4403)
+        room = await chat_engine.resolve_room(user=user, patient_id=patient_id)
+    except chat_engine.ChatAccessError as e:
+        await websocket.close(code=4000 + e.status_code, reason=e.detail)
         return
+    room_key = f"room:{room.id}"
 
     await manager.connect(room_key, websocket)
     try:
         while True:
             data = await websocket.receive_json()
+            if not isinstance(data, dict):
+                continue
             content = str(data.get("message", "")).strip()
             if not content:
                 continue
-            msg = ChatMessage(room_id=room.id, sender_user_id=user.id, content=content)
-            await msg.insert()
-            await manager.broadcast(room_key, {
-                "sender_id": str(user.id),
-                "message": content,
-                "room_id": str(room.id)
-            })
+            # الحفظ (ضمن دفعة) والبث لكل المتصلين بالغرفة يتمان في المحرك
+            await chat_engine.engine.send(room=room, sender_user_id=user.id, content=content)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # أي خروج من الحلقة (انقطاع، JSON غير صالح، فشل الحفظ) يزيل الاتصال ومهمة كتابته
         await manager.disconnect(room_key, websocket)
@@ -21,6 +21,7 @@ from app.services import patient_service
 from app.services.admin_service import create_patient
 from app.services.patient_service import assign_patient_doctors
 from app.services.auth_service import request_otp
+from app.services.loader_service import RequestLoaders, get_loaders
 from app.utils.r2_clinic import upload_clinic_image
 from app.models import Doctor, User, Patient
 from app.utils.logger import get_logger
@@ -34,11 +35,14 @@ MAX_IMAGE_MB = 10
 router = APIRouter(prefix="/doctor", tags=["doctor"], dependencies=[Depends(require_roles([Role.DOCTOR]))])
 
 
-async def _get_current_doctor_id(current) -> str:
+async def _get_current_doctor_id(current, loaders: Optional[RequestLoaders] = None) -> str:
     """
     Helper to resolve the Doctor document for the currently authenticated user.
     """
-    doctor = await Doctor.find_one(Doctor.user_id == current.id)
+    if loaders is not None:
+        doctor = await loaders.doctors_by_user.load(current.id)
+    else:
+        doctor = await Doctor.find_one(Doctor.user_id == current.id)
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor profile not found")
     return str(doctor.id)
@@ -140,23 +144,20 @@ async def my_patients(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
     current=Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
     """يعرض المرضى الخاصين بالطبيب (أساسي/ثانوي)."""
-    doctor_id = await _get_current_doctor_id(current)
+    doctor_id = await _get_current_doctor_id(current, loaders)
     patients = await patient_service.list_doctor_patients(
         doctor_id, skip=skip, limit=limit
     )
+    # مستخدمو كل المرضى في استعلام $in واحد
+    users = await loaders.users.load_many(p.user_id for p in patients)
     # Map to PatientOut combining user fields
     out: List[PatientOut] = []
-    for p in patients:
-        # جلب User مباشرة بدلاً من الاعتماد على p.user
-        try:
-            u = await User.get(p.user_id)
-            if not u:
-                print(f"⚠️ Warning: Patient {p.id} has no user (user_id: {p.user_id}), skipping...")
-                continue
-        except Exception as e:
-            print(f"❌ Error fetching user for patient {p.id}: {e}")
+    for p, u in zip(patients, users):
+        if not u:
+            print(f"⚠️ Warning: Patient {p.id} has no user (user_id: {p.user_id}), skipping...")
             continue
             
         out.append(PatientOut(
@@ -169,16 +170,21 @@ async def my_patients(
     return out
 
 @router.post("/patients/{patient_id}/treatment", response_model=PatientOut)
-async def set_treatment(patient_id: str, treatment_type: str = Query(...), current=Depends(get_current_user)):
+async def set_treatment(
+    patient_id: str,
+    treatment_type: str = Query(...),
+    current=Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
+):
     """تحديد نوع العلاج للمريض."""
-    doctor_id = await _get_current_doctor_id(current)
+    doctor_id = await _get_current_doctor_id(current, loaders)
     p = await patient_service.set_treatment_type(
         patient_id=patient_id,
         doctor_id=doctor_id,
         treatment_type=treatment_type,
     )
     # جلب User مباشرة بدلاً من الاعتماد على p.user
-    u = await User.get(p.user_id)
+    u = await loaders.users.load(p.user_id)
     if not u:
         raise HTTPException(status_code=404, detail="User not found")
     return PatientOut(
@@ -417,11 +423,13 @@ async def list_my_appointments(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
     current=Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
 ):
     """مواعيدي: اليوم/غدًا/الشهر أو نطاق (مع المتأخرون)."""
     df = datetime.fromisoformat(date_from) if date_from else None
     dt = datetime.fromisoformat(date_to) if date_to else None
-    doctor_id = await _get_current_doctor_id(current)
+    doctor_id = await _get_current_doctor_id(current, loaders)
+    loaders.users.prime(current.id, current)
     apps = await patient_service.list_appointments_for_doctor(
         doctor_id=doctor_id,
         day=day,
@@ -431,38 +439,19 @@ async def list_my_appointments(
         skip=skip,
         limit=limit,
     )
+    # أسماء المرضى والأطباء بثلاثة استعلامات $in بدل أربعة استعلامات لكل موعد
+    # (عبر loaders الطلب: الطبيب الحالي ومستخدمه محفوظان مسبقاً)
+    identities = await loaders.resolve_appointment_identities(apps)
     result = []
     for a in apps:
         try:
-            # جلب بيانات المريض
-            patient_name = None
-            try:
-                patient = await Patient.get(a.patient_id)
-                if patient:
-                    user = await User.get(patient.user_id)
-                    if user:
-                        patient_name = user.name
-            except Exception as e:
-                logger.warning(f"Could not fetch patient name for appointment {a.id}: {e}")
-            
-            # جلب بيانات الطبيب
-            doctor_name = None
-            try:
-                doctor = await Doctor.get(a.doctor_id)
-                if doctor:
-                    user = await User.get(doctor.user_id)
-                    if user:
-                        doctor_name = user.name
-            except Exception as e:
-                logger.warning(f"Could not fetch doctor name for appointment {a.id}: {e}")
-            
             result.append(
                 AppointmentOut(
                     id=str(a.id),
                     patient_id=str(a.patient_id),
-                    patient_name=patient_name,
+                    patient_name=identities.patient_name(a.patient_id),
                     doctor_id=str(a.doctor_id),
-                    doctor_name=doctor_name,
+                    doctor_name=identities.doctor_name(a.doctor_id),
                     scheduled_at=a.scheduled_at.isoformat() if a.scheduled_at else datetime.now(timezone.utc).isoformat(),
                     note=a.note,
                     image_path=a.image_path,
@@ -1,13 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Dict, List, Optional
 from datetime import datetime, timezone
 
 from app.routers.doctor import get_current_user
+from app.security import require_roles
+from app.constants import Role
 from app.services.doctor_working_hours_service import DoctorWorkingHoursService
-from app.schemas import WorkingHoursIn, WorkingHoursOut
-from app.models import User, Doctor
+from app.schemas import (
+    WorkingHoursIn,
+    WorkingHoursOut,
+    AvailabilityOpeningOut,
+    ScheduleExceptionIn,
+    ScheduleExceptionOut,
+)
+from app.models import User, Doctor, DoctorWorkingHours, ScheduleException
 
 router = APIRouter(prefix="/doctor", tags=["Doctor Working Hours"])
+# بحث الإتاحة عبر الأطباء (الاستقبال)
+availability_router = APIRouter(prefix="/working-hours", tags=["Doctor Working Hours"])
 working_hours_service = DoctorWorkingHoursService()
 
 
@@ -19,6 +29,70 @@ async def _get_current_doctor_id(current_user: User) -> str:
     return str(doctor.id)
 
 
+def working_hours_payload(wh: WorkingHoursIn) -> Dict:
+    """WorkingHoursIn -> الصيغة التي تستقبلها الخدمة."""
+    return {
+        "dayOfWeek": wh.day_of_week,
+        "startTime": wh.start_time,
+        "endTime": wh.end_time,
+        "isWorking": wh.is_working,
+        "slotDuration": wh.slot_duration,
+    }
+
+
+def working_hours_out(wh: DoctorWorkingHours) -> WorkingHoursOut:
+    return WorkingHoursOut(
+        id=str(wh.id),
+        doctor_id=str(wh.doctor_id),
+        day_of_week=wh.day_of_week,
+        start_time=wh.start_time,
+        end_time=wh.end_time,
+        is_working=wh.is_working,
+        slot_duration=wh.slot_duration,
+        created_at=wh.created_at.isoformat() if wh.created_at else datetime.now(timezone.utc).isoformat(),
+        updated_at=wh.updated_at.isoformat() if wh.updated_at else datetime.now(timezone.utc).isoformat(),
+    )
+
+
+def schedule_exception_payload(exception: ScheduleExceptionIn) -> Dict:
+    return {
+        "kind": exception.kind,
+        "startDate": exception.start_date,
+        "endDate": exception.end_date,
+        "startTime": exception.start_time,
+        "endTime": exception.end_time,
+        "slotDuration": exception.slot_duration,
+        "reason": exception.reason,
+    }
+
+
+def schedule_exception_out(exception: ScheduleException) -> ScheduleExceptionOut:
+    return ScheduleExceptionOut(
+        id=str(exception.id),
+        doctor_id=str(exception.doctor_id),
+        kind=exception.kind,
+        start_date=exception.start_date.date().isoformat(),
+        end_date=exception.end_date.date().isoformat(),
+        start_time=exception.start_time,
+        end_time=exception.end_time,
+        slot_duration=exception.slot_duration,
+        reason=exception.reason,
+        created_at=exception.created_at.isoformat(),
+    )
+
+
+async def _add_schedule_exception(doctor_id: str, exception: ScheduleExceptionIn, current: User) -> ScheduleExceptionOut:
+    try:
+        result = await working_hours_service.add_schedule_exception(
+            doctor_id=doctor_id, data=schedule_exception_payload(exception), created_by=current.id
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return schedule_exception_out(result)
+
+
 @router.post("/working-hours", response_model=List[WorkingHoursOut])
 async def set_working_hours(
     working_hours: List[WorkingHoursIn],
@@ -26,37 +100,14 @@ async def set_working_hours(
 ):
     """تحديد أوقات العمل للطبيب."""
     doctor_id = await _get_current_doctor_id(current)
-    
-    # Convert to dict format
-    working_hours_list = []
-    for wh in working_hours:
-        working_hours_list.append({
-            "dayOfWeek": wh.day_of_week,
-            "startTime": wh.start_time,
-            "endTime": wh.end_time,
-            "isWorking": wh.is_working,
-            "slotDuration": wh.slot_duration,
-        })
-    
     try:
         result = await working_hours_service.set_working_hours(
-            doctor_id=str(doctor_id), working_hours_list=working_hours_list
+            doctor_id=str(doctor_id),
+            working_hours_list=[working_hours_payload(wh) for wh in working_hours],
         )
-        
-        return [
-            WorkingHoursOut(
-                id=str(wh.id),
-                doctor_id=str(wh.doctor_id),
-                day_of_week=wh.day_of_week,
-                start_time=wh.start_time,
-                end_time=wh.end_time,
-                is_working=wh.is_working,
-                slot_duration=wh.slot_duration,
-                created_at=wh.created_at.isoformat() if wh.created_at else datetime.now(timezone.utc).isoformat(),
-                updated_at=wh.updated_at.isoformat() if wh.updated_at else datetime.now(timezone.utc).isoformat(),
-            )
-            for wh in result
-        ]
+        return [working_hours_out(wh) for wh in result]
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -68,20 +119,7 @@ async def get_working_hours(current=Depends(get_current_user)):
     """جلب أوقات عمل الطبيب."""
     doctor_id = await _get_current_doctor_id(current)
     result = await working_hours_service.get_doctor_working_hours(str(doctor_id))
-    return [
-        WorkingHoursOut(
-            id=str(wh.id),
-            doctor_id=str(wh.doctor_id),
-            day_of_week=wh.day_of_week,
-            start_time=wh.start_time,
-            end_time=wh.end_time,
-            is_working=wh.is_working,
-            slot_duration=wh.slot_duration,
-            created_at=wh.created_at.isoformat() if wh.created_at else datetime.now(timezone.utc).isoformat(),
-            updated_at=wh.updated_at.isoformat() if wh.updated_at else datetime.now(timezone.utc).isoformat(),
-        )
-        for wh in result
-    ]
+    return [working_hours_out(wh) for wh in result]
 
 
 @router.get("/available-slots/{date}", response_model=List[str])
@@ -97,6 +135,19 @@ async def get_available_slots(
     return result
 
 
+@router.get("/available-slots", response_model=Dict[str, List[str]])
+async def get_available_slots_range(
+    date_from: str = Query(..., description="YYYY-MM-DD"),
+    date_to: str = Query(..., description="YYYY-MM-DD (ضمناً)"),
+    current=Depends(get_current_user),
+):
+    """الأوقات المتاحة لكل يوم في مدى (أسبوع مثلاً)."""
+    doctor_id = await _get_current_doctor_id(current)
+    return await working_hours_service.get_available_slots_range(
+        doctor_id=str(doctor_id), date_from=date_from, date_to=date_to
+    )
+
+
 @router.delete("/working-hours", status_code=204)
 async def delete_working_hours(current=Depends(get_current_user)):
     """حذف جميع أوقات عمل الطبيب."""
@@ -104,3 +155,79 @@ async def delete_working_hours(current=Depends(get_current_user)):
     await working_hours_service.delete_working_hours(str(doctor_id))
     return None
 
+
+
+@router.post("/schedule-exceptions", response_model=ScheduleExceptionOut)
+async def add_schedule_exception(
+    exception: ScheduleExceptionIn,
+    current=Depends(get_current_user),
+):
+    """إضافة عطلة/إجازة أو ساعات مختلفة أو فترة إضافية لأيام محددة."""
+    doctor_id = await _get_current_doctor_id(current)
+    return await _add_schedule_exception(doctor_id, exception, current)
+
+
+@router.get("/schedule-exceptions", response_model=List[ScheduleExceptionOut])
+async def list_schedule_exceptions(
+    date_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="YYYY-MM-DD (ضمناً)"),
+    current=Depends(get_current_user),
+):
+    """استثناءات جدول الطبيب التي تتقاطع مع المدى."""
+    doctor_id = await _get_current_doctor_id(current)
+    result = await working_hours_service.list_schedule_exceptions(doctor_id, date_from, date_to)
+    return [schedule_exception_out(e) for e in result]
+
+
+@router.delete("/schedule-exceptions/{exception_id}", status_code=204)
+async def delete_schedule_exception(exception_id: str, current=Depends(get_current_user)):
+    """حذف استثناء."""
+    doctor_id = await _get_current_doctor_id(current)
+    await working_hours_service.delete_schedule_exception(doctor_id, exception_id)
+    return None
+
+
+@availability_router.get("/availability", response_model=List[AvailabilityOpeningOut])
+async def find_availability(
+    date_from: str = Query(..., alias="from", description="YYYY-MM-DD"),
+    date_to: str = Query(..., alias="to", description="YYYY-MM-DD (ضمناً)"),
+    doctor_ids: Optional[List[str]] = Query(None, description="معرفات الأطباء (مكررة أو مفصولة بفواصل)؛ فارغ = كل الأطباء"),
+    first_n: int = Query(10, ge=1, le=200),
+    current=Depends(require_roles([Role.RECEPTIONIST, Role.ADMIN, Role.DOCTOR])),
+):
+    """أقرب الأوقات المتاحة عبر عدة أطباء وأيام (بدل طلب لكل طبيب ولكل يوم)."""
+    ids = [i.strip() for value in (doctor_ids or []) for i in value.split(",") if i.strip()]
+    return await working_hours_service.find_openings(
+        doctor_ids=ids, date_from=date_from, date_to=date_to, first_n=first_n
+    )
+
+
+@availability_router.post("/{doctor_id}/exceptions", response_model=ScheduleExceptionOut)
+async def add_doctor_schedule_exception(
+    doctor_id: str,
+    exception: ScheduleExceptionIn,
+    current=Depends(require_roles([Role.RECEPTIONIST, Role.ADMIN])),
+):
+    """تسجيل عطلة/إجازة أو فترة إضافية لطبيب (الاستقبال)."""
+    return await _add_schedule_exception(doctor_id, exception, current)
+
+
+@availability_router.get("/{doctor_id}/exceptions", response_model=List[ScheduleExceptionOut])
+async def list_doctor_schedule_exceptions(
+    doctor_id: str,
+    date_from: Optional[str] = Query(None, alias="from", description="YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, alias="to", description="YYYY-MM-DD (ضمناً)"),
+    current=Depends(require_roles([Role.RECEPTIONIST, Role.ADMIN, Role.DOCTOR])),
+):
+    result = await working_hours_service.list_schedule_exceptions(doctor_id, date_from, date_to)
+    return [schedule_exception_out(e) for e in result]
+
+
+@availability_router.delete("/{doctor_id}/exceptions/{exception_id}", status_code=204)
+async def delete_doctor_schedule_exception(
+    doctor_id: str,
+    exception_id: str,
+    current=Depends(require_roles([Role.RECEPTIONIST, Role.ADMIN])),
+):
+    await working_hours_service.delete_schedule_exception(doctor_id, exception_id)
+    return None
@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from datetime import datetime, timezone
-import asyncio
 
 from app.schemas import PatientOut, PatientAppointmentsOut, AppointmentOut, NoteOut, GalleryOut, DoctorOut, PatientUpdate
 from app.security import require_roles, get_current_user
 from app.constants import Role
-from app.services import patient_service
-from app.models import Patient, Doctor, User
+from app.services import chat_service, patient_service
+from app.services.loader_service import RequestLoaders, get_loaders
+from app.services.auth_cache import invalidate_principal
+from app.models import Patient, User
 from app.utils.qrcode_gen import ensure_patient_qr
 from beanie import PydanticObjectId as OID
 
@@ -44,8 +45,8 @@ async def update_my_profile(data: PatientUpdate, current=Depends(get_current_use
     if not patient:
         raise HTTPException(status_code=404, detail="Patient profile not found")
     
-    # current is already the User object from get_current_user
-    u = current
+    # current is the cached principal (read-only); update the full user document
+    u = await User.get(current.id)
     
     # Update user fields
     if data.name is not None:
@@ -58,6 +59,8 @@ async def update_my_profile(data: PatientUpdate, current=Depends(get_current_use
         u.city = data.city
     
     await u.save()
+    await invalidate_principal(u.id)
+    await chat_service.refresh_participant_profile(u)
     
     # Return updated patient
     if patient and not patient.qr_code_data:
@@ -78,7 +81,10 @@ async def update_my_profile(data: PatientUpdate, current=Depends(get_current_use
     )
 
 @router.get("/doctor", response_model=DoctorOut)
-async def my_doctor(current=Depends(get_current_user)):
+async def my_doctor(
+    current=Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
+):
     """معلومات الطبيب المرتبط بالمريض (أول طبيب في القائمة)."""
     patient = await Patient.find_one(Patient.user_id == current.id)
     if not patient:
@@ -88,11 +94,11 @@ async def my_doctor(current=Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="No doctor assigned")
     
     # Return the first doctor in the list
-    doctor = await Doctor.get(patient.doctor_ids[0])
+    doctor = await loaders.doctors.load(patient.doctor_ids[0])
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
     
-    user = await User.get(doctor.user_id)
+    user = await loaders.users.load(doctor.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Doctor user not found")
     
@@ -105,47 +111,32 @@ async def my_doctor(current=Depends(get_current_user)):
     )
 
 @router.get("/appointments", response_model=PatientAppointmentsOut)
-async def my_appointments(current=Depends(get_current_user)):
+async def my_appointments(
+    current=Depends(get_current_user),
+    loaders: RequestLoaders = Depends(get_loaders),
+):
     """مواعيدي مقسّمة حسب الطبيب الأساسي والثانوي."""
     # الحصول على ملف المريض المرتبط بهذا المستخدم
     patient = await Patient.find_one(Patient.user_id == current.id)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient profile not found")
+    loaders.patients.prime(patient.id, patient)
+    loaders.users.prime(current.id, current)
 
     primary, secondary = await patient_service.list_patient_appointments_grouped(
         patient_id=str(patient.id)
     )
     
-    # تحويل المواعيد إلى AppointmentOut مع جلب patient_name و doctor_name
-    async def build_appointment_out(a):
-        # جلب بيانات المريض
-        patient_name = None
-        try:
-            apt_patient = await Patient.get(a.patient_id)
-            if apt_patient:
-                user = await User.get(apt_patient.user_id)
-                if user:
-                    patient_name = user.name
-        except Exception:
-            pass
-        
-        # جلب بيانات الطبيب
-        doctor_name = None
-        try:
-            doctor = await Doctor.get(a.doctor_id)
-            if doctor:
-                user = await User.get(doctor.user_id)
-                if user:
-                    doctor_name = user.name
-        except Exception:
-            pass
-        
+    # أسماء المرضى والأطباء لكل المواعيد دفعة واحدة
+    identities = await loaders.resolve_appointment_identities(primary + secondary)
+    
+    def build_appointment_out(a):
         return AppointmentOut(
             id=str(a.id),
             patient_id=str(a.patient_id),
-            patient_name=patient_name,
+            patient_name=identities.patient_name(a.patient_id),
             doctor_id=str(a.doctor_id),
-            doctor_name=doctor_name,
+            doctor_name=identities.doctor_name(a.doctor_id),
             scheduled_at=a.scheduled_at.isoformat(),
             note=a.note,
             image_path=a.image_path,
@@ -153,9 +144,8 @@ async def my_appointments(current=Depends(get_current_user)):
             status=a.status,
         )
     
-    # استخدام asyncio.gather لتنفيذ جميع العمليات بشكل متوازي
-    primary_out = await asyncio.gather(*[build_appointment_out(a) for a in primary])
-    secondary_out = await asyncio.gather(*[build_appointment_out(a) for a in secondary])
+    primary_out = [build_appointment_out(a) for a in primary]
+    secondary_out = [build_appointment_out(a) for a in secondary]
     
     return PatientAppointmentsOut(
         primary=primary_out,
@@ -10,6 +10,7 @@ from app.constants import Role
 from app.models import Patient, User
 from app.services import patient_service
 from app.services.admin_service import create_patient
+from app.services.identity_service import resolve_appointment_identities
 
 router = APIRouter(prefix="/reception", tags=["reception"], dependencies=[Depends(require_roles([Role.RECEPTIONIST, Role.ADMIN]))])
 
@@ -145,39 +146,12 @@ async def list_appointments(
         limit=limit,
     )
     # نحضر معلومات المرضى والأطباء المرتبطة بهذه المواعيد
-    from app.models import Patient, User, Doctor
-    from beanie.operators import In as BeanieIn
-
-    patient_ids = list({a.patient_id for a in apps})
-    doctor_ids = list({a.doctor_id for a in apps})
-
-    patients = (
-        await Patient.find(BeanieIn(Patient.id, patient_ids)).to_list()
-        if patient_ids
-        else []
-    )
-    doctors = (
-        await Doctor.find(BeanieIn(Doctor.id, doctor_ids)).to_list()
-        if doctor_ids
-        else []
-    )
-
-    user_ids = list({p.user_id for p in patients if p.user_id})
-    user_ids += [d.user_id for d in doctors if d.user_id]
-    user_ids = list(set(user_ids))
-
-    users = await User.find(BeanieIn(User.id, user_ids)).to_list() if user_ids else []
-    user_map = {u.id: u for u in users}
-
-    patient_map = {p.id: p for p in patients}
-    doctor_map = {d.id: d for d in doctors}
+    identities = await resolve_appointment_identities(apps)
 
     out: List[ReceptionAppointmentOut] = []
     for a in apps:
-        p = patient_map.get(a.patient_id)
-        d = doctor_map.get(a.doctor_id)
-        pu = user_map.get(p.user_id) if p else None
-        du = user_map.get(d.user_id) if d else None
+        pu = identities.patient_user(a.patient_id)
+        du = identities.doctor_user(a.doctor_id)
 
         out.append(
             ReceptionAppointmentOut(
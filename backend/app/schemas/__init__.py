@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, field_validator
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 from app.constants import Role
 
@@ -118,6 +118,51 @@ class WorkingHoursOut(BaseModel):
         from_attributes = True
 
 
+class DoctorScheduleIn(BaseModel):
+    """Full weekly schedule of one doctor (admin bulk replace)."""
+    doctor_id: str
+    working_hours: List[WorkingHoursIn]
+
+
+class DoctorScheduleOut(BaseModel):
+    """Saved weekly schedule of one doctor."""
+    doctor_id: str
+    working_hours: List[WorkingHoursOut]
+
+
+class ScheduleExceptionIn(BaseModel):
+    """Input schema for a date-specific schedule exception."""
+    kind: str = Field(..., description="closed | custom_hours | extra_shift")
+    start_date: str = Field(..., description="YYYY-MM-DD")
+    end_date: Optional[str] = Field(default=None, description="YYYY-MM-DD (inclusive); defaults to start_date")
+    start_time: Optional[str] = Field(default=None, pattern=r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', description="HH:MM (custom_hours / extra_shift)")
+    end_time: Optional[str] = Field(default=None, pattern=r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', description="HH:MM (custom_hours / extra_shift)")
+    slot_duration: int = Field(default=30, ge=15, le=120, description="Slot duration in minutes (must be multiple of 15)")
+    reason: Optional[str] = None
+
+
+class ScheduleExceptionOut(BaseModel):
+    """Output schema for a schedule exception."""
+    id: str
+    doctor_id: str
+    kind: str
+    start_date: str  # YYYY-MM-DD
+    end_date: str  # YYYY-MM-DD (inclusive)
+    start_time: Optional[str] = None
+    end_time: Optional[str] = None
+    slot_duration: int
+    reason: Optional[str] = None
+    created_at: str
+
+
+class AvailabilityOpeningOut(BaseModel):
+    """Output schema for an open appointment slot."""
+    doctor_id: str
+    date: str  # YYYY-MM-DD
+    time: str  # HH:MM
+    start: str  # ISO datetime (UTC)
+
+
 # -------------------- Appointments --------------------
 
 class AppointmentCreate(BaseModel):
@@ -240,6 +285,7 @@ class ChatMessageOut(BaseModel):
     sender_user_id: str | None
     content: str
     imageUrl: Optional[str] = None
+    thumbnails: Optional[Dict[str, str]] = None
     is_read: bool = False
     created_at: str
 
@@ -0,0 +1,38 @@
+"""
+Rebuild the denormalized chat room summaries (participants, last message,
+unread counters) from users and chat_messages.
+
+Run with:
+
+    python -m app.scripts.backfill_chat_rooms
+
+Safe to re-run; rooms that were never summarized are also rebuilt lazily
+the first time they appear in /chat/list.
+"""
+import asyncio
+import sys
+
+# Fix encoding for Windows console
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
+from app.database import init_db
+from app.models import ChatRoom
+from app.services.chat_service import rebuild_room_summary
+
+
+async def main() -> None:
+    await init_db()
+    print("\n=== Rebuilding chat room summaries ===")
+    total = 0
+    async for room in ChatRoom.find():
+        await rebuild_room_summary(room)
+        total += 1
+        if total % 100 == 0:
+            print(f"     {total} room(s)...")
+    print(f"[OK] Rebuilt {total} room(s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
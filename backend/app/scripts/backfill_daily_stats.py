@@ -0,0 +1,48 @@
+"""
+Backfill the DailyStats rollup collection from the raw collections.
+
+Run with:
+
+    python -m app.scripts.backfill_daily_stats
+    python -m app.scripts.backfill_daily_stats --from 2025-01-01 --to 2025-12-31
+
+Only finished days (before today, UTC) are rolled up; existing rollups in
+the range are recomputed and replaced.
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+
+# Fix encoding for Windows console
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
+from app.database import init_db
+from app.services.stats_rollup_service import backfill, get_coverage
+
+
+def _parse_day(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+async def main(date_from: str | None, date_to: str | None) -> None:
+    await init_db()
+    print("\n=== Backfilling daily stats ===")
+    end = _parse_day(date_to)
+    days = await backfill(_parse_day(date_from), end + timedelta(days=1) if end else None)
+    covered_from, covered_until = await get_coverage()
+    print(f"[OK] Rolled up {days} day(s)")
+    if covered_from:
+        print(f"     Coverage: {covered_from.date()} -> {covered_until.date()} (exclusive)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill DailyStats rollups")
+    parser.add_argument("--from", dest="date_from", help="First day (YYYY-MM-DD); defaults to earliest activity")
+    parser.add_argument("--to", dest="date_to", help="Last day, inclusive (YYYY-MM-DD); defaults to yesterday")
+    args = parser.parse_args()
+    asyncio.run(main(args.date_from, args.date_to))
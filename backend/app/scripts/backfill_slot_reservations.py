@@ -0,0 +1,53 @@
+"""
+Create slot reservations for existing upcoming appointments.
+
+Appointments booked before slot_reservations existed hold no reservation, so
+a new booking could still land on their slot. Run once after upgrading:
+
+    python -m app.scripts.backfill_slot_reservations
+
+Safe to re-run; appointments that already hold a reservation are skipped, and
+slots that are already double-booked are reported (the first one keeps it).
+"""
+import asyncio
+import sys
+from datetime import datetime, timezone
+
+# Fix encoding for Windows console
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
+from beanie.operators import In
+from fastapi import HTTPException
+
+from app.database import init_db
+from app.models import Appointment, SlotReservation
+from app.services.slot_index import slot_index, ACTIVE_STATUSES, day_start
+
+
+async def main() -> None:
+    await init_db()
+    print("\n=== Backfilling slot reservations ===")
+    today = day_start(datetime.now(timezone.utc))
+    created = skipped = conflicts = 0
+    async for appointment in Appointment.find(
+        Appointment.scheduled_at >= today,
+        In(Appointment.status, list(ACTIVE_STATUSES)),
+    ).sort("scheduled_at"):
+        if await SlotReservation.find_one(SlotReservation.appointment_id == appointment.id):
+            skipped += 1
+            continue
+        try:
+            await slot_index.reserve(
+                appointment.doctor_id, appointment.scheduled_at, appointment.id, check_index=False
+            )
+            created += 1
+        except HTTPException:
+            conflicts += 1
+            print(f"[WARN] Double-booked slot: appointment {appointment.id} at {appointment.scheduled_at}")
+    print(f"[OK] Created {created} reservation(s), skipped {skipped}, conflicts {conflicts}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
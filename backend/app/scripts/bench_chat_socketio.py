@@ -0,0 +1,354 @@
+"""
+Chat fan-out benchmark / soak test for the Socket.IO app.
+
+Seeds doctors and patients (the seed_demo_data staff/patients plus generated
+"Bench Patient N" accounts), opens one python-socketio client per user, joins
+every conversation, then has each client send messages (Poisson arrivals at
+--rate msg/s) and mark_read periodically while it receives. Reports connect
+time, send->ack and end-to-end delivery latency (p50/p95/p99) and throughput.
+
+Run with:
+
+    # self-contained: in-process server on a mongomock database
+    python -m app.scripts.bench_chat_socketio --mongomock --patients 200 --duration 30
+
+    # local mongod (MONGODB_URI), in-process server; long run = soak test
+    python -m app.scripts.bench_chat_socketio --patients 500 --rate 0.5 --duration 600
+
+    # an already running server sharing MONGODB_URI (e.g. several uvicorn workers)
+    python -m app.scripts.bench_chat_socketio --url http://localhost:8000 --patients 200
+
+Requires aiohttp (python-socketio's asyncio client) and, for --mongomock,
+mongomock-motor. Exits non-zero when deliveries are missing or p95 delivery
+latency exceeds --fail-p95-ms, so it can gate a deploy.
+
+The in-process server runs with REALTIME_LOG_MODE=production so per-packet
+socketio/engineio logging is not part of the measured latency (--verbose keeps
+the configured mode). With --mongomock the QR images written for the seeded
+patients are removed on exit.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import shutil
+import statistics
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
+
+# Fix encoding for Windows console
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
+# Settings are read when app modules are imported, so the log mode is fixed here
+if __name__ == "__main__" and "--verbose" not in sys.argv:
+    os.environ["REALTIME_LOG_MODE"] = "production"
+
+import socketio
+
+from app.constants import Role
+from app.models import User, Patient, Doctor
+from app.security import create_access_token
+
+CONTENT_PREFIX = "bench|"
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def _summary(samples: List[float]) -> str:
+    if not samples:
+        return "n/a"
+    return (f"p50={statistics.median(samples):.2f} p95={_percentile(samples, 0.95):.2f} "
+            f"p99={_percentile(samples, 0.99):.2f} max={max(samples):.2f}")
+
+
+async def _init_database(mongomock: bool) -> None:
+    if not mongomock:
+        from app.database import init_db
+        await init_db()
+        return
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("--mongomock requires the 'mongomock-motor' package")
+    from beanie import Document, init_beanie
+    import app.models as models
+    document_models = [
+        value for value in vars(models).values()
+        if isinstance(value, type) and issubclass(value, Document)
+    ]
+    await init_beanie(database=AsyncMongoMockClient()["clinic_bench"], document_models=document_models)
+
+
+def _remove_patient_media(patient_ids: Iterable) -> None:
+    """Delete the media/patients/<id> folders (QR codes) of patients created by a run."""
+    for patient_id in patient_ids:
+        shutil.rmtree(Path("media") / "patients" / str(patient_id), ignore_errors=True)
+
+
+async def _seed(doctor_count: int, patient_count: int) -> List[tuple]:
+    """Demo data + generated doctors/patients. Returns [(user, role, [patient_id, ...])]."""
+    from app.scripts.seed_demo_data import (
+        _create_or_get_staff, create_demo_users, create_demo_patients, assign_patients_to_doctor,
+    )
+    from app.services.admin_service import create_patient
+    from app.services.patient_service import assign_patient_doctors
+
+    # seed helpers print per record; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, demo_doctor, _, _ = await create_demo_users()
+        patients = await create_demo_patients()
+        await assign_patients_to_doctor(patients, demo_doctor)
+
+        doctor_users = [demo_doctor]
+        for i in range(1, doctor_count):
+            doctor_users.append(await _create_or_get_staff(
+                phone=f"0771{i:07d}", username=f"bench_doctor{i}", password="12345",
+                name=f"Bench Doctor {i}", role=Role.DOCTOR,
+            ))
+        doctors = [await Doctor.find_one(Doctor.user_id == u.id) for u in doctor_users]
+
+        for i in range(len(patients), patient_count):
+            phone = f"0790{i:07d}"
+            user = await User.find_one(User.phone == phone)
+            patient = await Patient.find_one(Patient.user_id == user.id) if user else None
+            if patient is None:
+                patient = await create_patient(phone=phone, name=f"Bench Patient {i}", gender=None, age=None, city=None)
+            if not patient.doctor_ids:
+                patient = await assign_patient_doctors(
+                    patient_id=str(patient.id), doctor_ids=[str(doctors[i % len(doctors)].id)],
+                )
+            patients.append(patient)
+
+    by_doctor: Dict = defaultdict(list)
+    participants = []
+    for patient in patients[:patient_count]:
+        if not patient.doctor_ids:
+            continue
+        by_doctor[patient.doctor_ids[0]].append(str(patient.id))
+        participants.append((await User.get(patient.user_id), Role.PATIENT, [str(patient.id)]))
+    for doctor in doctors:
+        if by_doctor.get(doctor.id):
+            participants.append((await User.get(doctor.user_id), Role.DOCTOR, by_doctor[doctor.id]))
+    return participants
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.connect_ms: List[float] = []
+        self.ack_ms: List[float] = []
+        self.delivery_ms: List[float] = []
+        self.sent_at: Dict[str, float] = {}
+        self.room_members: Dict[str, Set[str]] = defaultdict(set)
+        self.expected = 0
+        self.delivered = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.reads = 0
+
+
+class BenchClient:
+    """One simulated user: a python-socketio client that joins, sends, receives and marks read."""
+
+    def __init__(self, name: str, user: User, patient_ids: List[str], stats: Stats, read_every: int) -> None:
+        self.name = name
+        self.user_id = str(user.id)
+        self.token = create_access_token({"sub": str(user.id), "role": user.role, "phone": user.phone})
+        self.patient_ids = patient_ids
+        self.stats = stats
+        self.read_every = read_every
+        self.rooms: Dict[str, str] = {}  # patient_id -> room_id
+        self.received = 0
+        self.seen: Set[str] = set()
+        self.joined = asyncio.Event()
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on("joined_conversation", self._on_joined)
+        self.sio.on("message_received", self._on_message)
+        self.sio.on("message_sent", self._on_ack)
+        self.sio.on("error", self._on_error)
+
+    async def _on_joined(self, data: dict) -> None:
+        self.rooms[str(data["patient_id"])] = data["room_id"]
+        self.stats.room_members[data["room_id"]].add(self.name)
+        if len(self.rooms) == len(self.patient_ids):
+            self.joined.set()
+
+    async def _on_message(self, data: dict) -> None:
+        message = data.get("message") or {}
+        content = message.get("content") or ""
+        if not content.startswith(CONTENT_PREFIX) or message.get("sender_user_id") == self.user_id:
+            return
+        key = content[len(CONTENT_PREFIX):]
+        if key in self.seen:
+            self.stats.duplicates += 1
+            return
+        self.seen.add(key)
+        sent_at = self.stats.sent_at.get(key)
+        if sent_at is not None:
+            self.stats.delivery_ms.append((time.perf_counter() - sent_at) * 1000)
+        self.stats.delivered += 1
+        self.received += 1
+        if self.read_every and self.received % self.read_every == 0:
+            self.stats.reads += 1
+            await self.sio.emit("mark_read", {"room_id": message.get("room_id"), "message_id": message.get("id")})
+
+    async def _on_ack(self, data: dict) -> None:
+        content = (data.get("message") or {}).get("content") or ""
+        sent_at = self.stats.sent_at.get(content[len(CONTENT_PREFIX):])
+        if sent_at is not None:
+            self.stats.ack_ms.append((time.perf_counter() - sent_at) * 1000)
+
+    async def _on_error(self, data: dict) -> None:
+        self.stats.errors += 1
+
+    async def connect(self, url: str) -> None:
+        started = time.perf_counter()
+        await self.sio.connect(url, auth={"token": self.token}, transports=["websocket"], wait_timeout=10)
+        self.stats.connect_ms.append((time.perf_counter() - started) * 1000)
+        for patient_id in self.patient_ids:
+            await self.sio.emit("join_conversation", {"patient_id": patient_id})
+        await asyncio.wait_for(self.joined.wait(), timeout=30)
+
+    async def run(self, until: float, rate: float, rnd: random.Random) -> None:
+        seq = 0
+        while time.perf_counter() < until:
+            await asyncio.sleep(rnd.expovariate(rate))
+            patient_id = rnd.choice(self.patient_ids)
+            room_id = self.rooms.get(patient_id)
+            if room_id is None:
+                continue
+            key = f"{self.name}:{seq}"
+            seq += 1
+            self.stats.expected += len(self.stats.room_members[room_id] - {self.name})
+            self.stats.sent_at[key] = time.perf_counter()
+            await self.sio.emit("send_message", {"patient_id": patient_id, "content": f"{CONTENT_PREFIX}{key}"})
+
+
+async def _start_server(port: int):
+    import uvicorn
+    from app.main import app
+    # lifespan off: the database is initialised by the benchmark (mongomock or MONGODB_URI)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def main(args) -> int:
+    try:
+        import aiohttp  # noqa: F401  (python-socketio AsyncClient transport)
+    except ImportError:
+        raise SystemExit("The benchmark clients need aiohttp: pip install aiohttp")
+    if args.url and args.mongomock:
+        raise SystemExit("--mongomock only works with the in-process server (no --url)")
+
+    await _init_database(args.mongomock)
+    try:
+        return await _run(args)
+    finally:
+        if args.mongomock:
+            _remove_patient_media(patient.id for patient in await Patient.find_all().to_list())
+
+
+async def _run(args) -> int:
+    participants = await _seed(args.doctors, args.patients)
+
+    server = task = None
+    url = args.url
+    if not url:
+        server, task = await _start_server(args.port)
+        url = f"http://127.0.0.1:{args.port}"
+
+    stats = Stats()
+    clients = [
+        BenchClient(f"{role.value}-{i}", user, patient_ids, stats, args.read_every)
+        for i, (user, role, patient_ids) in enumerate(participants)
+    ]
+    limit = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client: BenchClient) -> None:
+        async with limit:
+            await client.connect(url)
+
+    print(f"\n=== Chat fan-out benchmark: {len(clients)} sockets, target {url} ===")
+    started = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in clients))
+    print(f"  connected + joined in {time.perf_counter() - started:.2f}s ({len(stats.room_members)} rooms)")
+
+    if server is not None:
+        from app.utils.realtime_log import realtime_log
+        realtime_log.snapshot()  # reset counters: report the send phase only
+
+    rnd = random.Random(args.seed)
+    started = time.perf_counter()
+    until = started + args.duration
+    await asyncio.gather(*(
+        client.run(until, args.rate, random.Random(rnd.random())) for client in clients
+    ))
+    send_elapsed = time.perf_counter() - started
+
+    deadline = time.perf_counter() + args.drain
+    while stats.delivered < stats.expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    sent = len(stats.sent_at)
+    missing = stats.expected - stats.delivered
+    print(f"  messages sent={sent} ({sent / send_elapsed:.1f}/s)  deliveries {stats.delivered}/{stats.expected} "
+          f"({stats.delivered / elapsed:.1f}/s)  missing={missing} duplicates={stats.duplicates} "
+          f"mark_read={stats.reads} errors={stats.errors}")
+    print(f"  connect ms:          {_summary(stats.connect_ms)}")
+    print(f"  send->ack ms:        {_summary(stats.ack_ms)}")
+    print(f"  end-to-end delivery: {_summary(stats.delivery_ms)}")
+
+    if server is not None:
+        from app.services.chat_engine import engine
+        from app.services.read_receipts import read_receipts
+        print(f"  server: {realtime_log.snapshot()['rates']} engine={engine.stats()} read_receipts={read_receipts.stats()}")
+
+    await asyncio.gather(*(client.sio.disconnect() for client in clients), return_exceptions=True)
+    if server is not None:
+        from app.services.chat_engine import engine
+        from app.services.read_receipts import read_receipts
+        await engine.close()
+        await read_receipts.flush_all()
+        server.should_exit = True
+        await task
+
+    p95 = _percentile(stats.delivery_ms, 0.95) if stats.delivery_ms else None
+    ok = missing == 0 and stats.errors == 0 and (
+        args.fail_p95_ms is None or (p95 is not None and p95 <= args.fail_p95_ms)
+    )
+    print("[OK] all messages delivered" + (f", p95 <= {args.fail_p95_ms}ms" if args.fail_p95_ms else "")
+          if ok else "[FAIL] missing deliveries, errors or p95 over budget")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Socket.IO chat fan-out benchmark / soak test")
+    parser.add_argument("--url", help="Target a running server instead of an in-process one")
+    parser.add_argument("--mongomock", action="store_true", help="In-memory mongomock database (in-process server only)")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the in-process server")
+    parser.add_argument("--doctors", type=int, default=5)
+    parser.add_argument("--patients", type=int, default=50, help="One socket per patient; one room per patient")
+    parser.add_argument("--rate", type=float, default=1.0, help="Messages per second per socket (Poisson)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of sending (long values = soak test)")
+    parser.add_argument("--drain", type=float, default=10.0, help="Seconds to wait for in-flight deliveries")
+    parser.add_argument("--read-every", type=int, default=5, help="mark_read after every N received messages (0 = never)")
+    parser.add_argument("--connect-concurrency", type=int, default=50)
+    parser.add_argument("--fail-p95-ms", type=float, default=None, help="Fail when p95 delivery latency exceeds this")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Keep the configured realtime log mode (per-packet logs in debug)")
+    sys.exit(asyncio.run(main(parser.parse_args())))
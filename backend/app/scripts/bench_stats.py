@@ -0,0 +1,89 @@
+"""
+Benchmark for the statistics endpoints.
+
+Seed the database first, then run:
+
+    python -m app.scripts.seed_demo_data
+    python -m app.scripts.bench_stats --runs 50
+
+Compares the single-roundtrip $facet dashboard against the old
+sequential count() approach on the same data.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# Fix encoding for Windows console
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
+from app.database import init_db
+from app.constants import Role
+from app.models import User, Appointment, ChatRoom, ChatMessage, Notification, DeviceToken
+from app.services.stats_service import get_dashboard_stats
+from app.utils.cache import set_cache
+
+
+async def _sequential_dashboard_counts() -> None:
+    """Baseline: the previous dashboard implementation (17 sequential count() calls)."""
+    now = datetime.now(timezone.utc)
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    this_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    await User.find(User.role == Role.PATIENT).count()
+    await User.find(User.role == Role.DOCTOR).count()
+    await Appointment.count()
+    await Appointment.find(Appointment.scheduled_at > now, Appointment.status == "scheduled").count()
+    await User.find(User.role == Role.PATIENT, User.created_at >= today_start).count()
+    await Appointment.find(
+        Appointment.scheduled_at >= today_start,
+        Appointment.scheduled_at < today_start + timedelta(days=1),
+    ).count()
+    await ChatMessage.find(ChatMessage.created_at >= today_start).count()
+    await User.find(User.role == Role.PATIENT, User.created_at >= this_month_start).count()
+    await Appointment.find(Appointment.scheduled_at >= this_month_start).count()
+    await Appointment.find(Appointment.status == "scheduled").count()
+    await Appointment.find(Appointment.status == "completed").count()
+    await Appointment.find(Appointment.status == "canceled").count()
+    await ChatRoom.count()
+    await ChatMessage.count()
+    await Notification.count()
+    await DeviceToken.find(DeviceToken.active == True).count()
+
+
+async def _measure(label: str, fn, runs: int) -> float:
+    """Run fn `runs` times (after one warm-up) and print latency percentiles in ms."""
+    await fn()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    p50 = statistics.median(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"  {label:<24} p50={p50:8.2f}ms  p95={p95:8.2f}ms  mean={statistics.mean(samples):8.2f}ms")
+    return p50
+
+
+async def main(runs: int) -> None:
+    await init_db()
+    # get_dashboard_stats is response-cached; without this every timed run after
+    # the warm-up would be a cache hit instead of the queries being measured
+    set_cache(None)
+    print(f"\n=== Dashboard stats ({runs} runs) ===")
+    baseline = await _measure("sequential count()", _sequential_dashboard_counts, runs)
+    current = await _measure("$facet + gather", get_dashboard_stats, runs)
+    if current > 0:
+        print(f"\n  speedup (p50): {baseline / current:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark statistics queries")
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+    asyncio.run(main(args.runs))
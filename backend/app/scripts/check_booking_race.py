@@ -0,0 +1,125 @@
+"""
+Concurrency check for appointment booking.
+
+Fires many parallel create_appointment calls for the same doctor and slot
+(at different minutes inside the slot) and verifies that exactly one
+succeeds and the rest get 409, then cancels the winner and checks that the
+slot can be booked again. Finally shifts the doctor's working hours so the
+booked appointment falls in a slot with a different start, and checks that
+booking that slot still gets 409.
+
+Run with:
+
+    python -m app.scripts.check_booking_race --mongomock
+    python -m app.scripts.check_booking_race --bookings 500     # against MONGODB_URI
+
+Against a real database the script removes the records it created; the
+patient's media folder (QR code) is removed in both modes.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+# Fix encoding for Windows console
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
+from fastapi import HTTPException
+
+from app.constants import Role
+from app.models import (
+    Appointment, Doctor, DoctorWorkingHours, Notification, AssignmentLog, Patient,
+    SlotAvailability, SlotReservation, User,
+)
+from app.scripts.bench_chat_socketio import _init_database, _remove_patient_media
+from app.services import patient_service
+from app.services.admin_service import create_staff_user, create_patient
+from app.services.doctor_working_hours_service import DoctorWorkingHoursService
+
+
+async def _book(patient: Patient, doctor: Doctor, at: datetime) -> str:
+    try:
+        await patient_service.create_appointment(
+            patient_id=str(patient.id), doctor_id=str(doctor.id), scheduled_at=at, note="race",
+        )
+        return "booked"
+    except HTTPException as e:
+        return str(e.status_code)
+    except Exception as e:
+        return type(e).__name__
+
+
+async def main(args) -> int:
+    await _init_database(args.mongomock)
+    tag = uuid.uuid4().hex[:8]
+    with contextlib.redirect_stdout(io.StringIO()):
+        doctor_user = await create_staff_user(
+            phone=f"race-d-{tag}", username=f"race_doctor_{tag}", password="12345",
+            name="Race Doctor", role=Role.DOCTOR,
+        )
+        doctor = await Doctor.find_one(Doctor.user_id == doctor_user.id)
+        patient = await create_patient(phone=f"race-p-{tag}", name="Race Patient", gender=None, age=None, city=None)
+        patient = await patient_service.assign_patient_doctors(patient_id=str(patient.id), doctor_ids=[str(doctor.id)])
+        await DoctorWorkingHoursService().set_working_hours(str(doctor.id), [
+            {"dayOfWeek": day, "startTime": "08:00", "endTime": "16:00", "slotDuration": 30} for day in range(7)
+        ])
+
+    slot = (datetime.now(timezone.utc) + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+    rnd = random.Random(args.seed)
+    times = [slot + timedelta(minutes=rnd.randrange(30)) for _ in range(args.bookings)]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = Counter(await asyncio.gather(*(_book(patient, doctor, at) for at in times)))
+            booked = await Appointment.find(Appointment.doctor_id == doctor.id).to_list()
+            reservations = await SlotReservation.find(SlotReservation.doctor_id == doctor.id).count()
+
+            # الإلغاء يحرر الخانة
+            if booked:
+                await patient_service.update_appointment_status(
+                    appointment_id=str(booked[0].id), patient_id=str(patient.id),
+                    doctor_id=str(doctor.id), status="canceled",
+                )
+            rebook = await _book(patient, doctor, slot + timedelta(minutes=15))
+
+            # تغيير الجدول: الموعد (10:15) يقع الآن في خانة 10:15-10:45 بمفتاح مختلف عن حجزه
+            await DoctorWorkingHoursService().set_working_hours(str(doctor.id), [
+                {"dayOfWeek": day, "startTime": "08:15", "endTime": "16:15", "slotDuration": 30} for day in range(7)
+            ])
+            after_change = await _book(patient, doctor, slot + timedelta(minutes=20))
+
+        print(f"\n=== {args.bookings} parallel bookings for {slot.isoformat()} ===")
+        print(f"  results: {dict(results)}")
+        print(f"  appointments={len(booked)} reservations={reservations} rebook after cancel: {rebook}")
+        print(f"  overlapping booking after working hours change: {after_change}")
+        ok = (results["booked"] == 1 and results["409"] == args.bookings - 1
+              and len(booked) == 1 and reservations == 1 and rebook == "booked"
+              and after_change == "409")
+        print("[OK] exactly one booking won the slot" if ok else "[FAIL] slot was double-booked or not released")
+        return 0 if ok else 1
+    finally:
+        _remove_patient_media([patient.id])
+        if not args.mongomock:
+            await Appointment.find(Appointment.doctor_id == doctor.id).delete()
+            await SlotReservation.find(SlotReservation.doctor_id == doctor.id).delete()
+            await SlotAvailability.find(SlotAvailability.doctor_id == doctor.id).delete()
+            await DoctorWorkingHours.find(DoctorWorkingHours.doctor_id == doctor.id).delete()
+            await AssignmentLog.find(AssignmentLog.patient_id == patient.id).delete()
+            await Notification.find(Notification.user_id == patient.user_id).delete()
+            await patient.delete()
+            await doctor.delete()
+            await User.find({"_id": {"$in": [doctor_user.id, patient.user_id]}}).delete()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel booking race check")
+    parser.add_argument("--mongomock", action="store_true", help="In-memory mongomock database")
+    parser.add_argument("--bookings", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,112 @@
+"""
+Query-count regression check for the chat statistics endpoint.
+
+get_chat_stats must issue the same number of database calls however many
+rooms and messages exist (one room scan plus one grouped aggregation per live
+range), not one lookup per message or per room. The script seeds growing
+numbers of rooms, counts the Beanie calls that reach the database during
+each get_chat_stats() call, and fails if the count changes.
+
+Run with:
+
+    python -m app.scripts.check_stats_queries --mongomock
+    python -m app.scripts.check_stats_queries --sizes 10,100,1000     # against MONGODB_URI
+
+Against a real database the script removes the records it created.
+"""
+import argparse
+import asyncio
+import contextlib
+import sys
+from collections import Counter
+from datetime import datetime, timezone
+
+# Fix encoding for Windows console
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
+from beanie import PydanticObjectId as OID
+from beanie.odm.queries.cursor import BaseCursorQuery
+from beanie.odm.queries.find import FindMany, FindOne
+
+from app.models import ChatRoom, ChatMessage
+from app.scripts.bench_chat_socketio import _init_database
+from app.services.stats_service import get_chat_stats
+from app.utils.cache import set_cache
+
+
+@contextlib.contextmanager
+def count_queries(counter: Counter):
+    """عدّ استدعاءات Beanie التي تصل لقاعدة البيانات (find/aggregate/count/find_one)."""
+    patched = [
+        (BaseCursorQuery, "to_list"),
+        (FindMany, "count"),
+        (FindOne, "_find_one"),
+        (FindOne, "count"),
+    ]
+    originals = [(cls, name, getattr(cls, name)) for cls, name in patched]
+
+    def wrap(cls, name, original):
+        async def counted(self, *args, **kwargs):
+            model = getattr(self, "document_model", None)
+            counter[f"{getattr(model, '__name__', '?')}.{name}"] += 1
+            return await original(self, *args, **kwargs)
+        return counted
+
+    for cls, name, original in originals:
+        setattr(cls, name, wrap(cls, name, original))
+    try:
+        yield counter
+    finally:
+        for cls, name, original in originals:
+            setattr(cls, name, original)
+
+
+async def _seed_rooms(count: int, messages_per_room: int, room_ids: list) -> None:
+    doctors = [OID() for _ in range(5)]
+    now = datetime.now(timezone.utc)
+    rooms = [ChatRoom(doctor_id=doctors[i % len(doctors)], patient_id=OID()) for i in range(count)]
+    await ChatRoom.insert_many(rooms)
+    rooms = await ChatRoom.find({"patient_id": {"$in": [room.patient_id for room in rooms]}}).to_list()
+    room_ids.extend(room.id for room in rooms)
+    await ChatMessage.insert_many([
+        ChatMessage(room_id=room.id, content="x", created_at=now)
+        for room in rooms for _ in range(messages_per_room)
+    ])
+
+
+async def main(args) -> int:
+    await _init_database(args.mongomock)
+    # النتائج مخزنة مؤقتاً؛ نقيس الاستعلامات لا الكاش
+    set_cache(None)
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    room_ids: list = []
+    seeded = 0
+    results = []
+    try:
+        for size in sizes:
+            await _seed_rooms(size - seeded, args.messages, room_ids)
+            seeded = size
+            with count_queries(Counter()) as counter:
+                stats = await get_chat_stats()
+            results.append((size, sum(counter.values()), dict(counter), stats["total_messages"]))
+
+        print("\n=== get_chat_stats database calls ===")
+        for size, total, detail, messages in results:
+            print(f"  rooms={size:<6} messages={messages:<8} calls={total}  {detail}")
+        ok = len({total for _, total, _, _ in results}) == 1
+        print("[OK] query count is constant" if ok else "[FAIL] query count grows with the number of rooms")
+        return 0 if ok else 1
+    finally:
+        if not args.mongomock and room_ids:
+            await ChatMessage.find({"room_id": {"$in": room_ids}}).delete()
+            await ChatRoom.find({"_id": {"$in": room_ids}}).delete()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query-count check for get_chat_stats")
+    parser.add_argument("--mongomock", action="store_true", help="In-memory mongomock database")
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated room counts")
+    parser.add_argument("--messages", type=int, default=3, help="Messages per room")
+    sys.exit(asyncio.run(main(parser.parse_args())))
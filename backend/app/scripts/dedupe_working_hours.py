@@ -0,0 +1,53 @@
+"""
+Remove duplicate doctor working hours before the unique index is created.
+
+doctor_working_hours now has a unique index on (doctor_id, day_of_week).
+Older deployments could hold more than one row for the same day (two saves
+racing between delete and insert), and init_db() fails to build the index
+until they are removed. Run once before upgrading:
+
+    python -m app.scripts.dedupe_working_hours
+
+Keeps the most recently updated row per day. Uses the driver directly, since
+init_db() itself would fail on the duplicates.
+"""
+import asyncio
+import sys
+
+# Fix encoding for Windows console
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.config import get_settings
+
+
+async def main() -> None:
+    settings = get_settings()
+    client = AsyncIOMotorClient(settings.MONGODB_URI)
+    db_name = settings.MONGODB_URI.rsplit("/", 1)[-1].split("?")[0]
+    collection = client[db_name]["doctor_working_hours"]
+    print("\n=== Removing duplicate working hours ===")
+    duplicates = collection.aggregate([
+        {"$sort": {"updated_at": -1, "_id": -1}},
+        {"$group": {
+            "_id": {"doctor_id": "$doctor_id", "day_of_week": "$day_of_week"},
+            "ids": {"$push": "$_id"},
+        }},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ])
+    stale = []
+    async for group in duplicates:
+        stale.extend(group["ids"][1:])
+    if stale:
+        result = await collection.delete_many({"_id": {"$in": stale}})
+        print(f"[OK] Removed {result.deleted_count} duplicate row(s)")
+    else:
+        print("[OK] No duplicates found")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
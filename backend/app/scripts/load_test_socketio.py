@@ -0,0 +1,150 @@
+"""
+Load test for Socket.IO fan-out across workers.
+
+Starts N Socket.IO servers ("workers") that share one message queue, attaches
+simulated sockets to each of them, joins the sockets to chat rooms spread over
+all workers, then emits messages from random workers and checks that every
+socket in the room receives every message, whichever worker it lives on.
+
+Run with:
+
+    python -m app.scripts.load_test_socketio --workers 4
+    python -m app.scripts.load_test_socketio --workers 4 --queue redis://localhost:6379/0
+
+The default queue ("memory") is the in-process pub/sub; with a Redis/AMQP URL
+each worker uses its own broker connection, exactly as separate processes do.
+Sockets are simulated at the engine.io layer, so no HTTP clients are needed.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List
+
+# Fix encoding for Windows console
+if sys.platform == "win32":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
+import socketio
+
+from app.services.socket_broker import create_client_manager
+
+EVENT = "message_received"
+
+
+class Worker:
+    """خادم Socket.IO واحد مع sockets وهمية تسجّل ما يصلها."""
+
+    def __init__(self, index: int, queue: str, channel: str, deliveries: Dict[str, List[tuple]]) -> None:
+        manager = create_client_manager(queue, channel=channel)
+        if manager is None:
+            raise SystemExit(f"Unsupported or unavailable queue: {queue!r}")
+        self.index = index
+        self.server = socketio.AsyncServer(async_mode="asgi", client_manager=manager)
+        self.deliveries = deliveries
+        self.server._send_eio_packet = self._record
+
+    async def start(self) -> None:
+        self.server.manager.initialize()
+        self.server.manager_initialized = True
+
+    async def _record(self, eio_sid: str, pkt) -> None:
+        # '2["message_received",{...}]' -> payload
+        raw = pkt.data if isinstance(pkt.data, str) else pkt.data.decode()
+        event, payload = json.loads(raw[raw.index("["):])
+        if event == EVENT:
+            self.deliveries[eio_sid].append((payload["seq"], time.perf_counter()))
+
+    async def attach(self, eio_sid: str, room: str) -> str:
+        sid = await self.server.manager.connect(eio_sid, "/")
+        await self.server.enter_room(sid, room)
+        return sid
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def main(args) -> int:
+    channel = f"loadtest-{uuid.uuid4().hex[:8]}"
+    deliveries: Dict[str, List[tuple]] = defaultdict(list)
+    workers = [Worker(i, args.queue, channel, deliveries) for i in range(args.workers)]
+    for worker in workers:
+        await worker.start()
+    # انتظار اشتراك كل العمال في القناة
+    await asyncio.sleep(0.2)
+
+    room_members: Dict[str, List[tuple]] = defaultdict(list)
+    for i in range(args.clients):
+        worker = workers[i % len(workers)]
+        room = f"room_{i % args.rooms}"
+        eio_sid = f"w{worker.index}-c{i}"
+        await worker.attach(eio_sid, room)
+        room_members[room].append((worker.index, eio_sid))
+
+    rnd = random.Random(args.seed)
+    sent_at: Dict[int, float] = {}
+    sent_from: Dict[int, int] = {}
+    expected: Dict[str, set] = defaultdict(set)
+    started = time.perf_counter()
+    for seq in range(args.messages):
+        room = f"room_{rnd.randrange(args.rooms)}"
+        source = rnd.choice(workers)
+        sent_at[seq] = time.perf_counter()
+        sent_from[seq] = source.index
+        for _, eio_sid in room_members[room]:
+            expected[eio_sid].add(seq)
+        await source.server.emit(EVENT, {"seq": seq, "room": room}, room=room)
+
+    total_expected = sum(len(seqs) for seqs in expected.values())
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        if sum(len(v) for v in deliveries.values()) >= total_expected:
+            break
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    cross_worker = missing = duplicates = 0
+    for eio_sid, seqs in expected.items():
+        received = [seq for seq, _ in deliveries.get(eio_sid, [])]
+        missing += len(seqs - set(received))
+        duplicates += len(received) - len(set(received))
+        worker_index = int(eio_sid[1:eio_sid.index("-")])
+        for seq, at in deliveries.get(eio_sid, []):
+            latencies.append((at - sent_at[seq]) * 1000)
+            if sent_from[seq] != worker_index:
+                cross_worker += 1
+
+    delivered = sum(len(v) for v in deliveries.values())
+    print(f"\n=== Socket.IO fan-out: {args.workers} workers, queue={args.queue} ===")
+    print(f"  sockets={args.clients} rooms={args.rooms} messages={args.messages}")
+    print(f"  delivered {delivered}/{total_expected} ({cross_worker} across workers), "
+          f"missing={missing} duplicates={duplicates}")
+    if latencies:
+        print(f"  latency ms: p50={statistics.median(latencies):.2f} "
+              f"p95={_percentile(latencies, 0.95):.2f} max={max(latencies):.2f}")
+    print(f"  throughput: {delivered / elapsed:.0f} deliveries/s over {elapsed:.2f}s")
+
+    ok = missing == 0 and duplicates == 0 and (args.workers == 1 or cross_worker > 0)
+    print("[OK] every socket received every message" if ok else "[FAIL] fan-out incomplete")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Socket.IO multi-worker fan-out load test")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=400, help="Simulated sockets, spread over workers")
+    parser.add_argument("--rooms", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--queue", default="memory", help="memory | redis://… | amqp://…")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -15,8 +15,14 @@ from app.config import get_settings
 from app.database import init_db
 from app.constants import Role
 from app.models import User, Patient, Doctor, Appointment, TreatmentNote
-from app.services.admin_service import create_staff_user, create_patient, assign_patient_to_doctors
-from app.services.patient_service import create_note, create_appointment, set_treatment_type
+from app.services.admin_service import create_staff_user, create_patient
+from app.services.patient_service import (
+    create_note,
+    create_appointment,
+    set_treatment_type,
+    assign_patient_doctors,
+    update_appointment_status,
+)
 
 
 async def _create_or_get_staff(*, phone: str, username: str, password: str, name: str, role: Role) -> User:
@@ -176,15 +182,14 @@ async def assign_patients_to_doctor(patients, doctor_user):
     for patient in patients:
         try:
             # Only assign if not already assigned
-            if patient.primary_doctor_id:
+            if patient.doctor_ids:
                 user = await User.get(patient.user_id)
-                print(f"[SKIP] Patient {user.name} already has a primary doctor")
+                print(f"[SKIP] Patient {user.name} already has a doctor")
                 continue
                 
-            await assign_patient_to_doctors(
+            await assign_patient_doctors(
                 patient_id=str(patient.id),
-                primary_doctor_id=doctor_id,
-                secondary_doctor_id=None,
+                doctor_ids=[doctor_id],
                 assigned_by_user_id=str(doctor_user.id),
             )
             user = await User.get(patient.user_id)
@@ -275,8 +280,14 @@ async def create_demo_appointments(patients, doctor_user):
                 image_path=None,
             )
             
-            appointment.status = apt_data["status"]
-            await appointment.save()
+            if apt_data["status"] != appointment.status:
+                # عبر الخدمة حتى يُحرر الإلغاء حجز الخانة وعدّادها
+                await update_appointment_status(
+                    appointment_id=str(appointment.id),
+                    patient_id=str(apt_data["patient"].id),
+                    doctor_id=doctor_id,
+                    status=apt_data["status"],
+                )
             
             user = await User.get(apt_data["patient"].user_id)
             print(f"[OK] Created appointment for {user.name} at {apt_data['scheduled_at']}")
@@ -1,7 +1,6 @@
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional, Callable
 
-from beanie import PydanticObjectId as OID
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
@@ -10,6 +9,7 @@ from passlib.context import CryptContext
 from app.config import get_settings
 from app.constants import Role
 from app.models.user import User
+from app.services.auth_cache import decode_access_token, get_principal
 
 settings = get_settings()
 
@@ -50,8 +50,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
 ) -> User:
-    """Decode JWT and fetch current user from MongoDB.
+    """Decode JWT and fetch current user (cached principal, without password_hash).
     Raises 401 if token invalid or user not found.
+    Handlers that modify the user must reload it with User.get before saving.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -59,9 +60,7 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(
-            token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM]
-        )
+        payload = decode_access_token(token)
         user_id: str | None = payload.get("sub")
         if user_id is None:
             raise credentials_exception
@@ -69,7 +68,7 @@ async def get_current_user(
         raise credentials_exception
 
     try:
-        user = await User.get(OID(user_id))
+        user = await get_principal(user_id)
     except Exception:
         user = None
     if not user:
@@ -0,0 +1,91 @@
+"""
+كاش المصادقة: فك JWT و"الهوية" (principal) للمستخدم لكل طلب/اتصال.
+
+- decode_access_token(): فك وتحقق JWT مع LRU صغير للرموز المتكررة
+  (انتهاء الصلاحية يُتحقق منه عند كل استخدام).
+- get_principal(): مستخدم بدون password_hash من كاش TTL بدلاً من User.get
+  في كل طلب. يستخدم Redis إذا كان CACHE_BACKEND=redis (إبطال مشترك بين العمال)،
+  وإلا كاشاً محلياً في الذاكرة.
+
+الـ principal للقراءة فقط: المسارات التي تعدّل المستخدم يجب أن تجلبه من
+القاعدة (User.get) ثم تستدعي invalidate_principal بعد الحفظ.
+"""
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from beanie import PydanticObjectId as OID
+from jose import jwt, JWTError
+
+from app.config import get_settings
+from app.models.user import User
+from app.utils.cache import MemoryCache, RedisCache, get_cache, _MISSING
+from app.utils.logger import get_logger
+
+settings = get_settings()
+logger = get_logger("auth_cache")
+
+# حقول لا تُخزن في الكاش
+_PRIVATE_FIELDS = {"password_hash"}
+
+_local_principals = MemoryCache(max_entries=settings.AUTH_CACHE_MAX_ENTRIES)
+_tokens: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def decode_access_token(token: str) -> dict:
+    """فك JWT والتحقق منه. يرفع JWTError إذا كان غير صالح أو منتهياً."""
+    payload = _tokens.get(token)
+    if payload is not None:
+        exp = payload.get("exp")
+        if exp is None or exp > time.time():
+            _tokens.move_to_end(token)
+            return payload
+        _tokens.pop(token, None)
+        raise JWTError("Signature has expired.")
+    payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+    _tokens[token] = payload
+    while len(_tokens) > settings.AUTH_CACHE_MAX_ENTRIES:
+        _tokens.popitem(last=False)
+    return payload
+
+
+def _backend():
+    shared = get_cache()
+    return shared if isinstance(shared, RedisCache) else _local_principals
+
+
+def _key(user_id) -> str:
+    return f"auth:user:{user_id}"
+
+
+async def get_principal(user_id) -> Optional[User]:
+    """المستخدم (بدون password_hash) من الكاش، أو من القاعدة عند عدم وجوده."""
+    ttl = settings.AUTH_CACHE_TTL_SECONDS
+    if ttl <= 0:
+        return await User.get(OID(user_id))
+    backend = _backend()
+    key = _key(user_id)
+    try:
+        data = await backend.get(key)
+    except Exception as e:
+        logger.warning(f"Auth cache get failed: {e}")
+        data = _MISSING
+    if data is not _MISSING:
+        return User.model_validate(data)
+    user = await User.get(OID(user_id))
+    if user is None:
+        return None
+    data = user.model_dump(mode="json", exclude=_PRIVATE_FIELDS)
+    try:
+        await backend.set(key, data, ttl)
+    except Exception as e:
+        logger.warning(f"Auth cache set failed: {e}")
+    return User.model_validate(data)
+
+
+async def invalidate_principal(user_id) -> None:
+    """حذف المستخدم من الكاش بعد تعديله أو حذفه."""
+    try:
+        await _backend().delete(_key(user_id))
+    except Exception as e:
+        logger.warning(f"Auth cache invalidation failed: {e}")
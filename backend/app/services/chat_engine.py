@@ -0,0 +1,222 @@
+"""
+محرك المحادثة: مسار واحد لكتابة رسائل الدردشة من REST و Socket.IO و WebSocket.
+
+- resolve_room(): التحقق من صلاحية المستخدم والحصول على غرفة (طبيب، مريض).
+- ChatEngine.send(): يضيف الرسالة إلى مخزن كتابة مؤجلة (write-behind) يُفرَّغ
+  بـ insert_many كل CHAT_WRITE_BATCH_MS أو عند بلوغ CHAT_WRITE_BATCH_SIZE رسالة،
+  ولا يعود إلا بعد حفظ الدفعة فعلياً (الإقرار للعميل بعد الحفظ). الإدراج غير مرتب
+  (ordered=False): فشل رسالة لا يُسقط بقية الدفعة، وكل مرسل يتلقى نتيجة رسالته.
+- بعد الحفظ: تحديث ملخص كل غرفة مرة واحدة للدفعة، ثم البث عبر broadcast()،
+  وتسليم رسائل المستلمين غير المتصلين عبر offline_delivery (إشعار مجمّع).
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from beanie import PydanticObjectId as OID
+from pymongo.errors import BulkWriteError, WriteError
+
+from app.config import get_settings
+from app.constants import Role
+from app.models import ChatRoom, ChatMessage, Patient, Doctor, User
+from app.services import chat_service
+from app.services.chat_service import ConnectionManager
+from app.services.offline_delivery import offline_delivery
+from app.services.stats_service import invalidate_stats_cache
+from app.utils.logger import get_logger
+from app.utils.realtime_log import realtime_log
+from app.utils.tasks import spawn
+
+settings = get_settings()
+logger = get_logger("chat_engine")
+
+# اتصالات WebSocket الخام (/ws/chat/{patient_id}) لكل غرفة
+ws_manager = ConnectionManager()
+
+
+class ChatAccessError(Exception):
+    """رفض الوصول لمحادثة؛ status_code/detail لـ REST و message للعملاء اللحظيين."""
+
+    def __init__(self, status_code: int, detail: str, message: str = "غير مصرح") -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.message = message
+
+
+async def resolve_room(*, user: User, patient_id, loaders=None) -> ChatRoom:
+    """الحصول على أو إنشاء غرفة المحادثة بعد التحقق من صلاحية المستخدم.
+    - الطبيب: يجب أن يكون ضمن doctor_ids للمريض.
+    - المريض: نفسه فقط، مع أول طبيب معين له.
+    """
+    try:
+        if loaders is not None:
+            patient = await loaders.patients.load(patient_id)
+        else:
+            patient = await Patient.get(OID(patient_id))
+    except Exception:
+        patient = None
+    if not patient:
+        raise ChatAccessError(404, "Patient not found", "المريض غير موجود")
+
+    if user.role == Role.DOCTOR:
+        if loaders is not None:
+            doctor = await loaders.doctors_by_user.load(user.id)
+        else:
+            doctor = await Doctor.find_one(Doctor.user_id == user.id)
+        if not doctor:
+            raise ChatAccessError(403, "Doctor profile not found")
+        if doctor.id not in patient.doctor_ids:
+            raise ChatAccessError(403, "Doctor not assigned to this patient")
+        return await chat_service.ensure_room(patient=patient, doctor_id=doctor.id)
+
+    if user.role == Role.PATIENT:
+        if patient.user_id != user.id:
+            raise ChatAccessError(403, "Forbidden")
+        if not patient.doctor_ids or not patient.doctor_ids[0]:
+            raise ChatAccessError(403, "No doctor assigned to this patient", "لا يوجد طبيب معين")
+        return await chat_service.ensure_room(patient=patient, doctor_id=patient.doctor_ids[0])
+
+    raise ChatAccessError(403, "Forbidden")
+
+
+def message_payload(message: ChatMessage) -> dict:
+    """تمثيل الرسالة المرسل للعملاء (نفس حقول ChatMessageOut)."""
+    return {
+        "id": str(message.id),
+        "room_id": str(message.room_id),
+        "sender_user_id": str(message.sender_user_id) if message.sender_user_id else None,
+        "content": message.content,
+        "imageUrl": message.imageUrl,
+        "thumbnails": message.thumbnails,
+        "is_read": message.is_read,
+        "created_at": message.created_at.isoformat(),
+    }
+
+
+async def broadcast(message: ChatMessage) -> None:
+    """بث رسالة محفوظة لكل المتصلين بالغرفة عبر Socket.IO و WebSocket الخام."""
+    room_id = str(message.room_id)
+    try:
+        from app.services.socket_service import emit_message_to_room
+        await emit_message_to_room(room_id, message_payload(message))
+    except Exception as e:
+        logger.warning(f"Failed to emit message via Socket.IO: {e}")
+    await ws_manager.broadcast(f"room:{room_id}", {
+        "sender_id": str(message.sender_user_id) if message.sender_user_id else None,
+        "message": message.content,
+        "room_id": room_id,
+    })
+
+
+class ChatEngine:
+    """كتابة مؤجلة مجمّعة لرسائل الدردشة."""
+
+    def __init__(self, batch_ms: Optional[int] = None, batch_size: Optional[int] = None) -> None:
+        self.batch_ms = settings.CHAT_WRITE_BATCH_MS if batch_ms is None else batch_ms
+        self.batch_size = batch_size or settings.CHAT_WRITE_BATCH_SIZE
+        self._buffer: List[Tuple[ChatRoom, ChatMessage, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        self.messages = 0
+        self.flushes = 0
+
+    async def send(
+        self,
+        *,
+        room: ChatRoom,
+        sender_user_id: Optional[OID],
+        content: str = "",
+        image_url: Optional[str] = None,
+        thumbnails: Optional[Dict[str, str]] = None,
+    ) -> ChatMessage:
+        """حفظ رسالة (ضمن دفعة) وبثها؛ تعود بعد الحفظ الفعلي."""
+        message = ChatMessage(
+            id=OID(),
+            room_id=room.id,
+            sender_user_id=sender_user_id,
+            content=content or "",
+            imageUrl=image_url,
+            thumbnails=thumbnails or None,
+            is_read=False,
+        )
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((room, message, future))
+        if len(self._buffer) >= self.batch_size or self.batch_ms <= 0:
+            spawn(self.flush(), self._tasks, logger, "Chat write-behind flush")
+        elif self._timer is None or self._timer.done():
+            self._timer = spawn(self._flush_later(), self._tasks, logger, "Chat write-behind flush")
+        await future
+        await broadcast(message)
+        return message
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.batch_ms / 1000)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """حفظ كل الرسائل المعلقة على دفعات (insert_many لكل دفعة) ثم إقرار المرسلين."""
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                await self._write(batch)
+
+    async def _write(self, batch: List[Tuple[ChatRoom, ChatMessage, asyncio.Future]]) -> None:
+        """insert_many واحد (غير مرتب) للدفعة، ثم تحديث ملخصات الغرف وإقرار المرسلين.
+        الرسائل التي فشل إدراجها (حسب index في BulkWriteError) يتلقى مرسلوها خطأها فقط."""
+        failed: Dict[int, Exception] = {}
+        try:
+            await ChatMessage.insert_many([message for _, message, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = WriteError(error.get("errmsg"), error.get("code"), error)
+        except Exception as e:
+            failed = {index: e for index in range(len(batch))}
+        if failed:
+            logger.error(f"❌ Failed to persist {len(failed)} of {len(batch)} chat message(s): {next(iter(failed.values()))}")
+            for index, error in failed.items():
+                future = batch[index][2]
+                if not future.done():
+                    future.set_exception(error)
+            batch = [item for index, item in enumerate(batch) if index not in failed]
+            if not batch:
+                return
+        self.messages += len(batch)
+        self.flushes += 1
+        realtime_log.count("messages", len(batch))
+        try:
+            await self._record(batch)
+        except Exception as e:
+            # الرسائل محفوظة؛ الملخص يُصلح لاحقاً عبر rebuild_room_summary
+            logger.error(f"❌ Failed to update chat room summaries: {e}")
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+        # المستلمون غير المتصلين: إشعار Push مجمّع
+        offline_delivery.enqueue([(room, message) for room, message, _ in batch])
+
+    async def _record(self, batch: List[Tuple[ChatRoom, ChatMessage, asyncio.Future]]) -> None:
+        by_room: Dict[OID, Tuple[ChatRoom, List[ChatMessage]]] = OrderedDict()
+        for room, message, _ in batch:
+            by_room.setdefault(room.id, (room, []))[1].append(message)
+        for room, messages in by_room.values():
+            await chat_service.record_messages(room, messages)
+        await invalidate_stats_cache()
+
+    async def close(self) -> None:
+        """تفريغ ما تبقى في المخزن (عند إيقاف التطبيق)."""
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        await self.flush()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "messages": self.messages,
+            "flushes": self.flushes,
+            "messages_per_flush": round(self.messages / self.flushes, 2) if self.flushes else 0,
+        }
+
+
+engine = ChatEngine()
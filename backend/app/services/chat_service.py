@@ -1,35 +1,326 @@
 import asyncio
-from typing import Dict, Set
+import json
+from typing import Dict, List, Optional, Set
 from fastapi import WebSocket
+from beanie import PydanticObjectId as OID
+from beanie.operators import In, Set as UpdateSet
+
+from app.config import get_settings
+from app.models import ChatRoom, ChatMessage, Patient, Doctor, User
+from app.utils.logger import get_logger
+from app.utils.tasks import spawn
+
+settings = get_settings()
+logger = get_logger("chat_service")
+
+# سياسات المستهلك البطيء عند امتلاء طابور الإرسال
+SLOW_CONSUMER_DROP_OLDEST = "drop_oldest"
+SLOW_CONSUMER_DISCONNECT = "disconnect"
+# WebSocket close code: "Try Again Later"
+_SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class _Connection:
+    """اتصال واحد مع طابور إرسال محدود ومهمة كتابة خاصة به."""
+
+    def __init__(self, room: str, websocket: WebSocket, queue_size: int) -> None:
+        self.room = room
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+
 
 class ConnectionManager:
     """In-memory WebSocket connection manager per room.
+    - لكل اتصال طابور إرسال محدود ومهمة كتابة، فلا يوقف عميل بطيء بقية الغرفة.
+    - الرسالة تُرمَّز JSON مرة واحدة لكل البث.
+    - عند امتلاء الطابور: إسقاط أقدم رسالة (drop_oldest) أو قطع الاتصال (disconnect).
+    - الاتصالات التي يفشل الإرسال إليها تُزال تلقائياً.
     - For production scaling, replace with Redis PubSub or similar.
     """
-    def __init__(self) -> None:
+    def __init__(self, queue_size: Optional[int] = None, slow_consumer_policy: Optional[str] = None) -> None:
         """تهيئة المُدير مع خريطة غرف ومزلاج لحماية الوصول المتزامن."""
-        self.rooms: Dict[str, Set[WebSocket]] = {}
+        self.rooms: Dict[str, Dict[WebSocket, _Connection]] = {}
         self.lock = asyncio.Lock()
+        self.queue_size = queue_size or settings.WS_SEND_QUEUE_SIZE
+        self.slow_consumer_policy = slow_consumer_policy or settings.WS_SLOW_CONSUMER_POLICY
+        self._tasks: Set[asyncio.Task] = set()
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.pruned = 0
 
     async def connect(self, room: str, websocket: WebSocket) -> None:
         """قبول الإتصال وإضافته إلى الغرفة المحددة."""
         await websocket.accept()
+        conn = _Connection(room, websocket, self.queue_size)
+        conn.writer = asyncio.ensure_future(self._writer(conn))
         async with self.lock:
-            self.rooms.setdefault(room, set()).add(websocket)
+            self.rooms.setdefault(room, {})[websocket] = conn
 
     async def disconnect(self, room: str, websocket: WebSocket) -> None:
         """إزالة الإتصال من الغرفة وتنظيف الغرفة إذا أصبحت فارغة."""
         async with self.lock:
-            if room in self.rooms and websocket in self.rooms[room]:
-                self.rooms[room].remove(websocket)
-                if not self.rooms[room]:
-                    self.rooms.pop(room, None)
+            conn = self._remove(room, websocket)
+        if conn and conn.writer and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+
+    def _remove(self, room: str, websocket: WebSocket) -> Optional[_Connection]:
+        conns = self.rooms.get(room)
+        if not conns:
+            return None
+        conn = conns.pop(websocket, None)
+        if not conns:
+            self.rooms.pop(room, None)
+        return conn
 
     async def broadcast(self, room: str, message: dict) -> None:
-        """Send a JSON message to all sockets in the room."""
-        conns = list(self.rooms.get(room, set()))
-        for ws in conns:
-            try:
-                await ws.send_json(message)
-            except Exception:
-                pass
+        """Send a JSON message to all sockets in the room (non-blocking enqueue)."""
+        conns = list(self.rooms.get(room, {}).values())
+        if not conns:
+            return
+        # نفس ترميز WebSocket.send_json، مرة واحدة لكل المستلمين
+        text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        for conn in conns:
+            self._enqueue(conn, text)
+
+    def _enqueue(self, conn: _Connection, text: str) -> None:
+        try:
+            conn.queue.put_nowait(text)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.slow_consumer_policy == SLOW_CONSUMER_DISCONNECT:
+            self.slow_disconnects += 1
+            spawn(self._close_slow(conn), self._tasks, logger, "Closing slow WebSocket consumer")
+            return
+        # drop_oldest: الإبقاء على أحدث الرسائل
+        self.dropped += 1
+        try:
+            conn.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        conn.queue.put_nowait(text)
+
+    async def _close_slow(self, conn: _Connection) -> None:
+        await self.disconnect(conn.room, conn.websocket)
+        try:
+            await conn.websocket.close(code=_SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def _writer(self, conn: _Connection) -> None:
+        """كتابة رسائل الطابور للعميل بالترتيب؛ أي فشل يعني اتصالاً ميتاً."""
+        try:
+            while True:
+                text = await conn.queue.get()
+                await conn.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.pruned += 1
+            await self.disconnect(conn.room, conn.websocket)
+
+
+# ---------------------------------------------------------------------------
+# ملخص غرفة المحادثة (حقول مكررة في ChatRoom لقائمة المحادثات)
+# ---------------------------------------------------------------------------
+# الحد الأقصى لطول معاينة آخر رسالة
+CHAT_PREVIEW_MAX_LENGTH = 200
+IMAGE_PREVIEW = "صورة"
+
+
+def _display_name(user: Optional[User]) -> Optional[str]:
+    if not user:
+        return None
+    return user.name or user.phone
+
+
+def message_preview(message: ChatMessage) -> str:
+    """نص المعاينة: "صورة" للرسائل المصورة وإلا بداية المحتوى."""
+    if message.imageUrl:
+        return IMAGE_PREVIEW
+    return (message.content or "")[:CHAT_PREVIEW_MAX_LENGTH]
+
+
+async def fill_participants(room: ChatRoom, *, patient: Optional[Patient] = None) -> None:
+    """تعبئة بيانات المشاركين (معرفات المستخدمين والأسماء والصور) في الغرفة دون حفظ."""
+    if patient is None:
+        patient = await Patient.get(room.patient_id)
+    doctor = await Doctor.get(room.doctor_id)
+    user_ids = [uid for uid in (patient.user_id if patient else None, doctor.user_id if doctor else None) if uid]
+    users = {u.id: u for u in await User.find(In(User.id, user_ids)).to_list()} if user_ids else {}
+    patient_user = users.get(patient.user_id) if patient else None
+    doctor_user = users.get(doctor.user_id) if doctor else None
+    room.patient_user_id = patient.user_id if patient else None
+    room.doctor_user_id = doctor.user_id if doctor else None
+    room.patient_name = _display_name(patient_user)
+    room.patient_image_url = patient_user.imageUrl if patient_user else None
+    room.doctor_name = _display_name(doctor_user)
+    room.doctor_image_url = doctor_user.imageUrl if doctor_user else None
+    room.archived = patient_user is None
+
+
+async def ensure_room(*, patient: Patient, doctor_id: OID) -> ChatRoom:
+    """الحصول على غرفة (طبيب، مريض) أو إنشاؤها مع ملخص المشاركين."""
+    room = await ChatRoom.find_one(
+        ChatRoom.patient_id == patient.id,
+        ChatRoom.doctor_id == doctor_id
+    )
+    if room:
+        if room.patient_user_id is None:
+            await rebuild_room_summary(room)
+        return room
+    room = ChatRoom(patient_id=patient.id, doctor_id=doctor_id)
+    await fill_participants(room, patient=patient)
+    await room.insert()
+    return room
+
+
+def _unread_field_for_recipient(room: ChatRoom, sender_user_id: Optional[OID]) -> Optional[str]:
+    """العداد الذي يزيد عند إرسال رسالة من هذا المستخدم (عداد الطرف الآخر)."""
+    if sender_user_id is None:
+        return None
+    if sender_user_id == room.patient_user_id:
+        return "unread_by_doctor"
+    if sender_user_id == room.doctor_user_id:
+        return "unread_by_patient"
+    return None
+
+
+def _unread_field_for_reader(room: ChatRoom, reader_user_id: OID) -> Optional[str]:
+    if reader_user_id == room.patient_user_id:
+        return "unread_by_patient"
+    if reader_user_id == room.doctor_user_id:
+        return "unread_by_doctor"
+    return None
+
+
+async def record_message(room: ChatRoom, message: ChatMessage) -> None:
+    """تحديث ملخص الغرفة بعد إدراج رسالة (تحديث ذري واحد)."""
+    await record_messages(room, [message])
+
+
+async def record_messages(room: ChatRoom, messages: List[ChatMessage]) -> None:
+    """تحديث ملخص الغرفة لدفعة رسائل في نفس الغرفة (آخر رسالة بشرط أن تكون أحدث، ثم العدادات)."""
+    if not messages:
+        return
+    if room.patient_user_id is None:
+        await rebuild_room_summary(room)
+        return
+    last = max(messages, key=lambda m: (m.created_at, m.id))
+    # عدة عمال قد يفرّغون دفعات نفس الغرفة بترتيب غير مضمون: آخر رسالة ومعاينتها
+    # تُكتب فقط إن كانت أحدث من المخزنة، والعدادات تزيد دائماً
+    increments: Dict[str, int] = {}
+    for message in messages:
+        field = _unread_field_for_recipient(room, message.sender_user_id)
+        if field:
+            increments[field] = increments.get(field, 0) + 1
+    await ChatRoom.find_one(
+        ChatRoom.id == room.id,
+        {"$or": [{"last_message_at": None}, {"last_message_at": {"$lt": last.created_at}}]},
+    ).update(UpdateSet({
+        "last_message_at": last.created_at,
+        "last_message_preview": message_preview(last),
+    }))
+    if increments:
+        await ChatRoom.find_one(ChatRoom.id == room.id).update({"$inc": increments})
+
+
+async def mark_room_read(room: ChatRoom, reader_user_id: OID) -> None:
+    """تعليم كل رسائل الطرف الآخر كمقروءة وتصفير عداد القارئ."""
+    await ChatMessage.find(
+        ChatMessage.room_id == room.id,
+        ChatMessage.sender_user_id != reader_user_id,
+        ChatMessage.is_read == False
+    ).update(UpdateSet({"is_read": True}))
+    if room.patient_user_id is None:
+        await rebuild_room_summary(room)
+        return
+    field = _unread_field_for_reader(room, reader_user_id)
+    if field:
+        await ChatRoom.find_one(ChatRoom.id == room.id).update(UpdateSet({field: 0}))
+
+
+async def latest_message_id(room: ChatRoom) -> Optional[OID]:
+    """معرف أحدث رسالة محفوظة في الغرفة بترتيب (created_at, _id)."""
+    latest = await ChatMessage.find(
+        ChatMessage.room_id == room.id
+    ).sort(-ChatMessage.created_at, -ChatMessage.id).limit(1).to_list()
+    return latest[0].id if latest else None
+
+
+async def mark_read_up_to(room: ChatRoom, reader_user_id: OID, up_to_message_id: OID) -> int:
+    """تعليم رسائل الطرف الآخر حتى معرف رسالة (شاملاً) كمقروءة وإنقاص عداد القارئ بعددها."""
+    result = await ChatMessage.find(
+        ChatMessage.room_id == room.id,
+        ChatMessage.sender_user_id != reader_user_id,
+        ChatMessage.is_read == False,
+        ChatMessage.id <= up_to_message_id
+    ).update(UpdateSet({"is_read": True}))
+    marked = getattr(result, "modified_count", 0) or 0
+    if not marked:
+        return 0
+    if room.patient_user_id is None:
+        await rebuild_room_summary(room)
+        return marked
+    field = _unread_field_for_reader(room, reader_user_id)
+    if field:
+        await ChatRoom.find_one(ChatRoom.id == room.id).update({"$inc": {field: -marked}})
+        await ChatRoom.find_one(ChatRoom.id == room.id, {field: {"$lt": 0}}).update(UpdateSet({field: 0}))
+    return marked
+
+
+async def mark_message_read(room: ChatRoom, message: ChatMessage) -> None:
+    """تعليم رسالة واحدة كمقروءة وإنقاص العداد إذا لم تكن مقروءة من قبل."""
+    result = await ChatMessage.find_one(
+        ChatMessage.id == message.id,
+        ChatMessage.is_read == False
+    ).update(UpdateSet({"is_read": True}))
+    message.is_read = True
+    if not result or not result.modified_count:
+        return
+    if room.patient_user_id is None:
+        await rebuild_room_summary(room)
+        return
+    field = _unread_field_for_recipient(room, message.sender_user_id)
+    if field:
+        await ChatRoom.find_one(ChatRoom.id == room.id, {field: {"$gt": 0}}).update({"$inc": {field: -1}})
+
+
+async def rebuild_room_summary(room: ChatRoom) -> ChatRoom:
+    """إعادة حساب ملخص الغرفة بالكامل من الرسائل (للترحيل أو الغرف القديمة)."""
+    await fill_participants(room)
+    last_messages = await ChatMessage.find(
+        ChatMessage.room_id == room.id
+    ).sort(-ChatMessage.created_at, -ChatMessage.id).limit(1).to_list()
+    last_message = last_messages[0] if last_messages else None
+    room.last_message_at = last_message.created_at if last_message else None
+    room.last_message_preview = message_preview(last_message) if last_message else None
+    room.unread_by_doctor = await ChatMessage.find(
+        ChatMessage.room_id == room.id,
+        ChatMessage.sender_user_id == room.patient_user_id,
+        ChatMessage.is_read == False
+    ).count() if room.patient_user_id else 0
+    room.unread_by_patient = await ChatMessage.find(
+        ChatMessage.room_id == room.id,
+        ChatMessage.sender_user_id == room.doctor_user_id,
+        ChatMessage.is_read == False
+    ).count() if room.doctor_user_id else 0
+    await room.save()
+    return room
+
+
+async def refresh_participant_profile(user: User) -> None:
+    """تحديث الاسم والصورة المكررة في الغرف بعد تعديل ملف المستخدم."""
+    name = _display_name(user)
+    await ChatRoom.find(ChatRoom.patient_user_id == user.id).update(
+        UpdateSet({"patient_name": name, "patient_image_url": user.imageUrl})
+    )
+    await ChatRoom.find(ChatRoom.doctor_user_id == user.id).update(
+        UpdateSet({"doctor_name": name, "doctor_image_url": user.imageUrl})
+    )
+
+
+async def archive_rooms_for_patient(patient_id: OID) -> None:
+    """إخفاء غرف مريض حُذف حسابه من قوائم المحادثات."""
+    await ChatRoom.find(ChatRoom.patient_id == patient_id).update(UpdateSet({"archived": True}))
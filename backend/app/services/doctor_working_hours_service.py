@@ -1,45 +1,99 @@
-from datetime import datetime, timezone
+import heapq
+from datetime import datetime, timedelta, timezone
+from itertools import islice
 from typing import List, Optional, Dict
 from fastapi import HTTPException
 from beanie import PydanticObjectId as OID
 from beanie.operators import In
+from pymongo import UpdateOne, DeleteMany
 
-from app.models import DoctorWorkingHours, User, Appointment
+from app.models import DoctorWorkingHours, ScheduleException, SlotAvailability, User
+from app.services.slot_index import slot_index, day_start, minute_of_day
+
+# أقصى مدى لاستعلام الإتاحة بالأيام
+MAX_RANGE_DAYS = 62
+# أقصى طول لاستثناء واحد (إجازة طويلة تُقسم إلى عدة استثناءات)
+MAX_EXCEPTION_DAYS = 366
 
 
 class DoctorWorkingHoursService:
     """خدمة إدارة أوقات عمل الأطباء."""
 
-    async def set_working_hours(
-        self, doctor_id: str, working_hours_list: List[Dict]
-    ) -> List[DoctorWorkingHours]:
-        """حفظ أو تحديث أوقات عمل الطبيب."""
-        # التحقق من أن الطبيب موجود
-        from app.models import Doctor
-        doctor = await Doctor.get(OID(doctor_id))
-        if not doctor:
-            raise HTTPException(status_code=404, detail="Doctor not found")
-        
-        # حذف أوقات العمل السابقة
-        await DoctorWorkingHours.find(
-            DoctorWorkingHours.doctor_id == OID(doctor_id)
-        ).delete()
-
-        # إضافة أوقات العمل الجديدة
-        new_working_hours = []
+    @staticmethod
+    def _schedule_ops(doctor_id: OID, working_hours_list: List[Dict]) -> List:
+        """عمليات bulk_write لاستبدال جدول طبيب: upsert لكل يوم على الفهرس الفريد
+        (doctor_id, day_of_week) وحذف الأيام غير المذكورة."""
+        now = datetime.now(timezone.utc)
+        days = set()
+        ops = []
         for wh_data in working_hours_list:
+            # التحقق من القيم عبر النموذج نفسه (صيغة الوقت، مدة الخانة، البداية قبل النهاية)
             working_hour = DoctorWorkingHours(
-                doctor_id=OID(doctor_id),
+                doctor_id=doctor_id,
                 day_of_week=wh_data['dayOfWeek'],
                 start_time=wh_data['startTime'],
                 end_time=wh_data['endTime'],
                 is_working=wh_data.get('isWorking', True),
                 slot_duration=wh_data.get('slotDuration', 30),
             )
-            await working_hour.insert()
-            new_working_hours.append(working_hour)
+            if working_hour.day_of_week in days:
+                raise ValueError(f"Duplicate day_of_week {working_hour.day_of_week}")
+            days.add(working_hour.day_of_week)
+            ops.append(UpdateOne(
+                {"doctor_id": doctor_id, "day_of_week": working_hour.day_of_week},
+                {
+                    "$set": {
+                        "start_time": working_hour.start_time,
+                        "end_time": working_hour.end_time,
+                        "is_working": working_hour.is_working,
+                        "slot_duration": working_hour.slot_duration,
+                        "updated_at": now,
+                    },
+                    "$setOnInsert": {"created_at": now},
+                },
+                upsert=True,
+            ))
+        ops.append(DeleteMany({"doctor_id": doctor_id, "day_of_week": {"$nin": sorted(days)}}))
+        return ops
+
+    async def set_working_hours_bulk(
+        self, schedules: Dict[str, List[Dict]]
+    ) -> Dict[str, List[DoctorWorkingHours]]:
+        """استبدال جداول عدة أطباء بعملية bulk_write واحدة (بدون لحظة يكون فيها الجدول فارغاً)."""
+        from app.models import Doctor
+        try:
+            doctor_ids = {doctor_id: OID(doctor_id) for doctor_id in schedules}
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid doctor id")
+        if not doctor_ids:
+            return {}
+        found = {
+            doctor.id for doctor in await Doctor.find(In(Doctor.id, list(doctor_ids.values()))).to_list()
+        }
+        missing = [doctor_id for doctor_id, oid in doctor_ids.items() if oid not in found]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Doctor not found: {', '.join(missing)}")
+
+        ops = []
+        for doctor_id, working_hours_list in schedules.items():
+            ops.extend(self._schedule_ops(doctor_ids[doctor_id], working_hours_list))
+        await DoctorWorkingHours.get_motor_collection().bulk_write(ops, ordered=True)
+
+        result: Dict[str, List[DoctorWorkingHours]] = {doctor_id: [] for doctor_id in schedules}
+        for wh in await DoctorWorkingHours.find(
+            In(DoctorWorkingHours.doctor_id, list(doctor_ids.values()))
+        ).sort("day_of_week").to_list():
+            result[str(wh.doctor_id)].append(wh)
+        for oid in doctor_ids.values():
+            await slot_index.invalidate(oid)
+        return result
 
-        return new_working_hours
+    async def set_working_hours(
+        self, doctor_id: str, working_hours_list: List[Dict]
+    ) -> List[DoctorWorkingHours]:
+        """حفظ أو تحديث أوقات عمل الطبيب (upsert مجمّع في عملية واحدة)."""
+        result = await self.set_working_hours_bulk({str(OID(doctor_id)): working_hours_list})
+        return result[str(OID(doctor_id))]
 
     async def get_doctor_working_hours(
         self, doctor_id: str
@@ -50,86 +104,101 @@ class DoctorWorkingHoursService:
         ).sort("day_of_week").to_list()
         return working_hours
 
-    async def get_available_slots(
-        self, doctor_id: str, date: str
-    ) -> List[str]:
-        """جلب الأوقات المتاحة لطبيب في يوم معين."""
-        from datetime import timedelta
+    @staticmethod
+    def _parse_doctor_id(doctor_id: str) -> OID:
+        try:
+            return OID(doctor_id)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid doctor id")
 
-        # Parse date
+    @staticmethod
+    def _parse_day(date: str) -> datetime:
         try:
-            appointment_date = datetime.fromisoformat(date.replace('Z', '+00:00'))
-            if appointment_date.tzinfo is None:
-                appointment_date = appointment_date.replace(tzinfo=timezone.utc)
+            day = datetime.fromisoformat(date.replace('Z', '+00:00'))
+            if day.tzinfo is None:
+                day = day.replace(tzinfo=timezone.utc)
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+        return day_start(day)
 
-        day_of_week = appointment_date.weekday()  # 0=Monday, 6=Sunday
-        # Convert to Sunday=0 format
-        day_of_week = (day_of_week + 1) % 7
-
-        # Get working hours for this day
-        working_hours = await DoctorWorkingHours.find_one(
-            DoctorWorkingHours.doctor_id == OID(doctor_id),
-            DoctorWorkingHours.day_of_week == day_of_week,
-            DoctorWorkingHours.is_working == True
-        )
-
-        if not working_hours:
+    async def get_available_slots(
+        self, doctor_id: str, date: str
+    ) -> List[str]:
+        """جلب الأوقات المتاحة لطبيب في يوم معين (من فهرس الإتاحة)."""
+        day = self._parse_day(date)
+        availability = await slot_index.day(OID(doctor_id), day)
+        return availability.free_times()
+
+    async def get_available_slots_range(
+        self, doctor_id: str, date_from: str, date_to: str
+    ) -> Dict[str, List[str]]:
+        """الأوقات المتاحة لكل يوم في المدى [date_from, date_to] (أسبوع أو أكثر)."""
+        start = self._parse_day(date_from)
+        end = self._parse_day(date_to) + timedelta(days=1)
+        if end <= start:
+            raise HTTPException(status_code=400, detail="date_to must not be before date_from")
+        if (end - start).days > MAX_RANGE_DAYS:
+            raise HTTPException(status_code=400, detail=f"Range too large (max {MAX_RANGE_DAYS} days)")
+        days = await slot_index.days(OID(doctor_id), start, end)
+        return {day.date().isoformat(): availability.free_times() for day, availability in days.items()}
+
+    async def find_openings(
+        self,
+        doctor_ids: Optional[List[str]],
+        date_from: str,
+        date_to: str,
+        first_n: int = 10,
+        now: Optional[datetime] = None,
+    ) -> List[Dict[str, str]]:
+        """أقرب first_n أوقات متاحة عبر عدة أطباء في المدى [date_from, date_to].
+        - الإتاحة لكل الأطباء باستعلام واحد (والناقص يُبنى باستعلامين للجميع).
+        - دمج مرتب لقوائم الأطباء (heapq.merge) مع تجاهل الأوقات الماضية.
+        """
+        start = self._parse_day(date_from)
+        end = self._parse_day(date_to) + timedelta(days=1)
+        if end <= start:
+            raise HTTPException(status_code=400, detail="to must not be before from")
+        if (end - start).days > MAX_RANGE_DAYS:
+            raise HTTPException(status_code=400, detail=f"Range too large (max {MAX_RANGE_DAYS} days)")
+
+        if doctor_ids:
+            try:
+                oids = list(dict.fromkeys(OID(doctor_id) for doctor_id in doctor_ids))
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid doctor id")
+        else:
+            from app.models import Doctor
+            oids = [doctor.id for doctor in await Doctor.find_all().to_list()]
+        if not oids:
             return []
 
-        # Get booked appointments for this date
-        start_of_day = appointment_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = appointment_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-        appointments = await Appointment.find(
-            Appointment.doctor_id == OID(doctor_id),
-            Appointment.scheduled_at >= start_of_day,
-            Appointment.scheduled_at <= end_of_day,
-            In(Appointment.status, ["scheduled", "completed"])
-        ).to_list()
-
-        booked_times = set()
-        for apt in appointments:
-            # Extract time from scheduled_at
-            time_str = apt.scheduled_at.strftime('%H:%M')
-            booked_times.add(time_str)
-
-        # Generate available slots
-        available_slots = []
-        start_parts = working_hours.start_time.split(':')
-        end_parts = working_hours.end_time.split(':')
-        
-        start_hour = int(start_parts[0])
-        start_minute = int(start_parts[1])
-        end_hour = int(end_parts[0])
-        end_minute = int(end_parts[1])
-
-        current_hour = start_hour
-        current_minute = start_minute
-
-        while (
-            current_hour < end_hour or
-            (current_hour == end_hour and current_minute < end_minute)
-        ):
-            time_str = f"{current_hour:02d}:{current_minute:02d}"
-            
-            if time_str not in booked_times:
-                available_slots.append(time_str)
-
-            # Add slot_duration
-            total_minutes = current_hour * 60 + current_minute + working_hours.slot_duration
-            current_hour = total_minutes // 60
-            current_minute = total_minutes % 60
-
-        return available_slots
+        availability = await slot_index.days_many(oids, start, end)
+        now = now or datetime.now(timezone.utc)
+
+        def openings(doctor_id: OID, days: Dict[datetime, SlotAvailability]):
+            for day, doc in days.items():
+                for index, count in enumerate(doc.booked):
+                    if count > 0:
+                        continue
+                    at = day + timedelta(minutes=doc.starts[index])
+                    if at >= now:
+                        yield at, str(doctor_id)
+
+        merged = heapq.merge(*(openings(doctor_id, days) for doctor_id, days in availability.items()))
+        return [
+            {
+                "doctor_id": doctor_id,
+                "date": at.date().isoformat(),
+                "time": at.strftime("%H:%M"),
+                "start": at.isoformat(),
+            }
+            for at, doctor_id in islice(merged, first_n)
+        ]
 
     async def is_time_available(
         self, doctor_id: str, date: str, time: str
     ) -> Dict[str, any]:
         """التحقق من توفر وقت معين."""
-        from datetime import timedelta
-
         # Parse date and time
         try:
             appointment_datetime = datetime.fromisoformat(
@@ -140,55 +209,84 @@ class DoctorWorkingHoursService:
         except Exception:
             return {"available": False, "reason": "Invalid date or time format"}
 
-        day_of_week = appointment_datetime.weekday()
-        day_of_week = (day_of_week + 1) % 7  # Convert to Sunday=0
+        availability = await slot_index.day(OID(doctor_id), appointment_datetime)
 
-        # Check working hours
-        working_hours = await DoctorWorkingHours.find_one(
-            DoctorWorkingHours.doctor_id == OID(doctor_id),
-            DoctorWorkingHours.day_of_week == day_of_week,
-            DoctorWorkingHours.is_working == True
-        )
-
-        if not working_hours:
+        if not availability.booked:
             return {"available": False, "reason": "الطبيب لا يعمل في هذا اليوم"}
 
-        # Check if time is within working hours
-        start_parts = working_hours.start_time.split(':')
-        end_parts = working_hours.end_time.split(':')
-        time_parts = time.split(':')
-
-        start_minutes = int(start_parts[0]) * 60 + int(start_parts[1])
-        end_minutes = int(end_parts[0]) * 60 + int(end_parts[1])
-        requested_minutes = int(time_parts[0]) * 60 + int(time_parts[1])
-
-        if requested_minutes < start_minutes or requested_minutes >= end_minutes:
+        requested_minutes = minute_of_day(appointment_datetime)
+        index = availability.slot_of(requested_minutes)
+        if index is None:
             return {"available": False, "reason": "الوقت خارج ساعات العمل"}
 
-        # Check if time aligns with slot_duration
-        minutes_from_start = requested_minutes - start_minutes
-        if minutes_from_start % working_hours.slot_duration != 0:
+        # Check if time aligns with the start of its slot
+        if requested_minutes != availability.starts[index]:
+            slot_duration = availability.ends[index] - availability.starts[index]
             return {
                 "available": False,
-                "reason": f"الوقت يجب أن يكون بفترات {working_hours.slot_duration} دقيقة"
+                "reason": f"الوقت يجب أن يكون بفترات {slot_duration} دقيقة"
             }
 
-        # Check if already booked at this specific time
-        existing_appointment = await Appointment.find_one(
-            Appointment.doctor_id == OID(doctor_id),
-            Appointment.scheduled_at == appointment_datetime,
-            In(Appointment.status, ["scheduled", "completed"])
-        )
-
-        if existing_appointment:
+        # Check if the slot is already booked
+        if availability.booked[index] > 0:
             return {"available": False, "reason": "هذا الوقت محجوز بالفعل"}
 
         return {"available": True}
 
+    async def add_schedule_exception(
+        self, doctor_id: str, data: Dict, created_by: Optional[OID] = None
+    ) -> ScheduleException:
+        """إضافة استثناء (عطلة/إجازة، ساعات مختلفة، فترة إضافية) لأيام محددة."""
+        from app.models import Doctor
+        doctor = await Doctor.get(self._parse_doctor_id(doctor_id))
+        if not doctor:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+        start = self._parse_day(data['startDate'])
+        end = self._parse_day(data.get('endDate') or data['startDate'])
+        if (end - start).days >= MAX_EXCEPTION_DAYS:
+            raise HTTPException(status_code=400, detail=f"Exception too long (max {MAX_EXCEPTION_DAYS} days)")
+        exception = ScheduleException(
+            doctor_id=doctor.id,
+            kind=data['kind'],
+            start_date=start,
+            end_date=end,
+            start_time=data.get('startTime'),
+            end_time=data.get('endTime'),
+            slot_duration=data.get('slotDuration', 30),
+            reason=data.get('reason'),
+            created_by=created_by,
+        )
+        await exception.insert()
+        await slot_index.invalidate(doctor.id, start, end)
+        return exception
+
+    async def list_schedule_exceptions(
+        self, doctor_id: str, date_from: Optional[str] = None, date_to: Optional[str] = None
+    ) -> List[ScheduleException]:
+        """الاستثناءات التي تتقاطع مع المدى [date_from, date_to] (استعلام مدى واحد)."""
+        query = [ScheduleException.doctor_id == self._parse_doctor_id(doctor_id)]
+        if date_to:
+            query.append(ScheduleException.start_date <= self._parse_day(date_to))
+        if date_from:
+            query.append(ScheduleException.end_date >= self._parse_day(date_from))
+        return await ScheduleException.find(*query).sort("start_date").to_list()
+
+    async def delete_schedule_exception(self, doctor_id: str, exception_id: str) -> None:
+        """حذف استثناء وإعادة بناء أيامه فقط."""
+        try:
+            exception = await ScheduleException.get(OID(exception_id))
+        except Exception:
+            exception = None
+        if not exception or exception.doctor_id != self._parse_doctor_id(doctor_id):
+            raise HTTPException(status_code=404, detail="Schedule exception not found")
+        await exception.delete()
+        await slot_index.invalidate(exception.doctor_id, exception.start_date, exception.end_date)
+
     async def delete_working_hours(self, doctor_id: str) -> bool:
         """حذف جميع أوقات عمل الطبيب."""
         result = await DoctorWorkingHours.find(
             DoctorWorkingHours.doctor_id == OID(doctor_id)
         ).delete()
+        await slot_index.invalidate(OID(doctor_id))
         return True
 
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Dict, Iterable, List, Optional
+
+from beanie import PydanticObjectId as OID
+from beanie.operators import In
+
+from app.models import Patient, Doctor, User
+
+
+class Identities:
+    """نتيجة الحل الدفعي للهويات: خرائط المرضى والأطباء والمستخدمين المرتبطين بهم."""
+
+    def __init__(self, patients: List[Patient], doctors: List[Doctor], users: List[User]) -> None:
+        self.patients: Dict[OID, Patient] = {p.id: p for p in patients}
+        self.doctors: Dict[OID, Doctor] = {d.id: d for d in doctors}
+        self.users: Dict[OID, User] = {u.id: u for u in users}
+
+    def patient_user(self, patient_id: OID) -> Optional[User]:
+        patient = self.patients.get(patient_id)
+        return self.users.get(patient.user_id) if patient else None
+
+    def doctor_user(self, doctor_id: OID) -> Optional[User]:
+        doctor = self.doctors.get(doctor_id)
+        return self.users.get(doctor.user_id) if doctor else None
+
+    def patient_name(self, patient_id: OID) -> Optional[str]:
+        user = self.patient_user(patient_id)
+        return user.name if user else None
+
+    def doctor_name(self, doctor_id: OID) -> Optional[str]:
+        user = self.doctor_user(doctor_id)
+        return user.name if user else None
+
+
+async def find_by_ids(model, ids: List[OID]) -> list:
+    """جلب مستندات بمعرفاتها باستعلام $in واحد (أساس loaders الطلب أيضاً)."""
+    if not ids:
+        return []
+    return await model.find(In(model.id, ids)).to_list()
+
+
+async def resolve_identities(
+    *,
+    patient_ids: Iterable[OID] = (),
+    doctor_ids: Iterable[OID] = (),
+) -> Identities:
+    """جلب المرضى والأطباء ومستخدميهم باستعلام $in واحد لكل نموذج (3 استعلامات كحد أقصى)."""
+    patients, doctors = await asyncio.gather(
+        find_by_ids(Patient, list({pid for pid in patient_ids if pid})),
+        find_by_ids(Doctor, list({did for did in doctor_ids if did})),
+    )
+    user_ids = {p.user_id for p in patients if p.user_id}
+    user_ids.update(d.user_id for d in doctors if d.user_id)
+    users = await find_by_ids(User, list(user_ids))
+    return Identities(patients, doctors, users)
+
+
+async def resolve_appointment_identities(appointments: Iterable) -> Identities:
+    """هويات المرضى والأطباء لقائمة مواعيد (لبناء patient_name/doctor_name)."""
+    appointments = list(appointments)
+    return await resolve_identities(
+        patient_ids=[a.patient_id for a in appointments],
+        doctor_ids=[a.doctor_id for a in appointments],
+    )
@@ -0,0 +1,50 @@
+"""
+قفل مهام مجدولة عبر MongoDB.
+
+كل worker يشغّل نفس الـ scheduler، فالمهام التي يجب أن تُنفَّذ مرة واحدة
+(مثل تجميع DailyStats) تأخذ قفلاً بمهلة: find_one_and_update مع upsert على
+فهرس فريد (name)؛ إن كان القفل محجوزاً وغير منتهٍ يفشل الإدراج بـ DuplicateKeyError.
+"""
+import os
+import socket
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
+
+from pymongo.errors import DuplicateKeyError
+
+from app.models import JobLock
+
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def acquire(name: str, ttl_seconds: int) -> bool:
+    """أخذ القفل إن كان متاحاً أو منتهياً."""
+    now = datetime.now(timezone.utc)
+    try:
+        await JobLock.get_motor_collection().find_one_and_update(
+            {"name": name, "expires_at": {"$lte": now}},
+            {"$set": {"owner": _OWNER, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def release(name: str) -> None:
+    await JobLock.get_motor_collection().update_one(
+        {"name": name, "owner": _OWNER},
+        {"$set": {"expires_at": datetime.now(timezone.utc)}},
+    )
+
+
+@asynccontextmanager
+async def job_lock(name: str, ttl_seconds: int) -> AsyncIterator[bool]:
+    """async with job_lock(...) as acquired: المهمة تُنفَّذ فقط إن كان acquired."""
+    acquired = await acquire(name, ttl_seconds)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            await release(name)
@@ -0,0 +1,169 @@
+"""
+DataLoader لكل طلب: تجميع عمليات الجلب بالمعرّف وحفظها مؤقتاً طوال الطلب.
+
+- كل load() في نفس دورة event loop تُجمع في استعلام $in واحد لكل نموذج.
+- النتائج (بما فيها "غير موجود") تُحفظ حتى نهاية الطلب.
+- الحالة لا تُشارك بين الطلبات: نسخة جديدة لكل طلب عبر Depends(get_loaders).
+- الجلب الدفعي نفسه من identity_service (find_by_ids / Identities)، فلا يوجد مساران.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Optional, Set, TypeVar
+
+from beanie import PydanticObjectId as OID
+from beanie.operators import In
+
+from app.models import Patient, Doctor, User
+from app.services.identity_service import Identities, find_by_ids
+from app.utils.logger import get_logger
+from app.utils.tasks import spawn
+
+logger = get_logger("loaders")
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class DataLoader(Generic[K, V]):
+    """تجميع وحفظ عمليات الجلب بالمفتاح (نمط DataLoader)."""
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[K]], Awaitable[Dict[K, V]]],
+        key_fn: Callable[[Any], K] = lambda key: key,
+    ) -> None:
+        self._batch_fn = batch_fn
+        self._key_fn = key_fn
+        self._cache: Dict[K, asyncio.Future] = {}
+        self._queue: List[K] = []
+        self._tasks: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+    def load(self, key: Any) -> "asyncio.Future[Optional[V]]":
+        """جلب قيمة واحدة؛ المفاتيح المطلوبة في نفس الدورة تُجمع في دفعة واحدة."""
+        key = self._key_fn(key)
+        future = self._cache.get(key)
+        if future is not None:
+            self.hits += 1
+            return future
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._cache[key] = future
+        self._queue.append(key)
+        if len(self._queue) == 1:
+            # التنفيذ بعد أن تُسجّل المهام الأخرى في نفس الدورة مفاتيحها
+            loop.call_soon(self._dispatch)
+        return future
+
+    async def load_many(self, keys: Iterable[Any]) -> List[Optional[V]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: Any, value: Optional[V]) -> None:
+        """إضافة قيمة معروفة مسبقاً (مثلاً من استعلام آخر) دون جلبها."""
+        key = self._key_fn(key)
+        if key in self._cache:
+            return
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(value)
+        self._cache[key] = future
+
+    def clear(self, key: Any) -> None:
+        """نسيان قيمة محفوظة (بعد تعديلها مثلاً) ليُعاد جلبها لاحقاً."""
+        self._cache.pop(self._key_fn(key), None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "batches": self.batches}
+
+    def _dispatch(self) -> None:
+        keys, self._queue = self._queue, []
+        if keys:
+            spawn(self._run_batch(keys), self._tasks, logger, "Loader batch")
+
+    async def _run_batch(self, keys: List[K]) -> None:
+        self.batches += 1
+        try:
+            found = await self._batch_fn(keys)
+        except Exception as e:
+            logger.error(f"❌ Loader batch of {len(keys)} keys failed: {e}")
+            for key in keys:
+                future = self._cache.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        for key in keys:
+            future = self._cache.get(key)
+            if future is not None and not future.done():
+                future.set_result(found.get(key))
+
+
+def _as_oid(value: Any) -> OID:
+    return value if isinstance(value, OID) else OID(value)
+
+
+def _by_ids(model) -> Callable[[List[OID]], Awaitable[Dict[OID, Any]]]:
+    async def batch(ids: List[OID]) -> Dict[OID, Any]:
+        return {doc.id: doc for doc in await find_by_ids(model, ids)}
+
+    return batch
+
+
+class RequestLoaders:
+    """مجموعة loaders لطلب واحد: المرضى، الأطباء، المستخدمون، والطبيب حسب user_id."""
+
+    def __init__(self) -> None:
+        self.patients: DataLoader[OID, Patient] = DataLoader(_by_ids(Patient), _as_oid)
+        self.doctors: DataLoader[OID, Doctor] = DataLoader(_by_ids(Doctor), _as_oid)
+        self.users: DataLoader[OID, User] = DataLoader(_by_ids(User), _as_oid)
+        self.doctors_by_user: DataLoader[OID, Doctor] = DataLoader(self._doctors_by_user_ids, _as_oid)
+
+    async def _doctors_by_user_ids(self, user_ids: List[OID]) -> Dict[OID, Doctor]:
+        doctors = await Doctor.find(In(Doctor.user_id, user_ids)).to_list()
+        for doctor in doctors:
+            self.doctors.prime(doctor.id, doctor)
+        return {doctor.user_id: doctor for doctor in doctors}
+
+    async def resolve_identities(
+        self,
+        *,
+        patient_ids: Iterable[OID] = (),
+        doctor_ids: Iterable[OID] = (),
+    ) -> Identities:
+        """مثل identity_service.resolve_identities لكن عبر loaders الطلب (مع الحفظ المؤقت)."""
+        patients, doctors = await asyncio.gather(
+            self.patients.load_many({pid for pid in patient_ids if pid}),
+            self.doctors.load_many({did for did in doctor_ids if did}),
+        )
+        patients = [p for p in patients if p]
+        doctors = [d for d in doctors if d]
+        user_ids = {p.user_id for p in patients if p.user_id}
+        user_ids.update(d.user_id for d in doctors if d.user_id)
+        users = [u for u in await self.users.load_many(user_ids) if u]
+        return Identities(patients, doctors, users)
+
+    async def resolve_appointment_identities(self, appointments: Iterable) -> Identities:
+        """هويات المرضى والأطباء لقائمة مواعيد عبر loaders الطلب."""
+        appointments = list(appointments)
+        return await self.resolve_identities(
+            patient_ids=[a.patient_id for a in appointments],
+            doctor_ids=[a.doctor_id for a in appointments],
+        )
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """عدادات hit/miss/batches لكل loader."""
+        return {
+            "patients": self.patients.stats(),
+            "doctors": self.doctors.stats(),
+            "users": self.users.stats(),
+            "doctors_by_user": self.doctors_by_user.stats(),
+        }
+
+
+async def get_loaders() -> AsyncIterator[RequestLoaders]:
+    """FastAPI dependency: loaders جديدة لكل طلب (تُشارك بين كل dependencies نفس الطلب)."""
+    loaders = RequestLoaders()
+    try:
+        yield loaders
+    finally:
+        logger.debug(f"Request loaders: {loaders.stats()}")
@@ -0,0 +1,204 @@
+"""
+تسليم رسائل الدردشة للمستخدمين غير المتصلين.
+
+- إشعار Push مجمّع: بعد حفظ الرسائل نتحقق من حضور المستلم (presence)؛ إن لم يكن
+  لديه أي socket متصل تُجمع رسائله ويُرسل له إشعار FCM واحد كل
+  CHAT_PUSH_WINDOW_SECONDS عبر notification_service (بدل إشعار لكل رسالة).
+- إعادة الإرسال عند الاتصال: لكل مستخدم موضع تسليم (ChatDeliveryCursor) يُثبَّت عند
+  انقطاع آخر socket له؛ عند عودته تُرسل له الرسائل التي بعد هذا الموضع على دفعات
+  (CHAT_REPLAY_PAGE_SIZE) بدل إعادة جلب التاريخ كاملاً.
+  التسليم "مرة واحدة على الأقل": قد تتكرر رسالة قريبة من لحظة الانقطاع، والعميل
+  يتجاهل المكرر حسب معرف الرسالة.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from beanie import PydanticObjectId as OID
+
+from app.config import get_settings
+from app.models import ChatRoom, ChatMessage, ChatDeliveryCursor
+from app.services import chat_service
+from app.services.notification_service import notify_user
+from app.services.socket_broker import get_presence
+from app.utils.logger import get_logger
+from app.utils.tasks import spawn
+
+settings = get_settings()
+logger = get_logger("offline_delivery")
+
+# رسائل أُنشئت قبل الانقطاع بقليل قد تُحفظ وتُبث بعده (كتابة مجمّعة)؛
+# نرجع بالموضع هذه المدة حتى لا تضيع
+_DISCONNECT_GRACE = timedelta(seconds=5)
+
+
+def _aware(value: datetime) -> datetime:
+    """MongoDB تعيد التواريخ بدون منطقة زمنية (UTC)."""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _recipient(room: ChatRoom, sender_user_id: Optional[OID]) -> Optional[OID]:
+    """الطرف الآخر في الغرفة."""
+    if sender_user_id is not None and sender_user_id == room.patient_user_id:
+        return room.doctor_user_id
+    if sender_user_id is not None and sender_user_id == room.doctor_user_id:
+        return room.patient_user_id
+    return None
+
+
+def _sender_name(room: ChatRoom, recipient_user_id: OID) -> Optional[str]:
+    if recipient_user_id == room.doctor_user_id:
+        return room.patient_name
+    return room.doctor_name
+
+
+class OfflineDelivery:
+    """تجميع إشعارات المستلمين غير المتصلين وإعادة الرسائل الفائتة عند الاتصال."""
+
+    def __init__(self, window: Optional[float] = None, page_size: Optional[int] = None) -> None:
+        self.window = settings.CHAT_PUSH_WINDOW_SECONDS if window is None else window
+        self.page_size = page_size or settings.CHAT_REPLAY_PAGE_SIZE
+        self._pending: Dict[OID, List[Tuple[ChatRoom, ChatMessage]]] = {}
+        self._timers: Dict[OID, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.queued = 0
+        self.pushes = 0
+        self.replayed = 0
+
+    # ---------- Push ----------
+
+    def enqueue(self, items: List[Tuple[ChatRoom, ChatMessage]]) -> None:
+        """رسائل محفوظة حديثاً؛ التحقق من الحضور يتم في الخلفية حتى لا يتأخر المرسل."""
+        if items:
+            spawn(self._dispatch(items), self._tasks, logger, "Offline chat delivery dispatch")
+
+    async def _dispatch(self, items: List[Tuple[ChatRoom, ChatMessage]]) -> None:
+        by_recipient: Dict[OID, List[Tuple[ChatRoom, ChatMessage]]] = {}
+        for room, message in items:
+            recipient = _recipient(room, message.sender_user_id)
+            if recipient is not None:
+                by_recipient.setdefault(recipient, []).append((room, message))
+        presence = get_presence()
+        for recipient, messages in by_recipient.items():
+            try:
+                if await presence.is_online(str(recipient)):
+                    continue
+            except Exception as e:
+                logger.warning(f"Presence check failed for {recipient}: {e}")
+                continue
+            self.queued += len(messages)
+            self._pending.setdefault(recipient, []).extend(messages)
+            if recipient not in self._timers:
+                self._timers[recipient] = spawn(
+                    self._push_later(recipient), self._tasks, logger, "Offline chat push"
+                )
+
+    async def _push_later(self, recipient: OID) -> None:
+        await asyncio.sleep(self.window)
+        self._timers.pop(recipient, None)
+        await self._push(recipient)
+
+    async def _push(self, recipient: OID) -> None:
+        """إشعار واحد بكل ما تجمّع للمستلم خلال النافذة."""
+        messages = self._pending.pop(recipient, None)
+        if not messages:
+            return
+        try:
+            # عاد للاتصال خلال النافذة: ستصله الرسائل عبر إعادة الإرسال
+            if await get_presence().is_online(str(recipient)):
+                return
+        except Exception:
+            pass
+        rooms = {room.id: room for room, _ in messages}
+        count = len(messages)
+        if len(rooms) == 1:
+            room, last = messages[-1]
+            title = _sender_name(room, recipient) or "رسالة جديدة"
+            body = chat_service.message_preview(last) if count == 1 else f"{count} رسائل جديدة"
+        else:
+            title = "رسائل جديدة"
+            body = f"{count} رسائل جديدة من {len(rooms)} محادثات"
+        try:
+            await notify_user(user_id=recipient, title=title, body=body)
+            self.pushes += 1
+        except Exception as e:
+            logger.error(f"❌ Failed to push offline chat notification to {recipient}: {e}")
+
+    async def flush_all(self) -> None:
+        """إرسال كل الإشعارات المعلقة فوراً (عند إيقاف التطبيق)."""
+        for task in list(self._timers.values()):
+            task.cancel()
+        self._timers.clear()
+        for recipient in list(self._pending):
+            await self._push(recipient)
+
+    # ---------- موضع التسليم ----------
+
+    async def mark_offline(self, user_id: OID) -> None:
+        """انقطع آخر socket للمستخدم: ما بعد هذه اللحظة فاته."""
+        until = datetime.now(timezone.utc) - _DISCONNECT_GRACE
+        cursor = await ChatDeliveryCursor.find_one(ChatDeliveryCursor.user_id == user_id)
+        if cursor is None:
+            await ChatDeliveryCursor(user_id=user_id, delivered_until=until).insert()
+            return
+        if cursor.replay_pending or _aware(cursor.delivered_until) >= until:
+            # ما زالت هناك رسائل فائتة لم تُرسل؛ الموضع الحالي هو الصحيح
+            return
+        cursor.delivered_until = until
+        cursor.last_message_id = None
+        cursor.updated_at = datetime.now(timezone.utc)
+        await cursor.save()
+
+    async def replay(self, user_id: OID) -> Tuple[List[ChatMessage], bool]:
+        """الدفعة التالية من الرسائل الفائتة (الأقدم أولاً) وتقديم الموضع بعدها.
+        يعيد (الرسائل، هل بقي المزيد). بدون موضع محفوظ لا يوجد ما يُعاد.
+        """
+        cursor = await ChatDeliveryCursor.find_one(ChatDeliveryCursor.user_id == user_id)
+        if cursor is None:
+            return [], False
+        since = _aware(cursor.delivered_until)
+
+        rooms = await ChatRoom.find(
+            {
+                "$or": [{"patient_user_id": user_id}, {"doctor_user_id": user_id}],
+                "archived": {"$ne": True},
+                "last_message_at": {"$gte": since},
+            },
+        ).to_list()
+        if not rooms:
+            messages, has_more = [], False
+        else:
+            if cursor.last_message_id is not None:
+                position = {"$or": [
+                    {"created_at": {"$gt": since}},
+                    {"created_at": since, "_id": {"$gt": cursor.last_message_id}},
+                ]}
+            else:
+                position = {"created_at": {"$gt": since}}
+            messages = await ChatMessage.find(
+                {"room_id": {"$in": [room.id for room in rooms]}, "sender_user_id": {"$ne": user_id}},
+                position,
+            ).sort(+ChatMessage.created_at, +ChatMessage.id).limit(self.page_size + 1).to_list()
+            has_more = len(messages) > self.page_size
+            messages = messages[:self.page_size]
+
+        if messages:
+            cursor.delivered_until = messages[-1].created_at
+            cursor.last_message_id = messages[-1].id
+            self.replayed += len(messages)
+        if messages or cursor.replay_pending != has_more:
+            cursor.replay_pending = has_more
+            cursor.updated_at = datetime.now(timezone.utc)
+            await cursor.save()
+        return messages, has_more
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queued,
+            "pushes": self.pushes,
+            "replayed": self.replayed,
+            "pending_recipients": len(self._pending),
+        }
+
+
+offline_delivery = OfflineDelivery()
@@ -7,6 +7,11 @@ from beanie.operators import In
 from app.models import Patient, User, Doctor, Appointment, TreatmentNote, GalleryImage
 from app.constants import Role
 from app.schemas import PatientUpdate
+from app.services import chat_service
+from app.services.auth_cache import invalidate_principal
+from app.services.slot_index import slot_index, occupies_slot
+from app.services.stats_service import invalidate_stats_cache
+from app.services.stats_rollup_service import invalidate_day as invalidate_stats_day
 
 MAX_PAGE_SIZE = 100
 
@@ -79,6 +84,8 @@ async def update_patient_by_doctor(*, doctor_id: str, patient_id: str, data: Pat
         patient.treatment_type = data.treatment_type
     await u.save()
     await patient.save()
+    await invalidate_principal(u.id)
+    await chat_service.refresh_participant_profile(u)
     return patient
 
 async def update_patient_by_admin(*, patient_id: str, data: PatientUpdate) -> Patient:
@@ -103,6 +110,8 @@ async def update_patient_by_admin(*, patient_id: str, data: PatientUpdate) -> Pa
         patient.treatment_type = data.treatment_type
     await u.save()
     await patient.save()
+    await invalidate_principal(u.id)
+    await chat_service.refresh_participant_profile(u)
     return patient
 
 async def delete_patient(*, actor_role: Role, patient_id: str, actor_doctor_id: str | None = None) -> None:
@@ -116,6 +125,8 @@ async def delete_patient(*, actor_role: Role, patient_id: str, actor_doctor_id:
     user = await User.get(patient.user_id)
     if user:
         await user.delete()
+        await invalidate_principal(user.id)
+    await chat_service.archive_rooms_for_patient(patient.id)
     return None
 
 async def assign_patient_doctors(
@@ -174,6 +185,10 @@ async def assign_patient_doctors(
 
     print(f"💾 [assign_patient_doctors] Saving patient...")
     await patient.save()
+    await invalidate_stats_cache()
+    # صلاحيات المحادثة المخزنة لكل socket تعتمد على doctor_ids
+    from app.services.socket_service import invalidate_patient_rooms
+    await invalidate_patient_rooms(str(patient.id))
     print(f"✅ [assign_patient_doctors] Patient saved. doctor_ids: {patient.doctor_ids}")
     
     # التحقق من الحفظ
@@ -217,6 +232,7 @@ async def create_note(
         image_paths=final_image_paths
     )
     await tn.insert()
+    await invalidate_stats_cache()
     return tn
 
 async def update_note(
@@ -311,6 +327,7 @@ async def create_appointment(
     final_image_path = final_image_paths[0] if final_image_paths else None
 
     ap = Appointment(
+        id=OID(),
         patient_id=patient.id,
         doctor_id=OID(doctor_id),
         scheduled_at=scheduled_at,
@@ -318,7 +335,16 @@ async def create_appointment(
         image_path=final_image_path,
         image_paths=final_image_paths,
     )
-    await ap.insert()
+    # حجز الخانة ذرياً قبل إنشاء الموعد (409 إن سبقنا طلب آخر إليها)
+    await slot_index.reserve(ap.doctor_id, ap.scheduled_at, ap.id)
+    try:
+        await ap.insert()
+    except Exception:
+        await slot_index.release(ap.id)
+        raise
+    await slot_index.add(ap.doctor_id, ap.scheduled_at)
+    await invalidate_stats_day(ap.scheduled_at)
+    await invalidate_stats_cache()
 
     # Notify patient about new appointment (push notification)
     try:
@@ -415,6 +441,11 @@ async def delete_appointment(*, appointment_id: str, patient_id: str) -> bool:
         if str(appointment.patient_id) != patient_id:
             return False
         await appointment.delete()
+        await slot_index.release(appointment.id)
+        if occupies_slot(appointment.status):
+            await slot_index.remove(appointment.doctor_id, appointment.scheduled_at)
+        await invalidate_stats_day(appointment.scheduled_at)
+        await invalidate_stats_cache()
         return True
     except Exception as e:
         print(f"Error deleting appointment {appointment_id}: {e}")
@@ -438,9 +469,24 @@ async def update_appointment_status(
         if patient and OID(doctor_id) not in patient.doctor_ids:
             return None
         # تحديث الحالة
-        appointment.status = status.lower()
+        was_active = occupies_slot(appointment.status)
+        new_status = status.lower()
+        # إعادة تفعيل موعد ملغى تحجز الخانة من جديد (409 إن حُجزت في الأثناء)
+        if not was_active and occupies_slot(new_status):
+            await slot_index.reserve(appointment.doctor_id, appointment.scheduled_at, appointment.id)
+        appointment.status = new_status
         await appointment.save()
+        # الإلغاء يحرر الخانة، وإعادة التفعيل تشغلها
+        if was_active and not occupies_slot(appointment.status):
+            await slot_index.release(appointment.id)
+            await slot_index.remove(appointment.doctor_id, appointment.scheduled_at)
+        elif not was_active and occupies_slot(appointment.status):
+            await slot_index.add(appointment.doctor_id, appointment.scheduled_at)
+        await invalidate_stats_day(appointment.scheduled_at)
+        await invalidate_stats_cache()
         return appointment
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error updating appointment status {appointment_id}: {e}")
         return None
@@ -0,0 +1,96 @@
+"""
+تجميع إيصالات القراءة قبل كتابتها في MongoDB.
+
+العملاء يرسلون read_up_to (أعلى معرف رسالة مقروءة) أو mark_read مع كل تمرير؛
+نحتفظ بأعلى قيمة لكل (غرفة، قارئ) ونكتبها في ChatMessage.is_read مرة واحدة
+على الأكثر لكل غرفة كل READ_RECEIPT_FLUSH_SECONDS.
+"""
+import asyncio
+import time
+from typing import Dict, Optional, Set
+
+from beanie import PydanticObjectId as OID
+
+from app.config import get_settings
+from app.models import ChatRoom
+from app.services import chat_service
+from app.utils.logger import get_logger
+from app.utils.tasks import spawn
+
+settings = get_settings()
+logger = get_logger("read_receipts")
+
+# عدد الغرف التي يُحتفظ بوقت آخر كتابة لها قبل تنظيف القديم
+_MAX_TRACKED_ROOMS = 10000
+
+
+class ReadReceiptCoalescer:
+    """حالة القراءة المعلقة لكل غرفة مع كتابة مؤجلة محدودة المعدل."""
+
+    def __init__(self, interval: Optional[float] = None) -> None:
+        self.interval = settings.READ_RECEIPT_FLUSH_SECONDS if interval is None else interval
+        self._pending: Dict[OID, Dict[OID, OID]] = {}
+        self._rooms: Dict[OID, ChatRoom] = {}
+        self._timers: Dict[OID, asyncio.Task] = {}
+        # كل مهام المؤقتات والكتابة الجارية (حتى بعد خروجها من _timers)
+        self._tasks: Set[asyncio.Task] = set()
+        self._last_flush: Dict[OID, float] = {}
+        self.marks = 0
+        self.flushes = 0
+
+    def mark(self, room: ChatRoom, reader_user_id: OID, up_to_message_id: OID) -> None:
+        """تسجيل أن القارئ قرأ حتى هذه الرسالة (تُحفظ أعلى قيمة فقط)."""
+        self.marks += 1
+        readers = self._pending.setdefault(room.id, {})
+        current = readers.get(reader_user_id)
+        if current is None or up_to_message_id > current:
+            readers[reader_user_id] = up_to_message_id
+        self._rooms[room.id] = room
+        if room.id not in self._timers:
+            now = time.monotonic()
+            delay = max(0.0, self._last_flush.get(room.id, 0.0) + self.interval - now)
+            self._timers[room.id] = spawn(
+                self._flush_later(room.id, delay), self._tasks, logger, "Read receipt flush"
+            )
+        if len(self._last_flush) > _MAX_TRACKED_ROOMS:
+            self._prune()
+
+    async def _flush_later(self, room_id: OID, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._timers.pop(room_id, None)
+        await self._flush_room(room_id)
+
+    async def _flush_room(self, room_id: OID) -> None:
+        readers = self._pending.pop(room_id, None)
+        room = self._rooms.pop(room_id, None)
+        if not readers or room is None:
+            return
+        self._last_flush[room_id] = time.monotonic()
+        self.flushes += 1
+        for reader_user_id, up_to in readers.items():
+            try:
+                await chat_service.mark_read_up_to(room, reader_user_id, up_to)
+            except Exception as e:
+                logger.error(f"❌ Failed to flush read state for room {room_id}: {e}")
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - self.interval
+        for room_id in [r for r, at in self._last_flush.items() if at < cutoff]:
+            self._last_flush.pop(room_id, None)
+
+    async def flush_all(self) -> None:
+        """كتابة كل الحالات المعلقة فوراً (عند إيقاف التطبيق).
+        المؤقتات التي لم تبدأ الكتابة تُلغى، والكتابات الجارية يُنتظر انتهاؤها."""
+        for task in list(self._timers.values()):
+            task.cancel()
+        self._timers.clear()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        for room_id in list(self._pending):
+            await self._flush_room(room_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {"marks": self.marks, "flushes": self.flushes, "pending_rooms": len(self._pending)}
+
+
+read_receipts = ReadReceiptCoalescer()
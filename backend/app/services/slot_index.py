@@ -0,0 +1,295 @@
+"""
+فهرس إتاحة مواعيد الأطباء (SlotAvailability).
+
+لكل (طبيب، يوم) وثيقة واحدة فيها عدد المواعيد الفعالة في كل خانة، مبنية من
+DoctorWorkingHours والاستثناءات (ScheduleException) ومواعيد ذلك اليوم عند أول
+طلب. بعدها:
+- إنشاء/إلغاء/حذف موعد: إعادة عدّ خانته فقط (add / remove)، مع بناء اليوم أولاً
+  إن لم يكن مبنياً حتى لا يضيع موعد أُنشئ أثناء بناء متزامن.
+- تغيير أوقات العمل: حذف وثائق الطبيب لتُبنى من جديد (invalidate)، وتغيير
+  استثناء: حذف أيامه فقط.
+- الاستعلام عن يوم أو أسبوع أو مدى: استعلام واحد على slot_availability دون
+  المرور على مجموعة المواعيد.
+الموعد يشغل الخانة التي يقع وقته داخلها (وليس فقط عند تطابق HH:MM).
+
+الحجز نفسه ذري عبر SlotReservation (فهرس فريد على doctor_id + slot_start):
+reserve() إدراج واحد ينجح أو يفشل بـ 409، و release() يحرر الخانة. مفتاح الحجز
+بداية الخانة في الجدول الحالي، فبعد تغيير أوقات العمل أو الاستثناءات قد يقع موعد
+قديم في خانة بمفتاح مختلف؛ لذلك يرفض reserve() أيضاً خانة عدّادها في الفهرس > 0.
+"""
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from beanie import PydanticObjectId as OID
+from beanie.operators import In
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.models import Appointment, DoctorWorkingHours, ScheduleException, SlotAvailability, SlotReservation
+from app.utils.logger import get_logger
+
+logger = get_logger("slot_index")
+
+# حالات المواعيد التي تشغل الخانة
+ACTIVE_STATUSES = ("scheduled", "completed")
+
+
+def _aware(value: datetime) -> datetime:
+    """MongoDB تعيد التواريخ بدون منطقة زمنية (UTC)."""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def day_start(value: datetime) -> datetime:
+    """منتصف ليل اليوم (UTC)."""
+    return _aware(value).astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def minute_of_day(value: datetime) -> int:
+    value = _aware(value).astimezone(timezone.utc)
+    return value.hour * 60 + value.minute
+
+
+def day_of_week(day: datetime) -> int:
+    """0=Sunday … 6=Saturday (صيغة DoctorWorkingHours)."""
+    return (day.weekday() + 1) % 7
+
+
+def _minutes(hhmm: str) -> int:
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def occupies_slot(status: Optional[str]) -> bool:
+    return (status or "").lower() in ACTIVE_STATUSES
+
+
+def _slots(start: int, end: int, duration: int) -> List[Tuple[int, int]]:
+    """خانات فترة عمل؛ الخانة الأخيرة قد تتجاوز نهاية الفترة (ceil)."""
+    count = math.ceil((end - start) / duration)
+    return [(start + i * duration, start + (i + 1) * duration) for i in range(count)]
+
+
+def empty_day(
+    doctor_id: OID,
+    day: datetime,
+    working_hours: Optional[DoctorWorkingHours],
+    exceptions: Iterable[ScheduleException] = (),
+) -> SlotAvailability:
+    """خانات يوم فارغة حسب قالب الأسبوع بعد تطبيق استثناءات اليوم:
+    closed يغلق اليوم كله، آخر custom_hours يحل محل ساعات القالب، وكل extra_shift
+    يضيف فترة (تُهمل خاناتها المتداخلة مع خانات قبلها).
+    """
+    exceptions = sorted(exceptions, key=lambda e: e.created_at)
+    if any(e.kind == "closed" for e in exceptions):
+        return SlotAvailability(doctor_id=doctor_id, day=day)
+    shifts: List[Tuple[int, int, int]] = []
+    if working_hours is not None and working_hours.is_working:
+        shifts.append(
+            (_minutes(working_hours.start_time), _minutes(working_hours.end_time), working_hours.slot_duration)
+        )
+    custom = [e for e in exceptions if e.kind == "custom_hours"]
+    if custom:
+        shifts = [(_minutes(custom[-1].start_time), _minutes(custom[-1].end_time), custom[-1].slot_duration)]
+    shifts.extend(
+        (_minutes(e.start_time), _minutes(e.end_time), e.slot_duration)
+        for e in exceptions if e.kind == "extra_shift"
+    )
+
+    starts: List[int] = []
+    ends: List[int] = []
+    for slot_start, slot_end in sorted(slot for shift in shifts for slot in _slots(*shift)):
+        if ends and slot_start < ends[-1]:
+            continue
+        starts.append(slot_start)
+        ends.append(slot_end)
+    return SlotAvailability(doctor_id=doctor_id, day=day, starts=starts, ends=ends, booked=[0] * len(starts))
+
+
+def count_bookings(days: Dict[datetime, SlotAvailability], scheduled: Iterable[datetime]) -> None:
+    """إضافة المواعيد الفعالة إلى خانات أيامها."""
+    for at in scheduled:
+        availability = days.get(day_start(at))
+        if availability is None:
+            continue
+        index = availability.slot_of(minute_of_day(at))
+        if index is not None:
+            availability.booked[index] += 1
+
+
+class SlotAvailabilityIndex:
+    """بناء وتحديث وقراءة فهرس الإتاحة."""
+
+    async def days(self, doctor_id: OID, start: datetime, end: datetime) -> Dict[datetime, SlotAvailability]:
+        """إتاحة الأيام [start, end) لطبيب: استعلام واحد، والأيام الناقصة تُبنى دفعة واحدة."""
+        return (await self.days_many([doctor_id], start, end))[doctor_id]
+
+    async def days_many(
+        self, doctor_ids: List[OID], start: datetime, end: datetime
+    ) -> Dict[OID, Dict[datetime, SlotAvailability]]:
+        """مثل days() لعدة أطباء باستعلام واحد؛ الناقص يُبنى باستعلامين للجميع."""
+        start = day_start(start)
+        days = [start + timedelta(days=i) for i in range(max(1, (day_start(end) - start).days))]
+        found = await SlotAvailability.find(
+            In(SlotAvailability.doctor_id, list(doctor_ids)),
+            SlotAvailability.day >= days[0],
+            SlotAvailability.day <= days[-1],
+        ).to_list()
+        by_doctor: Dict[OID, Dict[datetime, SlotAvailability]] = {doctor_id: {} for doctor_id in doctor_ids}
+        for doc in found:
+            by_doctor[doc.doctor_id][_aware(doc.day)] = doc
+        missing = {
+            doctor_id: [day for day in days if day not in known]
+            for doctor_id, known in by_doctor.items()
+        }
+        missing = {doctor_id: pending for doctor_id, pending in missing.items() if pending}
+        if missing:
+            for doctor_id, built in (await self._build(missing)).items():
+                by_doctor[doctor_id].update(built)
+        return {
+            doctor_id: {day: known[day] for day in days}
+            for doctor_id, known in by_doctor.items()
+        }
+
+    async def day(self, doctor_id: OID, day: datetime) -> SlotAvailability:
+        return (await self.days(doctor_id, day, day_start(day) + timedelta(days=1)))[day_start(day)]
+
+    async def _build(self, missing: Dict[OID, List[datetime]]) -> Dict[OID, Dict[datetime, SlotAvailability]]:
+        """بناء أيام ناقصة: استعلام لأوقات العمل، استعلام مدى واحد للاستثناءات،
+        واستعلام واحد لمواعيد كل الأطباء في المدى."""
+        doctor_ids = list(missing)
+        template: Dict[OID, Dict[int, DoctorWorkingHours]] = {}
+        for wh in await DoctorWorkingHours.find(In(DoctorWorkingHours.doctor_id, doctor_ids)).to_list():
+            template.setdefault(wh.doctor_id, {})[wh.day_of_week] = wh
+        first = min(min(days) for days in missing.values())
+        last = max(max(days) for days in missing.values())
+        exceptions: Dict[OID, List[ScheduleException]] = {}
+        for exception in await ScheduleException.find(
+            In(ScheduleException.doctor_id, doctor_ids),
+            ScheduleException.start_date <= last,
+            ScheduleException.end_date >= first,
+        ).to_list():
+            exceptions.setdefault(exception.doctor_id, []).append(exception)
+
+        def day_exceptions(doctor_id: OID, day: datetime) -> List[ScheduleException]:
+            return [
+                e for e in exceptions.get(doctor_id, ())
+                if _aware(e.start_date) <= day <= _aware(e.end_date)
+            ]
+
+        built = {
+            doctor_id: {
+                day: empty_day(
+                    doctor_id,
+                    day,
+                    template.get(doctor_id, {}).get(day_of_week(day)),
+                    day_exceptions(doctor_id, day),
+                )
+                for day in days
+            }
+            for doctor_id, days in missing.items()
+        }
+        working = [doctor_id for doctor_id, days in built.items() if any(doc.booked for doc in days.values())]
+        if working:
+            first = min(min(missing[doctor_id]) for doctor_id in working)
+            last = max(max(missing[doctor_id]) for doctor_id in working)
+            scheduled: Dict[OID, List[datetime]] = {}
+            for appointment in await Appointment.find(
+                In(Appointment.doctor_id, working),
+                Appointment.scheduled_at >= first,
+                Appointment.scheduled_at < last + timedelta(days=1),
+                In(Appointment.status, list(ACTIVE_STATUSES)),
+            ).to_list():
+                scheduled.setdefault(appointment.doctor_id, []).append(appointment.scheduled_at)
+            for doctor_id, times in scheduled.items():
+                count_bookings(built[doctor_id], times)
+        try:
+            await SlotAvailability.insert_many(
+                [doc for days in built.values() for doc in days.values()], ordered=False
+            )
+        except BulkWriteError:
+            # طلب متزامن بنى نفس الأيام (فهرس فريد)؛ النتيجة نفسها
+            pass
+        return built
+
+    async def _recount(self, doctor_id: OID, scheduled_at: datetime) -> None:
+        """إعادة عدّ مواعيد الخانة التي يقع فيها الوقت من مجموعة المواعيد.
+        اليوم يُبنى أولاً إن لم يكن موجوداً: بناء متزامن قرأ المواعيد قبل هذا
+        الموعد إما يسبقنا في الإدراج (فنصحح خانته هنا) أو يفشل إدراجه (فهرس فريد).
+        العدّ بدل $inc يجعل النتيجة صحيحة أياً كان ترتيب العمليات المتزامنة.
+        """
+        day = day_start(scheduled_at)
+        availability = await self.day(doctor_id, day)
+        index = availability.slot_of(minute_of_day(scheduled_at))
+        if index is None:
+            return
+        count = await Appointment.find(
+            Appointment.doctor_id == doctor_id,
+            Appointment.scheduled_at >= day + timedelta(minutes=availability.starts[index]),
+            Appointment.scheduled_at < day + timedelta(minutes=availability.ends[index]),
+            In(Appointment.status, list(ACTIVE_STATUSES)),
+        ).count()
+        await SlotAvailability.find_one(
+            SlotAvailability.doctor_id == doctor_id,
+            SlotAvailability.day == day,
+        ).update({"$set": {f"booked.{index}": count}})
+
+    async def add(self, doctor_id: OID, scheduled_at: datetime) -> None:
+        """موعد فعال جديد (أو أُعيد تفعيله) يشغل خانته."""
+        try:
+            await self._recount(doctor_id, scheduled_at)
+        except Exception as e:
+            logger.error(f"❌ Failed to update slot index for doctor {doctor_id}: {e}")
+
+    async def remove(self, doctor_id: OID, scheduled_at: datetime) -> None:
+        """موعد أُلغي أو حُذف يحرر خانته."""
+        try:
+            await self._recount(doctor_id, scheduled_at)
+        except Exception as e:
+            logger.error(f"❌ Failed to update slot index for doctor {doctor_id}: {e}")
+
+    async def reserve(
+        self, doctor_id: OID, scheduled_at: datetime, appointment_id: OID, check_index: bool = True
+    ) -> SlotReservation:
+        """حجز الخانة بإدراج واحد؛ 409 إن كانت مشغولة في الفهرس أو محجوزة (حتى مع
+        الطلبات المتزامنة). خارج ساعات العمل المفتاح هو الوقت نفسه مقرباً للدقيقة.
+        check_index=False لموعد موجود يُعدّ أصلاً في الفهرس (backfill)."""
+        day = day_start(scheduled_at)
+        availability = await self.day(doctor_id, day)
+        index = availability.slot_of(minute_of_day(scheduled_at))
+        if index is None:
+            slot_start = _aware(scheduled_at).astimezone(timezone.utc).replace(second=0, microsecond=0)
+        elif check_index and availability.booked[index] > 0:
+            # موعد حُجز بمفتاح جدول سابق يقع في هذه الخانة
+            raise HTTPException(status_code=409, detail="هذا الوقت محجوز بالفعل")
+        else:
+            slot_start = day + timedelta(minutes=availability.starts[index])
+        reservation = SlotReservation(
+            doctor_id=doctor_id,
+            slot_start=slot_start,
+            appointment_id=appointment_id,
+        )
+        try:
+            await reservation.insert()
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail="هذا الوقت محجوز بالفعل")
+        return reservation
+
+    async def release(self, appointment_id: OID) -> None:
+        """تحرير خانة موعد أُلغي أو حُذف."""
+        await SlotReservation.find(SlotReservation.appointment_id == appointment_id).delete()
+
+    async def invalidate(
+        self, doctor_id: OID, start: Optional[datetime] = None, end: Optional[datetime] = None
+    ) -> None:
+        """تغيّرت أوقات عمل الطبيب (أو استثناء للأيام [start, end] ضمناً):
+        تُعاد بناء هذه الأيام عند الطلب."""
+        query = [SlotAvailability.doctor_id == doctor_id]
+        if start is not None:
+            query.append(SlotAvailability.day >= day_start(start))
+        if end is not None:
+            query.append(SlotAvailability.day <= day_start(end))
+        await SlotAvailability.find(*query).delete()
+
+
+slot_index = SlotAvailabilityIndex()
@@ -0,0 +1,226 @@
+"""
+Socket.IO fan-out and presence shared between workers.
+
+- create_client_manager(): a python-socketio client manager for the configured
+  message queue (Redis, AMQP, or an in-process pub/sub used by tests and the
+  load-test script). Emits made on one worker reach sockets on every worker.
+- Presence (user_id -> socket ids): in memory for a single worker, or in Redis
+  so every worker sees who is online. Redis entries expire unless the owning
+  worker keeps renewing them, so a crashed worker's users go offline.
+
+Per-socket state (authenticated user, joined rooms) stays on the worker that
+owns the socket, since a socket id only lives on one worker.
+"""
+import asyncio
+import pickle
+import time
+from typing import Dict, List, Optional, Set
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from app.config import get_settings
+from app.utils.logger import get_logger
+
+settings = get_settings()
+logger = get_logger("socket_broker")
+
+
+class InProcessPubSubManager(AsyncPubSubManager):
+    """Pub/sub داخل العملية: كل الخوادم في نفس العملية تشترك في القناة.
+    يحاكي Redis/AMQP (نفس التسلسل pickle) لاختبار التوزيع بين عدة "workers".
+    """
+    name = "inprocess"
+    _subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    async def _publish(self, data):
+        payload = pickle.dumps(data)
+        for queue in list(self._subscribers.get(self.channel, [])):
+            queue.put_nowait(payload)
+
+    async def _listen(self):
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(self.channel, []).append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers[self.channel].remove(queue)
+
+
+def create_client_manager(url: Optional[str] = None, channel: Optional[str] = None,
+                          write_only: bool = False) -> Optional[AsyncPubSubManager]:
+    """إنشاء client manager حسب عنوان الطابور، أو None للعمل بعامل واحد."""
+    url = settings.SOCKETIO_MESSAGE_QUEUE if url is None else url
+    channel = channel or settings.SOCKETIO_CHANNEL
+    if not url:
+        return None
+    try:
+        if url in ("memory", "inprocess"):
+            return InProcessPubSubManager(channel=channel, write_only=write_only)
+        if url.startswith(("redis://", "rediss://", "unix://")):
+            return socketio.AsyncRedisManager(url, channel=channel, write_only=write_only)
+        if url.startswith(("amqp://", "amqps://")):
+            return socketio.AsyncAioPikaManager(url, channel=channel, write_only=write_only)
+    except RuntimeError as e:
+        # الحزمة الاختيارية (redis / aio_pika) غير مثبتة
+        logger.warning(f"Socket.IO message queue disabled: {e}")
+        return None
+    logger.warning(f"Unsupported SOCKETIO_MESSAGE_QUEUE: {url!r}; running without a message queue")
+    return None
+
+
+class MemoryPresence:
+    """حضور المستخدمين في ذاكرة العامل الحالي فقط."""
+
+    def __init__(self) -> None:
+        self._sids: Dict[str, Set[str]] = {}
+
+    async def add(self, user_id: str, sid: str) -> None:
+        self._sids.setdefault(user_id, set()).add(sid)
+
+    async def remove(self, user_id: str, sid: str) -> int:
+        """إزالة socket وإرجاع عدد sockets المتبقية للمستخدم."""
+        sids = self._sids.get(user_id)
+        if not sids:
+            return 0
+        sids.discard(sid)
+        if not sids:
+            self._sids.pop(user_id, None)
+            return 0
+        return len(sids)
+
+    async def sids(self, user_id: str) -> Set[str]:
+        return set(self._sids.get(user_id, ()))
+
+    async def is_online(self, user_id: str) -> bool:
+        return bool(self._sids.get(user_id))
+
+    async def online_user_ids(self) -> Set[str]:
+        return set(self._sids)
+
+    async def heartbeat(self) -> None:
+        """لا شيء: الحضور يعيش ويموت مع العامل نفسه."""
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RedisPresence:
+    """حضور مشترك بين العمال فوق عميل متوافق مع redis.asyncio.
+
+    لكل مستخدم sorted set: socket id -> وقت انتهاء صلاحيته. كل عامل يجدد
+    sockets المتصلة به (heartbeat) كل PRESENCE_HEARTBEAT_SECONDS، فإن توقف
+    العامل أو أُعيد تشغيله تنتهي sockets الخاصة به بعد PRESENCE_TTL_SECONDS
+    ولا يبقى مستخدموه "متصلين" للأبد. القراءة تتجاهل ما انتهت صلاحيته.
+    """
+
+    def __init__(self, client, key_prefix: str = "presence:", ttl: Optional[int] = None) -> None:
+        self.client = client
+        self.key_prefix = key_prefix
+        self.online_key = f"{key_prefix}online"
+        self.ttl = ttl or settings.PRESENCE_TTL_SECONDS
+        # sockets هذا العامل (للتجديد)
+        self._local: Dict[str, Set[str]] = {}
+
+    def _user_key(self, user_id: str) -> str:
+        return f"{self.key_prefix}user:{user_id}"
+
+    async def add(self, user_id: str, sid: str) -> None:
+        self._local.setdefault(user_id, set()).add(sid)
+        expires_at = time.time() + self.ttl
+        key = self._user_key(user_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {sid: expires_at})
+            pipe.expire(key, self.ttl)
+            pipe.zadd(self.online_key, {user_id: expires_at})
+            await pipe.execute()
+
+    async def remove(self, user_id: str, sid: str) -> int:
+        """إزالة socket وإرجاع عدد sockets المتبقية للمستخدم.
+        WATCH على مفتاح المستخدم: إن أضاف عامل آخر socket (إعادة اتصال) بين العدّ
+        والحذف تُعاد المحاولة، فلا يُحذف مستخدم متصل من قائمة المتصلين."""
+        from redis.exceptions import WatchError
+
+        sids = self._local.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                self._local.pop(user_id, None)
+        key = self._user_key(user_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    now = time.time()
+                    live = await pipe.zcount(key, f"({now}", "+inf")
+                    own = await pipe.zscore(key, sid)
+                    remaining = live - (1 if own is not None and own > now else 0)
+                    pipe.multi()
+                    pipe.zrem(key, sid)
+                    pipe.zremrangebyscore(key, "-inf", now)
+                    if not remaining:
+                        pipe.zrem(self.online_key, user_id)
+                    await pipe.execute()
+                    return remaining
+                except WatchError:
+                    continue
+
+    async def heartbeat(self) -> None:
+        """تجديد صلاحية sockets هذا العامل وتنظيف المنتهي من قائمة المتصلين."""
+        now = time.time()
+        expires_at = now + self.ttl
+        async with self.client.pipeline(transaction=False) as pipe:
+            for user_id, sids in self._local.items():
+                key = self._user_key(user_id)
+                pipe.zadd(key, {sid: expires_at for sid in sids})
+                pipe.expire(key, self.ttl)
+                pipe.zadd(self.online_key, {user_id: expires_at})
+            pipe.zremrangebyscore(self.online_key, "-inf", now)
+            await pipe.execute()
+
+    async def sids(self, user_id: str) -> Set[str]:
+        members = await self.client.zrangebyscore(self._user_key(user_id), f"({time.time()}", "+inf")
+        return {_decode(s) for s in members}
+
+    async def is_online(self, user_id: str) -> bool:
+        return bool(await self.client.zcount(self._user_key(user_id), f"({time.time()}", "+inf"))
+
+    async def online_user_ids(self) -> Set[str]:
+        members = await self.client.zrangebyscore(self.online_key, f"({time.time()}", "+inf")
+        return {_decode(u) for u in members}
+
+
+_presence = None
+
+
+def _create_presence():
+    """إنشاء مخزن الحضور حسب PRESENCE_BACKEND (memory | redis)."""
+    if (settings.PRESENCE_BACKEND or "memory").lower() == "redis":
+        url = settings.PRESENCE_REDIS_URL
+        if not url and (settings.SOCKETIO_MESSAGE_QUEUE or "").startswith(("redis://", "rediss://")):
+            url = settings.SOCKETIO_MESSAGE_QUEUE
+        try:
+            import redis.asyncio as redis_asyncio  # optional dependency
+        except ImportError:
+            logger.warning("PRESENCE_BACKEND=redis but the 'redis' package is not installed; using memory presence")
+        else:
+            if url:
+                return RedisPresence(redis_asyncio.from_url(url))
+            logger.warning("PRESENCE_BACKEND=redis but no Redis URL is configured; using memory presence")
+    return MemoryPresence()
+
+
+def get_presence():
+    """مخزن الحضور الحالي (يُنشأ مرة واحدة)."""
+    global _presence
+    if _presence is None:
+        _presence = _create_presence()
+    return _presence
+
+
+def set_presence(backend) -> None:
+    """استبدال مخزن الحضور (مثلاً RedisPresence فوق عميل وهمي محلي)."""
+    global _presence
+    _presence = backend
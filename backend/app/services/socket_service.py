@@ -2,32 +2,88 @@
 Socket.IO service for real-time chat communication.
 """
 import socketio
-from typing import Dict, Set, Optional
+import time
+from typing import Dict, Set, Optional, Tuple
 from beanie import PydanticObjectId as OID
-from app.models import User, Patient, Doctor, ChatRoom, ChatMessage
-from app.constants import Role
-from jose import jwt, JWTError
+from app.models import User, ChatRoom
 from app.config import get_settings
+from app.services import chat_engine, chat_service
+from app.services.auth_cache import decode_access_token, get_principal
+from app.services.offline_delivery import offline_delivery
+from app.services.read_receipts import read_receipts
+from app.services.socket_broker import create_client_manager, get_presence
+from app.utils.realtime_log import realtime_log
 
 settings = get_settings()
 
 # Create Socket.IO server
+# With SOCKETIO_MESSAGE_QUEUE set, emits fan out to sockets on every worker
+# Per-packet socketio/engineio logs only in debug mode (see app.utils.realtime_log)
 sio = socketio.AsyncServer(
     cors_allowed_origins="*",
     async_mode='asgi',
-    logger=True,
-    engineio_logger=True
+    client_manager=create_client_manager(),
+    logger=settings.realtime_debug,
+    engineio_logger=settings.realtime_debug
 )
 
-# Store active connections: userId -> Set of socketIds
-active_connections: Dict[str, Set[str]] = {}
+# Online presence (userId -> socketIds), shared between workers when PRESENCE_BACKEND=redis
+presence = get_presence()
 
+# Per-socket state lives on the worker that owns the socket:
 # Store socket rooms: socketId -> Set of roomIds
 socket_rooms: Dict[str, Set[str]] = {}
 
 # Store user data per socket: socketId -> user_data
 socket_users: Dict[str, dict] = {}
 
+# Authorized rooms per socket: socketId -> {patientId: (ChatRoom, expires_at)}
+# Filled on join_conversation / first send so the send path skips room resolution.
+# An entry is used only while it is unexpired and the socket is still in the patient's
+# auth room; invalidate_patient_rooms() closes that room on every worker.
+socket_room_cache: Dict[str, Dict[str, Tuple[ChatRoom, float]]] = {}
+
+
+def _auth_room(patient_id: str) -> str:
+    return f"auth_{patient_id}"
+
+
+def _cache_fresh(sid: str, patient_id: str, expires_at: float) -> bool:
+    return expires_at > time.monotonic() and _auth_room(patient_id) in sio.rooms(sid)
+
+
+async def _resolve_room_cached(sid: str, user: User, patient_id: str) -> ChatRoom:
+    """Resolve (and authorize) the chat room for this socket, using the per-socket cache."""
+    entry = socket_room_cache.get(sid, {}).get(patient_id)
+    if entry and _cache_fresh(sid, patient_id, entry[1]):
+        return entry[0]
+    try:
+        room = await chat_engine.resolve_room(user=user, patient_id=patient_id)
+    except chat_engine.ChatAccessError:
+        socket_room_cache.get(sid, {}).pop(patient_id, None)
+        raise
+    if sid in socket_users:
+        await sio.enter_room(sid, _auth_room(patient_id))
+        socket_room_cache.setdefault(sid, {})[patient_id] = (
+            room, time.monotonic() + settings.SOCKET_ROOM_CACHE_TTL_SECONDS
+        )
+    return room
+
+
+async def invalidate_patient_rooms(patient_id: str) -> None:
+    """Drop cached room authorizations for a patient (e.g. after doctor_ids change).
+    Closing the auth room goes through the client manager, so sockets on every worker
+    re-authorize on their next event; SOCKET_ROOM_CACHE_TTL_SECONDS is only a fallback.
+    """
+    for rooms in socket_room_cache.values():
+        rooms.pop(patient_id, None)
+    await sio.close_room(_auth_room(patient_id))
+
+
+async def is_user_online(user_id: str) -> bool:
+    """Whether the user has at least one connected socket on any worker."""
+    return await presence.is_online(user_id)
+
 
 @sio.on('connect')
 async def connect(sid: str, environ: dict, auth: dict):
@@ -43,22 +99,21 @@ async def connect(sid: str, environ: dict, auth: dict):
                 token = auth_header.replace('Bearer ', '')
         
         if not token:
-            print(f"❌ Connection rejected for {sid}: No token")
+            realtime_log.event("connect_rejected", sid=sid, reason="no_token")
             await sio.disconnect(sid)
             return False
         
         # Decode JWT
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+        payload = decode_access_token(token)
         user_id_str = payload.get("sub")
         if not user_id_str:
-            print(f"❌ Connection rejected for {sid}: No user ID in token")
+            realtime_log.event("connect_rejected", sid=sid, reason="no_user_id")
             await sio.disconnect(sid)
             return False
         
-        user_id = OID(user_id_str)
-        user = await User.get(user_id)
+        user = await get_principal(user_id_str)
         if not user:
-            print(f"❌ Connection rejected for {sid}: User not found")
+            realtime_log.event("connect_rejected", sid=sid, reason="user_not_found")
             await sio.disconnect(sid)
             return False
         
@@ -71,18 +126,21 @@ async def connect(sid: str, environ: dict, auth: dict):
         
         # Track active connection
         user_id_key = str(user.id)
-        if user_id_key not in active_connections:
-            active_connections[user_id_key] = set()
-        active_connections[user_id_key].add(sid)
+        was_online = await presence.is_online(user_id_key)
+        await presence.add(user_id_key, sid)
         socket_rooms[sid] = set()
         
         # Join user's personal room
         await sio.enter_room(sid, f"user_{user_id_key}")
         
-        print(f"✅ User connected: {user_id_key} ({user.name}) - Socket: {sid}")
+        realtime_log.count("connects")
+        if not was_online:
+            # Replay what the user missed while offline (after the connect handshake)
+            sio.start_background_task(_replay_missed, sid, user.id)
+        realtime_log.event("connect", sid=sid, user_id=user_id_key)
         return True
     except Exception as e:
-        print(f"❌ Connection error for {sid}: {e}")
+        realtime_log.error("connect_error", sid=sid, error=str(e))
         await sio.disconnect(sid)
         return False
 
@@ -94,19 +152,21 @@ async def disconnect(sid: str):
     user_data = socket_users.pop(sid, None)
     user_id = user_data.get('user_id') if user_data else None
     
-    # Remove from active connections
-    if user_id and user_id in active_connections:
-        active_connections[user_id].discard(sid)
-        if not active_connections[user_id]:
-            active_connections.pop(user_id, None)
+    # Remove from presence
+    if user_id:
+        remaining = await presence.remove(user_id, sid)
+        if not remaining:
+            try:
+                await offline_delivery.mark_offline(OID(user_id))
+            except Exception as e:
+                realtime_log.error("delivery_cursor_error", user_id=user_id, error=str(e))
     
     # Remove socket rooms
     socket_rooms.pop(sid, None)
+    socket_room_cache.pop(sid, None)
     
-    if user_id:
-        print(f"❌ User disconnected: {user_id} - Socket: {sid}")
-    else:
-        print(f"❌ Socket disconnected: {sid}")
+    realtime_log.count("disconnects")
+    realtime_log.event("disconnect", sid=sid, user_id=user_id)
 
 
 @sio.on('join_conversation')
@@ -127,43 +187,11 @@ async def join_conversation(sid: str, data: dict):
         user_id = user_data['user_id']
         user = user_data['user']
         
-        # Get or create room
+        # Get or create room (shared access rules)
         try:
-            patient = await Patient.get(OID(patient_id))
-        except Exception:
-            await sio.emit('error', {'message': 'المريض غير موجود', 'code': 'E404'}, room=sid)
-            return
-        
-        room = None
-        if user.role == Role.DOCTOR:
-            doctor = await Doctor.find_one(Doctor.user_id == user.id)
-            if not doctor or doctor.id not in patient.doctor_ids:
-                await sio.emit('error', {'message': 'غير مصرح', 'code': 'E403'}, room=sid)
-                return
-            room = await ChatRoom.find_one(
-                ChatRoom.patient_id == patient.id,
-                ChatRoom.doctor_id == doctor.id
-            )
-            if not room:
-                room = ChatRoom(patient_id=patient.id, doctor_id=doctor.id)
-                await room.insert()
-        elif user.role == Role.PATIENT:
-            if patient.user_id != user.id:
-                await sio.emit('error', {'message': 'غير مصرح', 'code': 'E403'}, room=sid)
-                return
-            if not patient.doctor_ids:
-                await sio.emit('error', {'message': 'لا يوجد طبيب معين', 'code': 'E403'}, room=sid)
-                return
-            doctor_id = patient.doctor_ids[0]
-            room = await ChatRoom.find_one(
-                ChatRoom.patient_id == patient.id,
-                ChatRoom.doctor_id == doctor_id
-            )
-            if not room:
-                room = ChatRoom(patient_id=patient.id, doctor_id=doctor_id)
-                await room.insert()
-        else:
-            await sio.emit('error', {'message': 'غير مصرح', 'code': 'E403'}, room=sid)
+            room = await _resolve_room_cached(sid, user, str(patient_id))
+        except chat_engine.ChatAccessError as e:
+            await sio.emit('error', {'message': e.message, 'code': f'E{e.status_code}'}, room=sid)
             return
         
         # Join room
@@ -174,10 +202,10 @@ async def join_conversation(sid: str, data: dict):
         if sid in socket_rooms:
             socket_rooms[sid].add(str(room.id))
         
-        print(f"👤 User {user_id} joined conversation {room.id}")
+        realtime_log.event("join", sid=sid, user_id=user_id, room_id=str(room.id))
         await sio.emit('joined_conversation', {'room_id': str(room.id), 'patient_id': patient_id}, room=sid)
     except Exception as e:
-        print(f"❌ Error joining conversation: {e}")
+        realtime_log.error("join_error", sid=sid, error=str(e))
         await sio.emit('error', {'message': f'خطأ في الانضمام للمحادثة: {str(e)}', 'code': 'E500'}, room=sid)
 
 
@@ -194,10 +222,10 @@ async def leave_conversation(sid: str, data: dict):
             if sid in socket_rooms:
                 socket_rooms[sid].discard(room_id)
             
-            print(f"👋 Socket {sid} left conversation {room_id}")
+            realtime_log.event("leave", sid=sid, room_id=room_id)
             await sio.emit('left_conversation', {'room_id': room_id}, room=sid)
     except Exception as e:
-        print(f"❌ Error leaving conversation: {e}")
+        realtime_log.error("leave_error", sid=sid, error=str(e))
 
 
 @sio.on('send_message')
@@ -225,79 +253,86 @@ async def send_message(sid: str, data: dict):
         user_id = user_data['user_id']
         user = user_data['user']
         
-        # Get or create room (same logic as join_conversation)
+        # Get or create room (shared access rules)
         try:
-            patient = await Patient.get(OID(patient_id))
-        except Exception:
-            await sio.emit('error', {'message': 'المريض غير موجود', 'code': 'E404'}, room=sid)
-            return
-        
-        room = None
-        if user.role == Role.DOCTOR:
-            doctor = await Doctor.find_one(Doctor.user_id == user.id)
-            if not doctor or doctor.id not in patient.doctor_ids:
-                await sio.emit('error', {'message': 'غير مصرح', 'code': 'E403'}, room=sid)
-                return
-            room = await ChatRoom.find_one(
-                ChatRoom.patient_id == patient.id,
-                ChatRoom.doctor_id == doctor.id
-            )
-            if not room:
-                room = ChatRoom(patient_id=patient.id, doctor_id=doctor.id)
-                await room.insert()
-        elif user.role == Role.PATIENT:
-            if patient.user_id != user.id:
-                await sio.emit('error', {'message': 'غير مصرح', 'code': 'E403'}, room=sid)
-                return
-            if not patient.doctor_ids:
-                await sio.emit('error', {'message': 'لا يوجد طبيب معين', 'code': 'E403'}, room=sid)
-                return
-            doctor_id = patient.doctor_ids[0]
-            room = await ChatRoom.find_one(
-                ChatRoom.patient_id == patient.id,
-                ChatRoom.doctor_id == doctor_id
-            )
-            if not room:
-                room = ChatRoom(patient_id=patient.id, doctor_id=doctor_id)
-                await room.insert()
-        else:
-            await sio.emit('error', {'message': 'غير مصرح', 'code': 'E403'}, room=sid)
+            room = await _resolve_room_cached(sid, user, str(patient_id))
+        except chat_engine.ChatAccessError as e:
+            await sio.emit('error', {'message': e.message, 'code': f'E{e.status_code}'}, room=sid)
             return
         
-        # Create message
-        message = ChatMessage(
-            room_id=room.id,
+        # Persist (batched) and broadcast to the room on every worker
+        message = await chat_engine.engine.send(
+            room=room,
             sender_user_id=user.id,
             content=content or "",
-            imageUrl=image_url,
-            is_read=False
+            image_url=image_url,
         )
-        await message.insert()
-        
-        # Broadcast to room
-        room_key = f"room_{room.id}"
-        message_data = {
-            "id": str(message.id),
-            "room_id": str(message.room_id),
-            "sender_user_id": str(message.sender_user_id) if message.sender_user_id else None,
-            "content": message.content,
-            "imageUrl": message.imageUrl,
-            "is_read": message.is_read,
-            "created_at": message.created_at.isoformat()
-        }
+        await sio.emit('message_sent', {'message': chat_engine.message_payload(message)}, room=sid)
         
-        await sio.emit('message_received', {'message': message_data}, room=room_key)
-        await sio.emit('message_sent', {'message': message_data}, room=sid)
-        
-        print(f"📨 Message sent from {user_id} in room {room.id}")
+        realtime_log.event("message", sid=sid, user_id=user_id, room_id=str(room.id))
     except Exception as e:
-        print(f"❌ Error sending message: {e}")
+        realtime_log.error("send_error", sid=sid, error=str(e))
         await sio.emit('error', {'message': f'خطأ في إرسال الرسالة: {str(e)}', 'code': 'E500'}, room=sid)
 
 
+async def _replay_missed(sid: str, user_id: OID) -> None:
+    """Send the next page of messages missed while offline ('missed_messages')."""
+    try:
+        messages, has_more = await offline_delivery.replay(user_id)
+        if messages or has_more:
+            await sio.emit('missed_messages', {
+                'messages': [chat_engine.message_payload(m) for m in messages],
+                'has_more': has_more,
+            }, room=sid)
+            realtime_log.event("replay", sid=sid, user_id=str(user_id), count=len(messages), has_more=has_more)
+    except Exception as e:
+        realtime_log.error("replay_error", sid=sid, error=str(e))
+
+
+@sio.on('sync_missed')
+async def sync_missed(sid: str, data: dict = None):
+    """Client asks for the next page of missed messages (after has_more=True)."""
+    user_data = socket_users.get(sid)
+    if not user_data:
+        await sio.emit('error', {'message': 'غير مصرح', 'code': 'E401'}, room=sid)
+        return
+    await _replay_missed(sid, OID(user_data['user_id']))
+
+
+async def _room_for_socket(sid: str, room_id: str) -> Optional[ChatRoom]:
+    """The room if this socket's user may still use it (same rules as join_conversation).
+    Served from the per-socket cache while fresh; otherwise re-authorized, and a joined
+    room the user has lost access to is left.
+    """
+    user_data = socket_users.get(sid)
+    if not user_data:
+        return None
+    for patient_id, (room, expires_at) in list(socket_room_cache.get(sid, {}).items()):
+        if str(room.id) == room_id and _cache_fresh(sid, patient_id, expires_at):
+            return room
+    try:
+        stored = await ChatRoom.get(OID(room_id))
+    except Exception:
+        stored = None
+    room = None
+    if stored:
+        try:
+            room = await _resolve_room_cached(sid, user_data['user'], str(stored.patient_id))
+        except chat_engine.ChatAccessError:
+            room = None
+    if room is None or str(room.id) != room_id:
+        if room_id in socket_rooms.get(sid, set()):
+            await sio.leave_room(sid, f"room_{room_id}")
+            socket_rooms[sid].discard(room_id)
+        return None
+    return room
+
+
 @sio.on('mark_read')
 async def mark_read(sid: str, data: dict):
-    """Mark messages as read."""
+    """Mark messages as read up to the last one the client saw (coalesced; written at most
+    once per room per second). Without message_id, up to the room's newest stored message.
+    """
     try:
         room_id = data.get('room_id')
         if not room_id:
@@ -312,33 +347,86 @@ async def mark_read(sid: str, data: dict):
         
         user_id = user_data['user_id']
         
-        # Mark messages as read
-        room = await ChatRoom.get(OID(room_id))
+        room = await _room_for_socket(sid, str(room_id))
         if not room:
             await sio.emit('error', {'message': 'المحادثة غير موجودة', 'code': 'E404'}, room=sid)
             return
         
-        # Update unread messages
-        from beanie.operators import Set as UpdateSet
-        await ChatMessage.find(
-            ChatMessage.room_id == room.id,
-            ChatMessage.sender_user_id != OID(user_id),
-            ChatMessage.is_read == False
-        ).update(UpdateSet({"is_read": True}))
+        # High-water mark is a real message id: fresh OID()s from other workers are not ordered
+        message_id = data.get('message_id')
+        if message_id:
+            try:
+                up_to = OID(message_id)
+            except Exception:
+                await sio.emit('error', {'message': 'معرف الرسالة غير صالح', 'code': 'E400'}, room=sid)
+                return
+        else:
+            up_to = await chat_service.latest_message_id(room)
+        if up_to is not None:
+            read_receipts.mark(room, OID(user_id), up_to)
         
         await sio.emit('marked_read', {'room_id': room_id}, room=sid)
     except Exception as e:
-        print(f"❌ Error marking messages as read: {e}")
+        realtime_log.error("mark_read_error", sid=sid, error=str(e))
         await sio.emit('error', {'message': f'خطأ في تعليم الرسائل كمقروءة: {str(e)}', 'code': 'E500'}, room=sid)
 
 
+@sio.on('read_up_to')
+async def read_up_to(sid: str, data: dict):
+    """Ephemeral read receipt: everything up to message_id (inclusive) was read.
+    Relayed to the room immediately; persisted to ChatMessage.is_read in coalesced batches.
+    """
+    try:
+        room_id = str(data.get('room_id') or '')
+        message_id = data.get('message_id')
+        user_data = socket_users.get(sid)
+        if not user_data:
+            await sio.emit('error', {'message': 'غير مصرح', 'code': 'E401'}, room=sid)
+            return
+        try:
+            up_to = OID(message_id)
+        except Exception:
+            await sio.emit('error', {'message': 'معرف الرسالة غير صالح', 'code': 'E400'}, room=sid)
+            return
+        room = await _room_for_socket(sid, room_id)
+        if not room:
+            await sio.emit('error', {'message': 'المحادثة غير موجودة', 'code': 'E404'}, room=sid)
+            return
+        
+        read_receipts.mark(room, OID(user_data['user_id']), up_to)
+        await sio.emit('read_up_to', {
+            'room_id': room_id,
+            'user_id': user_data['user_id'],
+            'message_id': str(up_to),
+        }, room=f"room_{room_id}", skip_sid=sid)
+    except Exception as e:
+        realtime_log.error("read_up_to_error", sid=sid, error=str(e))
+
+
+@sio.on('typing')
+async def typing(sid: str, data: dict):
+    """Ephemeral typing indicator for a joined conversation (never persisted)."""
+    room_id = str(data.get('room_id') or '')
+    user_data = socket_users.get(sid)
+    if not user_data or room_id not in socket_rooms.get(sid, set()):
+        return
+    await sio.emit('typing', {
+        'room_id': room_id,
+        'user_id': user_data['user_id'],
+        'is_typing': bool(data.get('is_typing', True)),
+    }, room=f"room_{room_id}", skip_sid=sid)
+
+
 async def emit_message_to_room(room_id: str, message_data: dict):
     """Emit message to a room (called from HTTP endpoints)."""
+    started = time.perf_counter()
     try:
         room_key = f"room_{room_id}"
         await sio.emit('message_received', {'message': message_data}, room=room_key)
     except Exception as e:
-        print(f"⚠️ Failed to emit message to room {room_id}: {e}")
+        realtime_log.warning("emit_failed", room_id=room_id, error=str(e))
+        return
+    realtime_log.observe("emit", (time.perf_counter() - started) * 1000)
 
 
 def get_socket_app():
@@ -0,0 +1,259 @@
+"""
+خدمة تجميع الإحصائيات اليومية (DailyStats).
+
+- تُحسب العدادات لكل (يوم، طبيب) من المجموعات الخام عبر aggregation.
+- مهمة مجدولة تُجمّع الأيام المنتهية فقط (قبل اليوم الحالي) بشكل تزايدي،
+  مع إعادة حساب آخر ROLLUP_LOOKBACK_DAYS أيام وكل يوم ناقص (فجوة) في التغطية.
+  تعمل على worker واحد فقط (job_lock).
+- تعديل موعد في يوم منتهٍ (إنشاء، تغيير حالة، حذف) يعيد تجميع ذلك اليوم فوراً
+  (invalidate_day)؛ حذفه بدلاً من ذلك قد يقلّص بداية التغطية فلا تعود المهمة إليه.
+- stats_service يجمع الـ rollups للأيام المغطّاة ويحسب الباقي (اليوم والمستقبل) مباشرة.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from beanie import PydanticObjectId as OID
+from beanie.odm.utils.encoder import Encoder
+from pymongo import DeleteMany, ReplaceOne
+
+from app.models import (
+    User, Appointment, TreatmentNote, GalleryImage, ChatRoom, ChatMessage,
+    Notification, AssignmentLog, DailyStats,
+)
+from app.constants import Role
+from app.services.job_lock import job_lock
+from app.utils.logger import get_logger
+
+logger = get_logger("stats_rollup")
+
+# عدد الأيام المنتهية التي يُعاد حسابها في كل تشغيل للمهمة المجدولة
+ROLLUP_LOOKBACK_DAYS = 7
+# حجم الدفعة (بالأيام) عند الـ backfill لتقييد حجم كل aggregation
+BACKFILL_CHUNK_DAYS = 31
+# مهلة قفل المهمة المجدولة (أطول من أي تشغيل متوقع)
+ROLLUP_LOCK_SECONDS = 30 * 60
+
+# مفتاح المواعيد بلا حالة في appointments_by_status (مفاتيح المستند نصية فلا يصلح None)؛
+# المسار المباشر في stats_service يستخدم نفس المفتاح
+UNKNOWN_STATUS = "unknown"
+
+_DAY_FORMAT = "%Y-%m-%d"
+
+
+def as_utc(value: datetime) -> datetime:
+    """إرجاع datetime بتوقيت UTC صريح (القيم المخزنة في Mongo تُقرأ بدون tzinfo)."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def day_start(value: datetime) -> datetime:
+    """بداية اليوم (UTC) الذي يقع فيه التاريخ."""
+    return as_utc(value).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def day_ceil(value: datetime) -> datetime:
+    """أول بداية يوم >= التاريخ."""
+    start = day_start(value)
+    return start if start == as_utc(value) else start + timedelta(days=1)
+
+
+def _parse_day(value: str) -> datetime:
+    return datetime.strptime(value, _DAY_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def _day_key(field: str) -> Dict:
+    return {"$dateToString": {"format": _DAY_FORMAT, "date": f"${field}"}}
+
+
+async def _grouped(model, field: str, start: datetime, end: datetime, extra_match: Dict | None = None,
+                   by: Dict | None = None) -> List[Dict]:
+    """عدّ مستندات النطاق [start, end) مجمّعة حسب اليوم ومفاتيح إضافية."""
+    match = {field: {"$gte": start, "$lt": end}}
+    if extra_match:
+        match.update(extra_match)
+    group_id = {"day": _day_key(field)}
+    group_id.update(by or {})
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": group_id, "count": {"$sum": 1}}},
+    ]
+    return await model.aggregate(pipeline).to_list()
+
+
+async def compute_range(start: datetime, end: datetime) -> List[DailyStats]:
+    """حساب مستندات DailyStats لكل يوم في النطاق [start, end) (بدون حفظ)."""
+    start, end = day_start(start), day_start(end)
+    rows: Dict[Tuple[datetime, Optional[OID]], DailyStats] = {}
+
+    def row(day: str, doctor_id: Optional[OID]) -> DailyStats:
+        key = (_parse_day(day), doctor_id)
+        if key not in rows:
+            rows[key] = DailyStats(day=key[0], doctor_id=doctor_id)
+        return rows[key]
+
+    # صف doctor_id=None لكل يوم حتى تبقى التغطية متصلة
+    day = start
+    while day < end:
+        row(day.strftime(_DAY_FORMAT), None)
+        day += timedelta(days=1)
+
+    for r in await _grouped(User, "created_at", start, end, {"role": Role.PATIENT.value}):
+        row(r["_id"]["day"], None).new_patients += r["count"]
+
+    for r in await _grouped(Appointment, "scheduled_at", start, end, by={"doctor": "$doctor_id", "status": "$status"}):
+        stats = row(r["_id"]["day"], r["_id"].get("doctor"))
+        stats.appointments += r["count"]
+        status = r["_id"].get("status") or UNKNOWN_STATUS
+        stats.appointments_by_status[status] = stats.appointments_by_status.get(status, 0) + r["count"]
+
+    for r in await _grouped(TreatmentNote, "created_at", start, end, by={"doctor": "$doctor_id"}):
+        row(r["_id"]["day"], r["_id"].get("doctor")).notes += r["count"]
+
+    for r in await _grouped(GalleryImage, "created_at", start, end):
+        row(r["_id"]["day"], None).images += r["count"]
+
+    for r in await _grouped(Notification, "sent_at", start, end):
+        row(r["_id"]["day"], None).notifications += r["count"]
+
+    for r in await _grouped(AssignmentLog, "assigned_at", start, end, by={"doctor": "$doctor_id"}):
+        row(r["_id"]["day"], r["_id"].get("doctor")).transfers += r["count"]
+
+    # الرسائل تُنسب للطبيب عبر غرفتها (مسح واحد للغرف)
+    message_rows = await _grouped(ChatMessage, "created_at", start, end, by={"room": "$room_id"})
+    if message_rows:
+        room_doctor = {room.id: room.doctor_id for room in await ChatRoom.find().to_list()}
+        for r in message_rows:
+            row(r["_id"]["day"], room_doctor.get(r["_id"].get("room"))).messages += r["count"]
+
+    return list(rows.values())
+
+
+async def rollup_range(start: datetime, end: datetime) -> int:
+    """إعادة حساب واستبدال DailyStats للنطاق [start, end). يُرجع عدد الأيام.
+    استبدال كل صف بـ upsert على (day, doctor_id) ثم حذف صفوف النطاق الأقدم من هذا
+    التشغيل (أطباء لم يعد لهم نشاط)، فلا توجد لحظة تغيب فيها بيانات النطاق."""
+    start, end = day_start(start), day_start(end)
+    if start >= end:
+        return 0
+    computed_at = datetime.now(timezone.utc)
+    docs = await compute_range(start, end)
+    ops = []
+    for doc in docs:
+        doc.computed_at = computed_at
+        fields = Encoder().encode(doc)
+        fields.pop("_id", None)
+        ops.append(ReplaceOne({"day": doc.day, "doctor_id": doc.doctor_id}, fields, upsert=True))
+    ops.append(DeleteMany({"day": {"$gte": start, "$lt": end}, "computed_at": {"$lt": computed_at}}))
+    await DailyStats.get_motor_collection().bulk_write(ops, ordered=True)
+    return (end - start).days
+
+
+async def invalidate_day(at: datetime) -> None:
+    """تعديل في يوم منتهٍ: إعادة تجميع صفوف ذلك اليوم فوراً.
+    إن فشل ذلك تُحذف صفوفه حتى لا تُعرض أرقام قديمة (ويُحسب مباشرة)."""
+    day = day_start(at)
+    if day >= day_start(datetime.now(timezone.utc)):
+        return
+    try:
+        await rollup_range(day, day + timedelta(days=1))
+        return
+    except Exception as e:
+        logger.error(f"❌ Failed to re-roll daily stats for {day.date()}: {e}")
+    try:
+        await DailyStats.find(DailyStats.day == day).delete()
+    except Exception as e:
+        logger.error(f"❌ Failed to invalidate daily stats for {day.date()}: {e}")
+
+
+async def get_coverage() -> Tuple[Optional[datetime], Optional[datetime]]:
+    """حدود الأيام المُجمَّعة [أول يوم، اليوم التالي لآخر يوم) أو (None, None).
+    قد توجد فجوات داخل الحدود؛ اليوم مغطّى فقط إن وُجد صفه doctor_id=None."""
+    first = await DailyStats.find(DailyStats.doctor_id == None).sort("+day").limit(1).to_list()
+    if not first:
+        return None, None
+    last = await DailyStats.find(DailyStats.doctor_id == None).sort("-day").limit(1).to_list()
+    return as_utc(first[0].day), as_utc(last[0].day) + timedelta(days=1)
+
+
+async def load_rollups(start: datetime, end: datetime) -> List[DailyStats]:
+    """جلب صفوف DailyStats للأيام في النطاق [start, end)."""
+    return await DailyStats.find(DailyStats.day >= start, DailyStats.day < end).to_list()
+
+
+async def earliest_activity_day() -> Optional[datetime]:
+    """أقدم يوم يحتوي على نشاط في أي من المجموعات المُجمَّعة."""
+    candidates = []
+    for model, field in (
+        (User, "created_at"),
+        (Appointment, "scheduled_at"),
+        (TreatmentNote, "created_at"),
+        (GalleryImage, "created_at"),
+        (ChatMessage, "created_at"),
+        (Notification, "sent_at"),
+        (AssignmentLog, "assigned_at"),
+    ):
+        docs = await model.find({field: {"$ne": None}}).sort(f"+{field}").limit(1).to_list()
+        if docs:
+            candidates.append(as_utc(getattr(docs[0], field)))
+    return day_start(min(candidates)) if candidates else None
+
+
+async def backfill(date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> int:
+    """تجميع كل الأيام المنتهية في النطاق على دفعات. يُرجع عدد الأيام."""
+    today = day_start(datetime.now(timezone.utc))
+    start = day_start(date_from) if date_from else await earliest_activity_day()
+    end = min(day_ceil(date_to), today) if date_to else today
+    if start is None:
+        return 0
+    total = 0
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=BACKFILL_CHUNK_DAYS), end)
+        total += await rollup_range(chunk_start, chunk_end)
+        logger.info(f"Rolled up daily stats {chunk_start.date()} -> {chunk_end.date()}")
+        chunk_start = chunk_end
+    return total
+
+
+async def missing_days(start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+    """نطاقات الأيام غير المغطّاة (بلا صف doctor_id=None) داخل [start, end)."""
+    covered = {
+        as_utc(day)
+        for day in await DailyStats.get_motor_collection().distinct(
+            "day", {"doctor_id": None, "day": {"$gte": start, "$lt": end}}
+        )
+    }
+    ranges: List[Tuple[datetime, datetime]] = []
+    day = start
+    while day < end:
+        if day not in covered:
+            if ranges and ranges[-1][1] == day:
+                ranges[-1] = (ranges[-1][0], day + timedelta(days=1))
+            else:
+                ranges.append((day, day + timedelta(days=1)))
+        day += timedelta(days=1)
+    return ranges
+
+
+async def roll_up_pending_days() -> None:
+    """المهمة المجدولة: تجميع الأيام المنتهية منذ آخر تشغيل (مع نافذة إعادة حساب)
+    وملء الفجوات داخل التغطية (أيام أُبطلت أو فاتت)."""
+    try:
+        async with job_lock("daily_stats_rollup", ROLLUP_LOCK_SECONDS) as acquired:
+            if not acquired:
+                logger.info("Daily stats rollup is running on another worker; skipping")
+                return
+            today = day_start(datetime.now(timezone.utc))
+            covered_from, covered_until = await get_coverage()
+            if covered_until is None:
+                start = today - timedelta(days=1)
+            else:
+                start = min(covered_until, today) - timedelta(days=ROLLUP_LOOKBACK_DAYS)
+            days = await rollup_range(start, today)
+            if covered_from is not None and covered_from < start:
+                for gap_start, gap_end in await missing_days(covered_from, start):
+                    days += await rollup_range(gap_start, gap_end)
+            logger.info(f"Daily stats rollup refreshed {days} day(s) up to {today.date()}")
+    except Exception as e:
+        logger.error(f"❌ Error in roll_up_pending_days: {e}")
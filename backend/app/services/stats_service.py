@@ -1,15 +1,36 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, List
 from collections import defaultdict
 
+from beanie.operators import In
+
 from app.models import (
     User, Patient, Doctor, Appointment, TreatmentNote, GalleryImage,
-    ChatRoom, ChatMessage, Notification, DeviceToken, AssignmentLog, OTPRequest
+    ChatRoom, ChatMessage, Notification, DeviceToken, AssignmentLog, OTPRequest, DailyStats
+)
+from app.services.stats_rollup_service import (
+    UNKNOWN_STATUS, as_utc, day_start, day_ceil, get_coverage as get_rollup_coverage, load_rollups,
 )
+from app.config import get_settings
 from app.constants import Role
+from app.utils.cache import cached, invalidate
 from app.utils.logger import get_logger
 
 logger = get_logger("stats_service")
+settings = get_settings()
+
+# كل نتائج الإحصائيات تُخزَّن في هذا الـ namespace وتُبطَل معاً عند الكتابة
+STATS_CACHE_NAMESPACE = "stats"
+
+
+def stats_cached(fn):
+    return cached(STATS_CACHE_NAMESPACE, ttl=settings.STATS_CACHE_TTL_SECONDS)(fn)
+
+
+async def invalidate_stats_cache() -> None:
+    """إبطال الإحصائيات المخزنة بعد الكتابات التي تغيّر الأرقام (مواعيد، سجلات، رسائل، تعيينات)."""
+    await invalidate(STATS_CACHE_NAMESPACE)
 
 
 def parse_dates(date_from: Optional[str], date_to: Optional[str]) -> tuple[Optional[datetime], Optional[datetime]]:
@@ -31,6 +52,105 @@ def format_date_group(date: datetime, group: str) -> str:
         return date.strftime("%Y-%m-%d")
 
 
+# صيغ $dateToString المطابقة لـ format_date_group (نفس النص الناتج حرفياً)
+_PERIOD_FORMATS = {
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+    "year": "%Y",
+}
+
+
+async def _count_by_period(query, field: str, group: str) -> List[Dict]:
+    """عدّ المستندات لكل فترة داخل MongoDB وإرجاع صفوف {period, count} فقط."""
+    date_format = _PERIOD_FORMATS.get(group, _PERIOD_FORMATS["day"])
+    pipeline = [
+        {"$group": {
+            "_id": {"$dateToString": {"format": date_format, "date": f"${field}"}},
+            "count": {"$sum": 1},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "period": "$_id", "count": 1}},
+    ]
+    rows = await query.aggregate(pipeline).to_list()
+    return [{"period": r["period"], "count": r["count"]} for r in rows]
+
+
+def _in_range(query, field: str, start: Optional[datetime], end: Optional[datetime]):
+    """تقييد استعلام find بالنطاق [start, end) على الحقل المحدد (None = بلا حد)."""
+    if start:
+        query = query.find({field: {"$gte": start}})
+    if end:
+        query = query.find({field: {"$lt": end}})
+    return query
+
+
+async def _split_range(
+    df: Optional[datetime], dt: Optional[datetime]
+) -> tuple[List[DailyStats], List[tuple[Optional[datetime], Optional[datetime]]]]:
+    """تقسيم النطاق [df, dt) إلى أيام كاملة مغطّاة بـ DailyStats ونطاقات تُحسب مباشرة.
+
+    يُرجع (rollups, live_ranges). الأيام المغطّاة تنتهي دائماً قبل اليوم الحالي،
+    لذا اليوم الحالي والمستقبل (مثل المواعيد القادمة) يُحسبان من المجموعات الخام.
+    """
+    df = as_utc(df) if df else None
+    dt = as_utc(dt) if dt else None
+    covered_from, covered_until = await get_rollup_coverage()
+    if covered_from is None:
+        return [], [(df, dt)]
+    covered_until = min(covered_until, day_start(datetime.now(timezone.utc)))
+    start = max(day_ceil(df), covered_from) if df else covered_from
+    end = min(day_start(dt), covered_until) if dt else covered_until
+    if start >= end:
+        return [], [(df, dt)]
+
+    # التغطية قد تكون متقطعة (backfill جزئي، مهمة فائتة، يوم أُبطل بعد تعديل):
+    # اليوم مغطّى فقط إن وُجد صفه doctor_id=None، والفجوات تُحسب مباشرة
+    rollups = await load_rollups(start, end)
+    covered = sorted({as_utc(stats.day) for stats in rollups if stats.doctor_id is None})
+    if not covered:
+        return [], [(df, dt)]
+    covered_set = set(covered)
+    rollups = [stats for stats in rollups if as_utc(stats.day) in covered_set]
+
+    live_ranges = []
+    cursor = df
+    for day in covered:
+        if cursor is None or cursor < day:
+            live_ranges.append((cursor, day))
+        cursor = day + timedelta(days=1)
+    if dt is None or cursor < dt:
+        live_ranges.append((cursor, dt))
+    return rollups, live_ranges
+
+
+# مفتاح السلسلة في الرد -> حقل العداد في DailyStats
+_OVERVIEW_SERIES = {
+    "new_patients": "new_patients",
+    "appointments": "appointments",
+    "notes": "notes",
+    "images": "images",
+    "chat_messages": "messages",
+    "notifications": "notifications",
+}
+
+
+async def _live_overview_series(
+    start: Optional[datetime], end: Optional[datetime], group: str
+) -> Dict[str, List[Dict]]:
+    """حساب السلاسل الست مباشرة من المجموعات الخام للنطاق [start, end)."""
+    # التجميع يتم في MongoDB والسلاسل الست تُنفّذ بالتوازي
+    series = await asyncio.gather(
+        _count_by_period(_in_range(User.find(User.role == Role.PATIENT), "created_at", start, end), "created_at", group),
+        _count_by_period(_in_range(Appointment.find(), "scheduled_at", start, end), "scheduled_at", group),
+        _count_by_period(_in_range(TreatmentNote.find(), "created_at", start, end), "created_at", group),
+        _count_by_period(_in_range(GalleryImage.find(), "created_at", start, end), "created_at", group),
+        _count_by_period(_in_range(ChatMessage.find(), "created_at", start, end), "created_at", group),
+        _count_by_period(_in_range(Notification.find(), "sent_at", start, end), "sent_at", group),
+    )
+    return dict(zip(_OVERVIEW_SERIES, series))
+
+
+@stats_cached
 async def get_overview_stats(
     group: str = "day",
     date_from: Optional[str] = None,
@@ -38,85 +158,34 @@ async def get_overview_stats(
 ) -> Dict:
     """ملخص عام شامل: مرضى جدد، مواعيد، سجلات، صور، محادثات، إشعارات."""
     df, dt = parse_dates(date_from, date_to)
-    
-    # بناء queries
-    user_query = User.find(User.role == Role.PATIENT)
-    appointment_query = Appointment.find()
-    note_query = TreatmentNote.find()
-    image_query = GalleryImage.find()
-    chat_room_query = ChatRoom.find()
-    chat_message_query = ChatMessage.find()
-    notification_query = Notification.find()
-    
-    if df:
-        user_query = user_query.find(User.created_at >= df)
-        appointment_query = appointment_query.find(Appointment.scheduled_at >= df)
-        note_query = note_query.find(TreatmentNote.created_at >= df)
-        image_query = image_query.find(GalleryImage.created_at >= df)
-        chat_room_query = chat_room_query.find()  # ChatRoom doesn't have created_at
-        chat_message_query = chat_message_query.find(ChatMessage.created_at >= df)
-        notification_query = notification_query.find(Notification.sent_at >= df)
-    
-    if dt:
-        user_query = user_query.find(User.created_at < dt)
-        appointment_query = appointment_query.find(Appointment.scheduled_at < dt)
-        note_query = note_query.find(TreatmentNote.created_at < dt)
-        image_query = image_query.find(GalleryImage.created_at < dt)
-        chat_message_query = chat_message_query.find(ChatMessage.created_at < dt)
-        notification_query = notification_query.find(Notification.sent_at < dt)
-    
-    # جلب البيانات
-    users = await user_query.to_list()
-    appointments = await appointment_query.to_list()
-    notes = await note_query.to_list()
-    images = await image_query.to_list()
-    chat_messages = await chat_message_query.to_list()
-    notifications = await notification_query.to_list()
-    
-    # تجميع البيانات
-    new_patients = defaultdict(int)
-    appointments_grouped = defaultdict(int)
-    notes_grouped = defaultdict(int)
-    images_grouped = defaultdict(int)
-    messages_grouped = defaultdict(int)
-    notifications_grouped = defaultdict(int)
-    
-    for user in users:
-        period = format_date_group(user.created_at, group)
-        new_patients[period] += 1
-    
-    for app in appointments:
-        period = format_date_group(app.scheduled_at, group)
-        appointments_grouped[period] += 1
-    
-    for note in notes:
-        period = format_date_group(note.created_at, group)
-        notes_grouped[period] += 1
-    
-    for img in images:
-        period = format_date_group(img.created_at, group)
-        images_grouped[period] += 1
-    
-    for msg in chat_messages:
-        period = format_date_group(msg.created_at, group)
-        messages_grouped[period] += 1
-    
-    for notif in notifications:
-        period = format_date_group(notif.sent_at, group)
-        notifications_grouped[period] += 1
-    
-    return {
+    rollups, live_ranges = await _split_range(df, dt)
+    
+    totals = {key: defaultdict(int) for key in _OVERVIEW_SERIES}
+    for stats in rollups:
+        period = format_date_group(stats.day, group)
+        for key, counter in _OVERVIEW_SERIES.items():
+            value = getattr(stats, counter)
+            if value:
+                totals[key][period] += value
+    
+    live_parts = await asyncio.gather(*[
+        _live_overview_series(start, end, group) for start, end in live_ranges
+    ])
+    for part in live_parts:
+        for key, rows in part.items():
+            for r in rows:
+                totals[key][r["period"]] += r["count"]
+    
+    result = {
         "group": group,
         "range": {"from": date_from, "to": date_to},
-        "new_patients": [{"period": k, "count": v} for k, v in sorted(new_patients.items())],
-        "appointments": [{"period": k, "count": v} for k, v in sorted(appointments_grouped.items())],
-        "notes": [{"period": k, "count": v} for k, v in sorted(notes_grouped.items())],
-        "images": [{"period": k, "count": v} for k, v in sorted(images_grouped.items())],
-        "chat_messages": [{"period": k, "count": v} for k, v in sorted(messages_grouped.items())],
-        "notifications": [{"period": k, "count": v} for k, v in sorted(notifications_grouped.items())],
     }
+    for key in _OVERVIEW_SERIES:
+        result[key] = [{"period": k, "count": v} for k, v in sorted(totals[key].items())]
+    return result
 
 
+@stats_cached
 async def get_users_stats() -> Dict:
     """إحصائيات المستخدمين حسب الدور."""
     total_users = await User.count()
@@ -138,22 +207,34 @@ async def get_users_stats() -> Dict:
     }
 
 
+async def _live_appointment_counts(
+    start: Optional[datetime], end: Optional[datetime], now: datetime
+) -> List[Dict]:
+    """عدّ المواعيد في النطاق حسب (الحالة، الطبيب) مع القادمة/الماضية."""
+    query = _in_range(Appointment.find(), "scheduled_at", start, end)
+    pipeline = [
+        {"$group": {
+            "_id": {"status": "$status", "doctor": "$doctor_id"},
+            "count": {"$sum": 1},
+            "upcoming": {"$sum": {"$cond": [
+                {"$and": [{"$gt": ["$scheduled_at", now]}, {"$eq": ["$status", "scheduled"]}]}, 1, 0,
+            ]}},
+            "past": {"$sum": {"$cond": [{"$lt": ["$scheduled_at", now]}, 1, 0]}},
+        }},
+    ]
+    return await query.aggregate(pipeline).to_list()
+
+
+@stats_cached
 async def get_appointments_stats(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None
 ) -> Dict:
     """إحصائيات المواعيد الشاملة."""
     df, dt = parse_dates(date_from, date_to)
+    rollups, live_ranges = await _split_range(df, dt)
     
-    query = Appointment.find()
-    if df:
-        query = query.find(Appointment.scheduled_at >= df)
-    if dt:
-        query = query.find(Appointment.scheduled_at < dt)
-    
-    appointments = await query.to_list()
-    
-    total = len(appointments)
+    total = 0
     by_status = defaultdict(int)
     by_doctor = defaultdict(int)
     
@@ -161,14 +242,26 @@ async def get_appointments_stats(
     upcoming = 0
     past = 0
     
-    for app in appointments:
-        by_status[app.status] += 1
-        by_doctor[str(app.doctor_id)] += 1
-        
-        if app.scheduled_at > now and app.status == "scheduled":
-            upcoming += 1
-        elif app.scheduled_at < now:
-            past += 1
+    # الأيام المُجمَّعة كلها قبل اليوم الحالي، فمواعيدها كلها ماضية
+    for stats in rollups:
+        if not stats.appointments:
+            continue
+        total += stats.appointments
+        past += stats.appointments
+        by_doctor[str(stats.doctor_id)] += stats.appointments
+        for status, count in stats.appointments_by_status.items():
+            by_status[status] += count
+    
+    live_parts = await asyncio.gather(*[
+        _live_appointment_counts(start, end, now) for start, end in live_ranges
+    ])
+    for rows in live_parts:
+        for r in rows:
+            total += r["count"]
+            by_status[r["_id"].get("status") or UNKNOWN_STATUS] += r["count"]
+            by_doctor[str(r["_id"].get("doctor"))] += r["count"]
+            upcoming += r["upcoming"]
+            past += r["past"]
     
     return {
         "total": total,
@@ -180,25 +273,48 @@ async def get_appointments_stats(
     }
 
 
+async def _group_count(source, pipeline: List[Dict]) -> Dict:
+    """تشغيل pipeline ينتهي بـ $group على _id (على نموذج أو استعلام find) وإرجاع خريطة _id -> الصف."""
+    rows = await source.aggregate(pipeline).to_list()
+    return {r["_id"]: r for r in rows}
+
+
+@stats_cached
 async def get_doctors_stats() -> Dict:
-    """إحصائيات الأطباء ومرضاهم."""
+    """إحصائيات الأطباء ومرضاهم.
+
+    عدد الاستعلامات ثابت مهما كان عدد الأطباء: pipeline واحد لكل مجموعة
+    مجمّع حسب doctor_id، وجلب المستخدمين دفعة واحدة.
+    """
     doctors = await Doctor.find().to_list()
-    stats = []
+    user_ids = list({d.user_id for d in doctors if d.user_id})
+    
+    users, patients_by_doctor, appointments_by_doctor, notes_by_doctor = await asyncio.gather(
+        User.find(In(User.id, user_ids)).to_list(),
+        _group_count(Patient, [
+            # $setUnion يزيل التكرار حتى يُعدّ المريض مرة واحدة لكل طبيب
+            {"$project": {"doctor_ids": {"$setUnion": [{"$ifNull": ["$doctor_ids", []]}, []]}}},
+            {"$unwind": "$doctor_ids"},
+            {"$group": {"_id": "$doctor_ids", "count": {"$sum": 1}}},
+        ]),
+        _group_count(Appointment, [
+            {"$group": {
+                "_id": "$doctor_id",
+                "count": {"$sum": 1},
+                "completed": {"$sum": {"$cond": [{"$eq": ["$status", "completed"]}, 1, 0]}},
+            }},
+        ]),
+        _group_count(TreatmentNote, [
+            {"$group": {"_id": "$doctor_id", "count": {"$sum": 1}}},
+        ]),
+    )
+    user_map = {u.id: u for u in users}
     
+    stats = []
     for doctor in doctors:
-        user = await User.get(doctor.user_id)
-        # Count patients where this doctor is in their doctor_ids list
-        from beanie.operators import In
-        patients = await Patient.find(In(Patient.doctor_ids, [doctor.id])).to_list()
-        total_patients = len(patients)
-        
-        appointments = await Appointment.find(Appointment.doctor_id == doctor.id).count()
-        completed = await Appointment.find(
-            Appointment.doctor_id == doctor.id,
-            Appointment.status == "completed"
-        ).count()
-        
-        notes = await TreatmentNote.find(TreatmentNote.doctor_id == doctor.id).count()
+        user = user_map.get(doctor.user_id)
+        total_patients = patients_by_doctor.get(doctor.id, {}).get("count", 0)
+        appointments = appointments_by_doctor.get(doctor.id, {})
         
         stats.append({
             "doctor_id": str(doctor.id),
@@ -208,50 +324,62 @@ async def get_doctors_stats() -> Dict:
             "primary_patients": total_patients,  # For backward compatibility
             "secondary_patients": 0,  # No longer used
             "total_patients": total_patients,
-            "total_appointments": appointments,
-            "completed_appointments": completed,
-            "treatment_notes": notes,
+            "total_appointments": appointments.get("count", 0),
+            "completed_appointments": appointments.get("completed", 0),
+            "treatment_notes": notes_by_doctor.get(doctor.id, {}).get("count", 0),
         })
     
     return {"doctors": stats, "total_doctors": len(stats)}
 
 
+@stats_cached
 async def get_chat_stats(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None
 ) -> Dict:
-    """إحصائيات المحادثات."""
+    """إحصائيات المحادثات.
+
+    الرسائل تُعدّ لكل غرفة داخل MongoDB، ثم تُنسب للطبيب عبر خريطة
+    غرفة -> طبيب من مسح واحد للغرف (بدل ChatRoom.get لكل رسالة).
+    """
     df, dt = parse_dates(date_from, date_to)
-    
-    rooms_query = ChatRoom.find()
-    messages_query = ChatMessage.find()
-    
-    if df:
-        messages_query = messages_query.find(ChatMessage.created_at >= df)
-    if dt:
-        messages_query = messages_query.find(ChatMessage.created_at < dt)
-    
-    total_rooms = await rooms_query.count()
-    total_messages = await messages_query.count()
+    rollups, live_ranges = await _split_range(df, dt)
+    
+    rooms, *live_parts = await asyncio.gather(
+        ChatRoom.find().to_list(),
+        *[
+            _group_count(_in_range(ChatMessage.find(), "created_at", start, end), [
+                {"$group": {"_id": "$room_id", "count": {"$sum": 1}}},
+            ])
+            for start, end in live_ranges
+        ],
+    )
     
     # إحصائيات حسب الطبيب
-    rooms = await rooms_query.to_list()
-    messages = await messages_query.to_list()
-    
+    room_doctor = {room.id: str(room.doctor_id) for room in rooms}
     messages_by_doctor = defaultdict(int)
     rooms_by_doctor = defaultdict(int)
     
     for room in rooms:
         rooms_by_doctor[str(room.doctor_id)] += 1
     
-    for msg in messages:
-        # نحتاج معرف الطبيب من الغرفة
-        room = await ChatRoom.get(msg.room_id)
-        if room:
-            messages_by_doctor[str(room.doctor_id)] += 1
+    total_messages = 0
+    for stats in rollups:
+        if not stats.messages:
+            continue
+        total_messages += stats.messages
+        if stats.doctor_id:
+            messages_by_doctor[str(stats.doctor_id)] += stats.messages
+    
+    for messages_by_room in live_parts:
+        for room_id, row in messages_by_room.items():
+            total_messages += row["count"]
+            doctor_id = room_doctor.get(room_id)
+            if doctor_id:
+                messages_by_doctor[doctor_id] += row["count"]
     
     return {
-        "total_rooms": total_rooms,
+        "total_rooms": len(rooms),
         "total_messages": total_messages,
         "messages_by_doctor": dict(messages_by_doctor),
         "rooms_by_doctor": dict(rooms_by_doctor),
@@ -259,23 +387,24 @@ async def get_chat_stats(
     }
 
 
+@stats_cached
 async def get_notifications_stats(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None
 ) -> Dict:
     """إحصائيات الإشعارات."""
     df, dt = parse_dates(date_from, date_to)
-    
-    query = Notification.find()
-    if df:
-        query = query.find(Notification.sent_at >= df)
-    if dt:
-        query = query.find(Notification.sent_at < dt)
-    
-    total = await query.count()
+    rollups, live_ranges = await _split_range(df, dt)
     
     # عدد الأجهزة المسجلة
-    total_devices = await DeviceToken.find(DeviceToken.active == True).count()
+    total_devices, *live_counts = await asyncio.gather(
+        DeviceToken.find(DeviceToken.active == True).count(),
+        *[
+            _in_range(Notification.find(), "sent_at", start, end).count()
+            for start, end in live_ranges
+        ],
+    )
+    total = sum(stats.notifications for stats in rollups) + sum(live_counts)
     
     return {
         "total_notifications": total,
@@ -284,6 +413,7 @@ async def get_notifications_stats(
     }
 
 
+@stats_cached
 async def get_transfers_stats(
     group: str = "day",
     date_from: Optional[str] = None,
@@ -291,109 +421,119 @@ async def get_transfers_stats(
 ) -> Dict:
     """إحصائيات تحويلات المرضى بين الأطباء."""
     df, dt = parse_dates(date_from, date_to)
-    
-    query = AssignmentLog.find()
-    if df:
-        query = query.find(AssignmentLog.assigned_at >= df)
-    if dt:
-        query = query.find(AssignmentLog.assigned_at < dt)
-    
-    logs = await query.to_list()
+    rollups, live_ranges = await _split_range(df, dt)
     
     by_period = defaultdict(int)
     by_doctor = defaultdict(int)
-    
-    for log in logs:
-        period = format_date_group(log.assigned_at, group)
-        by_period[period] += 1
-        by_doctor[str(log.doctor_id)] += 1
+    total = 0
+    
+    for stats in rollups:
+        if not stats.transfers:
+            continue
+        by_period[format_date_group(stats.day, group)] += stats.transfers
+        by_doctor[str(stats.doctor_id)] += stats.transfers
+        total += stats.transfers
+    
+    for start, end in live_ranges:
+        query = _in_range(AssignmentLog.find(), "assigned_at", start, end)
+        periods, doctors = await asyncio.gather(
+            _count_by_period(query, "assigned_at", group),
+            _group_count(query, [{"$group": {"_id": "$doctor_id", "count": {"$sum": 1}}}]),
+        )
+        for r in periods:
+            by_period[r["period"]] += r["count"]
+            total += r["count"]
+        for doctor_id, row in doctors.items():
+            by_doctor[str(doctor_id)] += row["count"]
     
     return {
         "group": group,
         "range": {"from": date_from, "to": date_to},
         "by_period": [{"period": k, "count": v} for k, v in sorted(by_period.items())],
         "by_doctor": dict(by_doctor),
-        "total_transfers": len(logs),
+        "total_transfers": total,
+    }
+
+
+async def _facet_counts(model, facets: Dict[str, Dict]) -> Dict[str, int]:
+    """عدّ عدة مرشّحات على نفس المجموعة في رحلة واحدة عبر $facet."""
+    pipeline = [
+        {"$facet": {
+            name: [{"$match": match}, {"$count": "n"}]
+            for name, match in facets.items()
+        }},
+    ]
+    rows = await model.aggregate(pipeline).to_list()
+    result = rows[0] if rows else {}
+    return {
+        name: (result.get(name) or [{"n": 0}])[0]["n"]
+        for name in facets
     }
 
 
+@stats_cached
 async def get_dashboard_stats() -> Dict:
     """إحصائيات Dashboard شاملة - ملخص سريع."""
     now = datetime.now(timezone.utc)
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    today_end = today_start + timedelta(days=1)
     this_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     
-    # إحصائيات عامة
-    total_patients = await User.find(User.role == Role.PATIENT).count()
-    total_doctors = await User.find(User.role == Role.DOCTOR).count()
-    total_appointments = await Appointment.count()
-    upcoming_appointments = await Appointment.find(
-        Appointment.scheduled_at > now,
-        Appointment.status == "scheduled"
-    ).count()
-    
-    # إحصائيات اليوم
-    today_patients = await User.find(
-        User.role == Role.PATIENT,
-        User.created_at >= today_start
-    ).count()
-    today_appointments = await Appointment.find(
-        Appointment.scheduled_at >= today_start,
-        Appointment.scheduled_at < today_start + timedelta(days=1)
-    ).count()
-    today_messages = await ChatMessage.find(
-        ChatMessage.created_at >= today_start
-    ).count()
-    
-    # إحصائيات هذا الشهر
-    month_patients = await User.find(
-        User.role == Role.PATIENT,
-        User.created_at >= this_month_start
-    ).count()
-    month_appointments = await Appointment.find(
-        Appointment.scheduled_at >= this_month_start
-    ).count()
-    
-    # إحصائيات المواعيد حسب الحالة
-    scheduled = await Appointment.find(Appointment.status == "scheduled").count()
-    completed = await Appointment.find(Appointment.status == "completed").count()
-    canceled = await Appointment.find(Appointment.status == "canceled").count()
-    
-    # إحصائيات المحادثات
-    total_chat_rooms = await ChatRoom.count()
-    total_chat_messages = await ChatMessage.count()
-    
-    # إحصائيات الإشعارات
-    total_notifications = await Notification.count()
-    active_devices = await DeviceToken.find(DeviceToken.active == True).count()
+    # استعلام واحد لكل مجموعة، وكل المجموعات بالتوازي
+    users, appointments, messages, total_chat_rooms, total_notifications, devices = await asyncio.gather(
+        _facet_counts(User, {
+            "total_patients": {"role": Role.PATIENT.value},
+            "total_doctors": {"role": Role.DOCTOR.value},
+            "today_patients": {"role": Role.PATIENT.value, "created_at": {"$gte": today_start}},
+            "month_patients": {"role": Role.PATIENT.value, "created_at": {"$gte": this_month_start}},
+        }),
+        _facet_counts(Appointment, {
+            "total": {},
+            "upcoming": {"scheduled_at": {"$gt": now}, "status": "scheduled"},
+            "today": {"scheduled_at": {"$gte": today_start, "$lt": today_end}},
+            "month": {"scheduled_at": {"$gte": this_month_start}},
+            "scheduled": {"status": "scheduled"},
+            "completed": {"status": "completed"},
+            "canceled": {"status": "canceled"},
+        }),
+        _facet_counts(ChatMessage, {
+            "total": {},
+            "today": {"created_at": {"$gte": today_start}},
+        }),
+        ChatRoom.count(),
+        Notification.count(),
+        _facet_counts(DeviceToken, {
+            "active": {"active": True},
+        }),
+    )
     
     return {
         "overview": {
-            "total_patients": total_patients,
-            "total_doctors": total_doctors,
-            "total_appointments": total_appointments,
-            "upcoming_appointments": upcoming_appointments,
+            "total_patients": users["total_patients"],
+            "total_doctors": users["total_doctors"],
+            "total_appointments": appointments["total"],
+            "upcoming_appointments": appointments["upcoming"],
         },
         "today": {
-            "new_patients": today_patients,
-            "appointments": today_appointments,
-            "chat_messages": today_messages,
+            "new_patients": users["today_patients"],
+            "appointments": appointments["today"],
+            "chat_messages": messages["today"],
         },
         "this_month": {
-            "new_patients": month_patients,
-            "appointments": month_appointments,
+            "new_patients": users["month_patients"],
+            "appointments": appointments["month"],
         },
         "appointments_by_status": {
-            "scheduled": scheduled,
-            "completed": completed,
-            "canceled": canceled,
+            "scheduled": appointments["scheduled"],
+            "completed": appointments["completed"],
+            "canceled": appointments["canceled"],
         },
         "chat": {
             "total_rooms": total_chat_rooms,
-            "total_messages": total_chat_messages,
+            "total_messages": messages["total"],
         },
         "notifications": {
             "total_sent": total_notifications,
-            "active_devices": active_devices,
+            "active_devices": devices["active"],
         },
     }
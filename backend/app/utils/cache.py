@@ -0,0 +1,179 @@
+"""
+Async response cache with pluggable backends.
+
+- MemoryCache: in-process LRU with per-entry TTL (default, per worker).
+- RedisCache: any redis.asyncio-compatible client, shared across workers.
+  A local fake (e.g. fakeredis.aioredis.FakeRedis) can be passed via set_cache().
+
+Values must be JSON-serializable. Cache failures never break the wrapped call.
+
+Invalidation bumps a per-namespace generation that is part of every key, so
+it costs one write whatever the number of cached entries; entries of older
+generations are never read again and expire by TTL (or LRU in memory).
+"""
+import copy
+import functools
+import inspect
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import get_settings
+from app.utils.logger import get_logger
+
+settings = get_settings()
+logger = get_logger("cache")
+
+_MISSING = object()
+
+
+class MemoryCache:
+    """LRU في الذاكرة مع مدة صلاحية لكل مفتاح."""
+
+    def __init__(self, max_entries: int = 512) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            return _MISSING
+        self._entries.move_to_end(key)
+        # نسخة حتى لا يعدّل المستدعي القيمة المخزنة
+        return copy.deepcopy(value)
+
+    async def set(self, key: str, value: Any, ttl: int) -> None:
+        self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    async def generation(self, namespace: str) -> int:
+        return self._generations.get(namespace, 0)
+
+    async def bump(self, namespace: str) -> None:
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+
+class RedisCache:
+    """Backend مشترك فوق عميل متوافق مع redis.asyncio."""
+
+    def __init__(self, client, key_prefix: str = "cache:") -> None:
+        self.client = client
+        self.key_prefix = key_prefix
+
+    async def get(self, key: str) -> Any:
+        raw = await self.client.get(self.key_prefix + key)
+        if raw is None:
+            return _MISSING
+        return json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: int) -> None:
+        await self.client.set(self.key_prefix + key, json.dumps(value, default=str), ex=ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(self.key_prefix + key)
+
+    async def generation(self, namespace: str) -> int:
+        raw = await self.client.get(f"{self.key_prefix}gen:{namespace}")
+        return int(raw) if raw is not None else 0
+
+    async def bump(self, namespace: str) -> None:
+        # INCR ذري ومشترك بين العمال، بكلفة ثابتة مهما كان عدد المفاتيح
+        await self.client.incr(f"{self.key_prefix}gen:{namespace}")
+
+
+_cache = None
+
+
+def _create_cache():
+    """إنشاء الـ backend حسب CACHE_BACKEND (memory | redis | none)."""
+    backend = (settings.CACHE_BACKEND or "memory").lower()
+    if backend == "none":
+        return None
+    if backend == "redis":
+        try:
+            import redis.asyncio as redis_asyncio  # optional dependency
+        except ImportError:
+            logger.warning("CACHE_BACKEND=redis but the 'redis' package is not installed; using memory cache")
+        else:
+            if settings.CACHE_REDIS_URL:
+                return RedisCache(redis_asyncio.from_url(settings.CACHE_REDIS_URL))
+            logger.warning("CACHE_BACKEND=redis but CACHE_REDIS_URL is not set; using memory cache")
+    return MemoryCache(max_entries=settings.CACHE_MAX_ENTRIES)
+
+
+def get_cache():
+    """الـ backend الحالي (يُنشأ مرة واحدة)، أو None إذا كان الكاش معطلاً."""
+    global _cache
+    if _cache is None:
+        _cache = _create_cache() or False
+    return _cache or None
+
+
+def set_cache(backend) -> None:
+    """استبدال الـ backend (مثلاً بعميل Redis وهمي محلي). None يعطّل الكاش."""
+    global _cache
+    _cache = backend if backend is not None else False
+
+
+def _make_key(namespace: str, generation: int, fn: Callable, arguments: dict) -> str:
+    payload = json.dumps(sorted(arguments.items()), default=str, separators=(",", ":"))
+    return f"{namespace}:{generation}:{fn.__module__}.{fn.__name__}:{payload}"
+
+
+def cached(namespace: str, ttl: Optional[int] = None) -> Callable:
+    """Decorator لتخزين نتيجة دالة async حسب معاملاتها داخل namespace قابل للإبطال."""
+
+    def decorator(fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None:
+                return await fn(*args, **kwargs)
+            # نفس المفتاح للمعاملات الموضعية والمسماة والقيم الافتراضية
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = None
+            try:
+                key = _make_key(namespace, await cache.generation(namespace), fn, bound.arguments)
+                value = await cache.get(key)
+            except Exception as e:
+                logger.warning(f"Cache get failed for {namespace}: {e}")
+                value = _MISSING
+            if value is not _MISSING:
+                return value
+            value = await fn(*args, **kwargs)
+            if key is None:
+                return value
+            try:
+                await cache.set(key, value, ttl or settings.CACHE_DEFAULT_TTL_SECONDS)
+            except Exception as e:
+                logger.warning(f"Cache set failed for {namespace}: {e}")
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+async def invalidate(namespace: str) -> None:
+    """إبطال كل المفاتيح المخزنة في namespace بزيادة رقم جيله (لا يرفع استثناءات)."""
+    cache = get_cache()
+    if cache is None:
+        return
+    try:
+        await cache.bump(namespace)
+    except Exception as e:
+        logger.warning(f"Cache invalidation failed for {namespace}: {e}")
@@ -0,0 +1,35 @@
+"""
+Opaque keyset cursors over (created_at, _id).
+
+The cursor is base64url("<epoch milliseconds>:<ObjectId>") so clients treat it
+as an opaque token; decode_cursor raises ValueError for anything malformed.
+"""
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone
+from typing import Tuple
+
+from beanie import PydanticObjectId as OID
+from bson.errors import InvalidId
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(created_at: datetime, doc_id: OID) -> str:
+    """ترميز موضع (created_at, _id) كنص غير شفاف."""
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    # MongoDB تخزن التواريخ بدقة الميلي ثانية
+    millis = (created_at - _EPOCH) // timedelta(milliseconds=1)
+    raw = f"{millis}:{doc_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, OID]:
+    """فك ترميز cursor إلى (created_at, _id). يرفع ValueError إذا كان غير صالح."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        millis, doc_id = base64.urlsafe_b64decode(padded.encode()).decode().split(":", 1)
+        return _EPOCH + timedelta(milliseconds=int(millis)), OID(doc_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
@@ -1,9 +1,13 @@
 import asyncio
+import hashlib
+import os
+import uuid
 from datetime import datetime
-from typing import Optional
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
 
 import boto3
-from fastapi import HTTPException
+from fastapi import HTTPException, UploadFile
 
 from app.config import get_settings
 from app.utils.logger import get_logger
@@ -104,3 +108,130 @@ async def upload_clinic_image(
         return f"r2-disabled://{key}"
 
 
+
+
+# حجم القطعة عند القراءة/الكتابة المتدفقة
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# مقاسات المصغّرات (أطول ضلع بالبكسل)
+THUMBNAIL_SIZES = (160, 480)
+_R2_DISABLED = "r2-disabled://"
+
+
+def _write_chunk(f, hasher, chunk: bytes) -> None:
+    # hashlib يحرر GIL للقطع الكبيرة؛ الكتابة والتجزئة معاً خارج حلقة الأحداث
+    hasher.update(chunk)
+    f.write(chunk)
+
+
+async def upload_clinic_image_stream(
+    patient_id: str,
+    folder: str,
+    upload: UploadFile,
+    content_type: str = "image/jpeg",
+    max_bytes: Optional[int] = None,
+) -> Tuple[str, str]:
+    """
+    Stream an uploaded image to storage in chunks and return (path, sha256).
+
+    Local storage only (DEV MODE, like upload_clinic_image): the file is written
+    under media/ and returned as an r2-disabled:// path.
+
+    Unlike upload_clinic_image the file is never fully held in memory: chunks are
+    hashed and written through the default thread pool. The object is named after
+    its content hash, so re-sending the same photo reuses the stored file:
+        patients/{patient_id}/{folder}/{sha256}{ext}
+    """
+    if not patient_id:
+        raise HTTPException(status_code=400, detail="Missing patient_id for upload")
+    if not folder:
+        raise HTTPException(status_code=400, detail="Missing folder for upload")
+
+    ext = _ext_from_content_type(content_type)
+    # DEV MODE: R2 موقَّف حاليًا – نحفظ الصور محلياً في مجلد media
+    folder_path = Path("media") / "patients" / patient_id / folder
+    await asyncio.to_thread(folder_path.mkdir, parents=True, exist_ok=True)
+    part_path = folder_path / f".{uuid.uuid4().hex}.part"
+
+    hasher = hashlib.sha256()
+    size = 0
+    f = await asyncio.to_thread(open, part_path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise HTTPException(status_code=413, detail="File too large")
+            await asyncio.to_thread(_write_chunk, f, hasher, chunk)
+    except BaseException:
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(part_path.unlink, missing_ok=True)
+        raise
+    await asyncio.to_thread(f.close)
+    if not size:
+        await asyncio.to_thread(part_path.unlink, missing_ok=True)
+        raise HTTPException(status_code=400, detail="Empty file")
+
+    digest = hasher.hexdigest()
+    key = f"patients/{patient_id}/{folder}/{digest}{ext}"
+    final_path = Path("media") / key
+    if final_path.exists():
+        await asyncio.to_thread(part_path.unlink, missing_ok=True)
+    else:
+        await asyncio.to_thread(os.replace, part_path, final_path)
+    logger.info(f"Saved file locally to: {final_path} ({size} bytes)")
+    return f"{_R2_DISABLED}{key}", digest
+
+
+def _render_thumbnails(source: Path, sizes: Iterable[int]) -> Dict[int, Path]:
+    """إنشاء مصغّرات WebP بجانب الملف الأصلي (تُتخطى الموجودة مسبقاً)."""
+    from PIL import Image, ImageOps
+
+    sizes = sorted(set(sizes), reverse=True)
+    targets = {size: source.with_name(f"{source.stem}_{size}.webp") for size in sizes}
+    missing = [size for size, target in targets.items() if not target.exists()]
+    if missing:
+        with Image.open(source) as img:
+            # JPEG: فك الترميز بمقياس مصغّر مباشرة (أسرع بكثير لصور الكاميرا)
+            img.draft("RGB", (missing[0], missing[0]))
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            for size in missing:
+                thumb = img.copy()
+                thumb.thumbnail((size, size))
+                # ملف مؤقت فريد ثم استبدال ذري: طلبان متزامنان لنفس الصورة لا يقرأ أحدهما
+                # مصغّراً نصف مكتوب
+                part = targets[size].with_name(f".{targets[size].name}.{uuid.uuid4().hex}.part")
+                try:
+                    thumb.save(part, "WEBP", quality=80)
+                    os.replace(part, targets[size])
+                except BaseException:
+                    part.unlink(missing_ok=True)
+                    raise
+    return targets
+
+
+async def create_thumbnails(image_path: str, sizes: Iterable[int] = THUMBNAIL_SIZES) -> Dict[str, str]:
+    """
+    Generate WebP thumbnails for a stored image in a worker thread.
+
+    Local storage only: works on r2-disabled://… paths (files under media/), as
+    written by upload_clinic_image_stream. Returns {"<size>": path} in the same
+    scheme; an empty dict if the file is not a readable image or is stored elsewhere.
+    """
+    if not image_path.startswith(_R2_DISABLED):
+        logger.warning(f"Thumbnails are only generated for local storage; skipping {image_path}")
+        return {}
+    key = image_path[len(_R2_DISABLED):]
+    try:
+        rendered = await asyncio.to_thread(_render_thumbnails, Path("media") / key, tuple(sizes))
+    except Exception as e:
+        logger.warning(f"Failed to create thumbnails for {key}: {e}")
+        return {}
+    media_dir = Path("media")
+    return {
+        str(size): f"{_R2_DISABLED}{path.relative_to(media_dir).as_posix()}"
+        for size, path in sorted(rendered.items())
+    }
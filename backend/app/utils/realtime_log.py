@@ -0,0 +1,106 @@
+"""
+Logging and counters for the realtime layer (Socket.IO / WebSocket chat).
+
+Modes (REALTIME_LOG_MODE, defaults to "debug" when APP_DEBUG else "production"):
+- debug: every event is logged, plus python-socketio / engine.io logs.
+- production: per-event logs are structured (JSON) and sampled at
+  REALTIME_LOG_SAMPLE_RATE; warnings/errors are always logged. Counters
+  (connects/sec, messages/sec, emit latency) are summarized every
+  REALTIME_METRICS_INTERVAL_SECONDS.
+"""
+import json
+import random
+import time
+from typing import Dict, List
+
+from app.config import get_settings
+from app.utils.logger import get_logger
+
+settings = get_settings()
+
+# عدد عينات الكمون المحفوظة بين تقريرين
+_LATENCY_RESERVOIR = 2048
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class RealtimeLog:
+    """سجل أحداث مع أخذ عينات وعدادات للطبقة اللحظية."""
+
+    def __init__(self, debug: bool, sample_rate: float) -> None:
+        self.debug = debug
+        self.sample_rate = sample_rate
+        self.logger = get_logger("realtime")
+        self._counters: Dict[str, int] = {}
+        self._latencies: Dict[str, List[float]] = {}
+        self._latency_seen: Dict[str, int] = {}
+        self._window_started = time.monotonic()
+
+    def _format(self, event: str, fields: dict) -> str:
+        if self.debug:
+            details = " ".join(f"{k}={v}" for k, v in fields.items())
+            return f"{event} {details}".rstrip()
+        return json.dumps({"event": event, **fields}, default=str, ensure_ascii=False)
+
+    def event(self, event: str, **fields) -> None:
+        """حدث عادي (اتصال، انضمام، رسالة): كامل في debug، وعينة في production."""
+        if self.debug:
+            self.logger.info(self._format(event, fields))
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            self.logger.info(self._format(event, {**fields, "sampled": self.sample_rate}))
+
+    def warning(self, event: str, **fields) -> None:
+        self.logger.warning(self._format(event, fields))
+
+    def error(self, event: str, **fields) -> None:
+        self.logger.error(self._format(event, fields))
+
+    def count(self, name: str, n: int = 1) -> None:
+        self._counters[name] = self._counters.get(name, 0) + n
+
+    def observe(self, name: str, millis: float) -> None:
+        """تسجيل زمن (ms) مع reservoir sampling لحجم ذاكرة ثابت."""
+        samples = self._latencies.setdefault(name, [])
+        seen = self._latency_seen.get(name, 0) + 1
+        self._latency_seen[name] = seen
+        if len(samples) < _LATENCY_RESERVOIR:
+            samples.append(millis)
+        else:
+            slot = random.randrange(seen)
+            if slot < _LATENCY_RESERVOIR:
+                samples[slot] = millis
+
+    def snapshot(self, reset: bool = True) -> dict:
+        """المعدلات (لكل ثانية) والكمون منذ آخر لقطة."""
+        elapsed = max(time.monotonic() - self._window_started, 1e-9)
+        data = {
+            "window_s": round(elapsed, 1),
+            "rates": {name: round(value / elapsed, 2) for name, value in self._counters.items()},
+            "totals": dict(self._counters),
+            "latency_ms": {
+                name: {
+                    "p50": round(_percentile(samples, 0.5), 2),
+                    "p95": round(_percentile(samples, 0.95), 2),
+                    "n": self._latency_seen.get(name, 0),
+                }
+                for name, samples in self._latencies.items() if samples
+            },
+        }
+        if reset:
+            self._counters = {}
+            self._latencies = {}
+            self._latency_seen = {}
+            self._window_started = time.monotonic()
+        return data
+
+    async def report(self) -> None:
+        """مهمة مجدولة: تسجيل ملخص العدادات."""
+        data = self.snapshot()
+        if data["totals"] or data["latency_ms"]:
+            self.logger.info(json.dumps({"event": "realtime_metrics", **data}, ensure_ascii=False))
+
+
+realtime_log = RealtimeLog(debug=settings.realtime_debug, sample_rate=settings.REALTIME_LOG_SAMPLE_RATE)
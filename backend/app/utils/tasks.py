@@ -0,0 +1,27 @@
+"""
+مهام الخلفية (fire-and-forget) مع الاحتفاظ بمراجعها.
+
+asyncio يحتفظ بمرجع ضعيف فقط للمهام؛ مهمة بلا مرجع قد تُجمع قبل انتهائها،
+واستثناؤها لا يظهر إلا كتحذير "Task exception was never retrieved".
+spawn() يحفظ المهمة في مجموعة المالك حتى تنتهي ويسجّل فشلها.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Set
+
+
+def spawn(coro: Awaitable, tasks: Set[asyncio.Task], logger: logging.Logger, what: str) -> asyncio.Task:
+    """تشغيل coro في الخلفية؛ المرجع في tasks حتى الانتهاء، والفشل يُسجَّل باسم what."""
+    task = asyncio.ensure_future(coro)
+    tasks.add(task)
+
+    def _done(finished: asyncio.Task) -> None:
+        tasks.discard(finished)
+        if finished.cancelled():
+            return
+        error = finished.exception()
+        if error is not None:
+            logger.error(f"❌ {what} failed: {error}")
+
+    task.add_done_callback(_done)
+    return task